@@ -0,0 +1,376 @@
+from itertools import chain
+import numpy as np
+import pandas as pd
+from catalog import enrich
+from rollups import CATEGORIES, DAILY, FUNNELS, PRODUCTS
+from sketches import ADDED, SOLD, merged_sketch
+
+
+# A date range is a (start, end) pair of datetimes, end exclusive; either side may be None
+def timestamp_match(date_range):
+    # Filter on the raw events' timestamp, stored as BSON dates
+    if date_range is None:
+        return {}
+    start, end = date_range
+    bounds = {}
+    if start is not None:
+        bounds["$gte"] = start
+    if end is not None:
+        bounds["$lt"] = end
+    return {"timestamp": bounds} if bounds else {}
+
+
+def day_match(date_range):
+    # Filter on the rollups' "YYYY-MM-DD" day field
+    if date_range is None:
+        return {}
+    start, end = date_range
+    bounds = {}
+    if start is not None:
+        bounds["$gte"] = start.date().isoformat()
+    if end is not None:
+        bounds["$lt"] = end.date().isoformat()
+    return {"day": bounds} if bounds else {}
+
+
+def with_match(match, pipeline):
+    return ([{"$match": match}] if match else []) + pipeline
+
+
+# Aggregation pipelines, one per dashboard panel. Each returns only the aggregated rows,
+# grouped by product_id; product names and categories are joined from the catalog afterwards.
+# $toDate also accepts ISO string timestamps left over from before `bootstrap.py migrate-timestamps`.
+def order_summary_pipeline():
+    return [
+        {"$group": {"_id": None, "total_orders": {"$sum": 1}, "total_revenue": {"$sum": "$total_price"}}}
+    ]
+
+
+def activity_summary_pipeline():
+    return [
+        {"$group": {"_id": "$product_id", "count": {"$sum": 1}}},
+        {"$group": {"_id": None, "total_activities": {"$sum": "$count"}, "unique_products": {"$sum": 1}}},
+    ]
+
+
+def daily_orders_pipeline():
+    return [
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": {"$toDate": "$timestamp"}, "unit": "day"}},
+            "count": {"$sum": 1},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+
+
+def count_by_pipeline(field):
+    return [
+        {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1, "_id": 1}},
+    ]
+
+
+def top_products_pipeline(n=10):
+    return [
+        {"$unwind": "$cart_items"},
+        {"$group": {"_id": "$cart_items.product_id", "total_quantity": {"$sum": "$cart_items.quantity"}}},
+        {"$sort": {"total_quantity": -1, "_id": 1}},
+        {"$limit": n},
+    ]
+
+
+def flatten_orders(order_df):
+    # One row per cart item with the order columns repeated, indexed like the source order.
+    # Orders with an empty or missing cart keep one row with empty item columns, like explode().
+    # Builds the item columns in one pass instead of a pd.Series per row.
+    if order_df.empty or 'cart_items' not in order_df:
+        return order_df
+    cart_items = [items if isinstance(items, list) and items else [{}] for items in order_df['cart_items']]
+    lengths = np.fromiter((len(items) for items in cart_items), dtype=np.int64, count=len(cart_items))
+    positions = np.repeat(np.arange(len(order_df)), lengths)
+    orders = order_df.drop(columns=['cart_items']).iloc[positions]
+    items = pd.DataFrame.from_records(list(chain.from_iterable(cart_items)), index=orders.index)
+    return pd.concat([orders, items], axis=1)
+
+
+def funnel_summary(db, date_range=None):
+    # Session funnel over the selected days, from the funnels the consumer maintains
+    # (sessions.py) or `spark_job.py` recomputes
+    totals = {"sessions": 0, "carts": 0, "checkouts": 0}
+    for doc in db[FUNNELS].find(day_match(date_range)):
+        for field in totals:
+            totals[field] += doc.get(field, 0)
+    if not totals["sessions"]:
+        return pd.DataFrame(columns=["stage", "count"])
+    return pd.DataFrame({
+        "stage": ["Sessions", "Added to Cart", "Checked Out"],
+        "count": [totals["sessions"], totals["carts"], totals["checkouts"]],
+    })
+
+
+class MongoMetrics:
+    """Dashboard metrics computed server-side with aggregation pipelines."""
+
+    def __init__(self, db, date_range=None):
+        self.activities = db.user_activities
+        self.orders = db.orders
+        self.match = timestamp_match(date_range)
+
+    def _aggregate(self, collection, pipeline):
+        return collection.aggregate(with_match(self.match, pipeline))
+
+    def key_metrics(self):
+        orders = next(self._aggregate(self.orders, order_summary_pipeline()), {})
+        activities = next(self._aggregate(self.activities, activity_summary_pipeline()), {})
+        return {
+            "total_orders": orders.get("total_orders", 0),
+            "total_activities": activities.get("total_activities", 0),
+            "unique_products": activities.get("unique_products", 0),
+            "total_revenue": orders.get("total_revenue", 0),
+        }
+
+    def daily_orders(self):
+        rows = [
+            {"date": row["_id"].date().isoformat(), "count": row["count"]}
+            for row in self._aggregate(self.orders, daily_orders_pipeline())
+        ]
+        return pd.DataFrame(rows, columns=["date", "count"])
+
+    def _product_counts(self):
+        rows = [{"product_id": row["_id"], "count": row["count"]}
+                for row in self._aggregate(self.activities, count_by_pipeline("product_id"))]
+        return enrich(pd.DataFrame(rows, columns=["product_id", "count"]))
+
+    def product_distribution(self):
+        counts = self._product_counts()
+        return counts.reindex(columns=["product_name", "count"])
+
+    def category_distribution(self):
+        counts = self._product_counts()
+        if counts.empty:
+            return pd.DataFrame(columns=["category", "count"])
+        by_category = counts.groupby("category")["count"].sum().sort_values(ascending=False)
+        return pd.DataFrame({"category": by_category.index, "count": by_category.values})
+
+    def top_products(self, n=10):
+        rows = [{"product_id": row["_id"], "total_quantity": row["total_quantity"]}
+                for row in self._aggregate(self.orders, top_products_pipeline(n))]
+        top = enrich(pd.DataFrame(rows, columns=["product_id", "total_quantity"]))
+        return top.reindex(columns=["product_name", "total_quantity"])
+
+    def _recent(self, collection, n):
+        # The n newest events in the range, newest first
+        cursor = collection.find(self.match, {"_id": 0}).sort("timestamp", -1).limit(n)
+        df = pd.DataFrame(list(cursor))
+        if not df.empty:
+            df['timestamp'] = pd.to_datetime(df['timestamp'])
+        return df
+
+    def recent_activities(self, n=10):
+        return enrich(self._recent(self.activities, n))
+
+    def recent_orders(self, n=10):
+        df = self._recent(self.orders, n)
+        if df.empty:
+            return df
+        return enrich(flatten_orders(df))
+
+    def date_bounds(self):
+        # First and last activity day over the whole history, used to build the range picker
+        first = next(self.activities.find({}, {"timestamp": 1}).sort("timestamp", 1).limit(1), None)
+        last = next(self.activities.find({}, {"timestamp": 1}).sort("timestamp", -1).limit(1), None)
+        if first is None:
+            return None
+        return pd.Timestamp(first["timestamp"]).date(), pd.Timestamp(last["timestamp"]).date()
+
+
+class RollupMetrics(MongoMetrics):
+    """Metrics summed from the per-day rollup collections the consumer keeps up to date.
+
+    The rollups keep counting archived days, so with an ArchiveReader the recent tables of a
+    range reaching back past the retention window continue into the archive as well.
+    """
+
+    def __init__(self, db, date_range=None, archive=None):
+        super().__init__(db, date_range)
+        self.daily = db[DAILY]
+        self.products = db[PRODUCTS]
+        self.categories = db[CATEGORIES]
+        self.date_range = date_range
+        self.day_match = day_match(date_range)
+        self.archive = archive
+
+    def _recent(self, collection, n):
+        # Archived events are all older than the hot ones, they only fill up a short hot list
+        df = super()._recent(collection, n)
+        if self.archive is None or len(df) >= n:
+            return df
+        archived = self.archive.latest(collection.name, self.date_range, n - len(df))
+        if archived.empty:
+            return df
+        archived = archived.drop(columns=["_id", "day"], errors="ignore")
+        return archived if df.empty else pd.concat([df, archived], ignore_index=True)
+
+    def _sum_by(self, collection, key, field, extra=None, limit=None):
+        # Sum a counter over the selected days, grouped by key, largest first
+        group = {"_id": f"${key}", field: {"$sum": f"${field}"}}
+        group.update(extra or {})
+        pipeline = [
+            {"$match": {**self.day_match, field: {"$gt": 0}}},
+            {"$group": group},
+            {"$sort": {field: -1, "_id": 1}},
+        ]
+        if limit is not None:
+            pipeline.append({"$limit": limit})
+        return collection.aggregate(pipeline)
+
+    def key_metrics(self):
+        totals = {"orders": 0, "activities": 0, "revenue": 0}
+        for doc in self.daily.find(self.day_match, {"orders": 1, "activities": 1, "revenue": 1}):
+            for field in totals:
+                totals[field] += doc.get(field, 0)
+        return {
+            "total_orders": totals["orders"],
+            "total_activities": totals["activities"],
+            "unique_products": self._unique_products(),
+            "total_revenue": totals["revenue"],
+        }
+
+    def _unique_products(self):
+        return len(list(self._sum_by(self.products, "product_id", "added_to_cart")))
+
+    def daily_orders(self):
+        query = {**self.day_match, "orders": {"$gt": 0}}
+        rows = [{"date": doc["_id"], "count": doc["orders"]}
+                for doc in self.daily.find(query, {"orders": 1}).sort("_id", 1)]
+        return pd.DataFrame(rows, columns=["date", "count"])
+
+    def product_distribution(self):
+        rows = [{"product_name": row["product_name"], "count": row["added_to_cart"]}
+                for row in self._sum_by(self.products, "product_id", "added_to_cart",
+                                        {"product_name": {"$last": "$product_name"}})]
+        return pd.DataFrame(rows, columns=["product_name", "count"])
+
+    def category_distribution(self):
+        rows = [{"category": row["_id"], "count": row["activities"]}
+                for row in self._sum_by(self.categories, "category", "activities")]
+        return pd.DataFrame(rows, columns=["category", "count"])
+
+    def top_products(self, n=10):
+        rows = [{"product_name": row["product_name"], "total_quantity": row["quantity_sold"]}
+                for row in self._sum_by(self.products, "product_id", "quantity_sold",
+                                        {"product_name": {"$last": "$product_name"}}, limit=n)]
+        return pd.DataFrame(rows, columns=["product_name", "total_quantity"])
+
+    def date_bounds(self):
+        days = [doc["_id"] for doc in self.daily.find({"activities": {"$gt": 0}}, {"_id": 1})]
+        if not days:
+            return None
+        return pd.Timestamp(min(days)).date(), pd.Timestamp(max(days)).date()
+
+
+class SketchMetrics(RollupMetrics):
+    """Rollup metrics with the per-product panels read from the day sketches.
+
+    Distinct products and top products cost the same whatever the catalog size: the
+    sketches of the selected days are merged, no per-product document is read. Counts are
+    estimates, see sketches.py for the error bounds.
+    """
+
+    def __init__(self, db, date_range=None, top_n=20, archive=None):
+        super().__init__(db, date_range, archive)
+        self.db = db
+        self.top_n = top_n  # Products shown in the distribution, the rest are summed as "Other"
+        self._sketches = {}
+
+    def _sketch(self, name):
+        if name not in self._sketches:
+            self._sketches[name] = merged_sketch(self.db, name, self.day_match)
+        return self._sketches[name]
+
+    def _top(self, name, n, column):
+        rows = [{"product_id": key, column: count} for key, count in self._sketch(name).top(n) if count]
+        top = enrich(pd.DataFrame(rows, columns=["product_id", column]))
+        return top.reindex(columns=["product_name", column])
+
+    def _unique_products(self):
+        return self._sketch(ADDED).distinct()
+
+    def product_distribution(self):
+        top = self._top(ADDED, self.top_n, "count")
+        other = self._sketch(ADDED).total - top["count"].sum()
+        if other > 0:
+            top = pd.concat([top, pd.DataFrame({"product_name": ["Other"], "count": [other]})], ignore_index=True)
+        return top
+
+    def top_products(self, n=10):
+        return self._top(SOLD, n, "total_quantity")
+
+
+class PandasMetrics:
+    """The same metrics computed client-side from fully loaded DataFrames."""
+
+    def __init__(self, activity_df, order_df):
+        self.activity_df = enrich(activity_df)
+        self.order_df = order_df
+        self._order_items = None
+
+    @property
+    def order_items(self):
+        # Flattened once per data load and shared by the panels that need line items
+        if self._order_items is None:
+            self._order_items = enrich(flatten_orders(self.order_df))
+        return self._order_items
+
+    def key_metrics(self):
+        return {
+            "total_orders": len(self.order_df),
+            "total_activities": len(self.activity_df),
+            "unique_products": self.activity_df['product_id'].nunique() if not self.activity_df.empty else 0,
+            "total_revenue": self.order_df['total_price'].sum() if not self.order_df.empty else 0,
+        }
+
+    def daily_orders(self):
+        if self.order_df.empty:
+            return pd.DataFrame(columns=["date", "count"])
+        daily_orders = self.order_df.groupby(self.order_df['timestamp'].dt.date).size().reset_index()
+        daily_orders.columns = ['date', 'count']
+        daily_orders['date'] = daily_orders['date'].astype(str)
+        return daily_orders
+
+    def _count_by(self, field):
+        if self.activity_df.empty:
+            return pd.DataFrame(columns=[field, "count"])
+        counts = self.activity_df[field].value_counts()
+        return pd.DataFrame({field: counts.index, "count": counts.values})
+
+    def product_distribution(self):
+        return self._count_by('product_name')
+
+    def category_distribution(self):
+        return self._count_by('category')
+
+    def top_products(self, n=10):
+        if self.order_df.empty:
+            return pd.DataFrame(columns=["product_name", "total_quantity"])
+        top_products = self.order_items.groupby('product_name')['quantity'].sum().sort_values(ascending=False).head(n)
+        top_products = top_products.astype("int64")  # Orders with empty carts leave NaN quantities
+        top_products_df = pd.DataFrame(top_products).reset_index()
+        top_products_df.columns = ['product_name', 'total_quantity']
+        return top_products_df
+
+    def recent_activities(self, n=10):
+        if self.activity_df.empty:
+            return self.activity_df
+        return self.activity_df.sort_values('timestamp', ascending=False).head(n)
+
+    def recent_orders(self, n=10):
+        if self.order_df.empty:
+            return self.order_df
+        recent = self.order_df.sort_values('timestamp', ascending=False).head(n)
+        return self.order_items.loc[recent.index]
+
+    def date_bounds(self):
+        if self.activity_df.empty:
+            return None
+        return self.activity_df['timestamp'].min().date(), self.activity_df['timestamp'].max().date()
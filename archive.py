@@ -0,0 +1,220 @@
+import os
+import sys
+import uuid
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Cold storage for raw events: <ARCHIVE_DIR>/<collection>/day=YYYY-MM-DD/part-*.parquet, zstd.
+# Events move here once they are older than the retention window; the rollups keep their counters.
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+RETENTION_DAYS = int(os.getenv("ARCHIVE_RETENTION_DAYS", 30))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 50000))
+
+CART_ITEM = pa.struct([
+    ("product_id", pa.int64()),
+    ("quantity", pa.int64()),
+    ("price", pa.float64()),
+    ("product_name", pa.string()),  # Only on events written before schema 2
+])
+
+# Fields not listed here are dropped when archiving
+SCHEMAS = {
+    "user_activities": pa.schema([
+        ("_id", pa.string()),
+        ("event_type", pa.string()),
+        ("session_id", pa.string()),
+        ("product_id", pa.int64()),
+        ("price", pa.float64()),
+        ("timestamp", pa.timestamp("us")),
+        ("ingested_at", pa.timestamp("us")),
+        ("product_name", pa.string()),
+        ("category", pa.string()),
+    ]),
+    "orders": pa.schema([
+        ("_id", pa.string()),
+        ("event_type", pa.string()),
+        ("session_id", pa.string()),
+        ("timestamp", pa.timestamp("us")),
+        ("ingested_at", pa.timestamp("us")),
+        ("cart_items", pa.list_(CART_ITEM)),
+        ("total_price", pa.float64()),
+    ]),
+}
+PARTITIONING = ds.partitioning(pa.schema([("day", pa.string())]), flavor="hive")
+
+
+def retention_cutoff(retention_days=RETENTION_DAYS, now=None):
+    # Midnight starting the oldest day still kept in MongoDB, so archived days are complete
+    today = (now or datetime.utcnow()).date()
+    return datetime.combine(today - timedelta(days=retention_days), time.min)
+
+
+def write_day(root, name, day, docs):
+    # One new file per day and batch, written under a name the dataset scan skips until renamed
+    directory = os.path.join(root, name, f"day={day}")
+    os.makedirs(directory, exist_ok=True)
+    table = pa.Table.from_pylist(docs, schema=SCHEMAS[name])
+    part = uuid.uuid4().hex
+    tmp_path = os.path.join(directory, f".part-{part}.parquet")
+    pq.write_table(table, tmp_path, compression="zstd")
+    os.replace(tmp_path, os.path.join(directory, f"part-{part}.parquet"))
+
+
+def archive_collection(collection, root=ARCHIVE_DIR, cutoff=None, batch_size=ARCHIVE_BATCH_SIZE):
+    # Move events older than `cutoff` into the archive, oldest first. Documents are deleted only
+    # after their file is in place; a crash in between leaves copies the readers drop by _id.
+    cutoff = cutoff or retention_cutoff()
+    query = {"timestamp": {"$lt": cutoff}}
+    moved = 0
+    while True:
+        docs = list(collection.find(query).sort("timestamp", 1).limit(batch_size))
+        if not docs:
+            return moved
+        ids = [doc["_id"] for doc in docs]
+        by_day = defaultdict(list)
+        for doc in docs:
+            doc["_id"] = str(doc["_id"])  # ObjectIds of documents written before event ids
+            by_day[doc["timestamp"].date().isoformat()].append(doc)
+        for day, day_docs in by_day.items():
+            write_day(root, collection.name, day, day_docs)
+        collection.delete_many({"_id": {"$in": ids}})
+        moved += len(docs)
+        print(f"Archived {moved} events from {collection.name}")
+
+
+def arrow_frame(table):
+    # Arrow table of events to a DataFrame, cart_items as lists of dicts like stored documents
+    if "cart_items" not in table.column_names:
+        return table.to_pandas()
+    cart_items = table.column("cart_items").to_pylist()
+    df = table.drop_columns(["cart_items"]).to_pandas()
+    df["cart_items"] = [items or [] for items in cart_items]
+    return df
+
+
+class ArchiveReader:
+    """Scans of the archived events with the date range pushed down to the partitions and row groups."""
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+
+    def dataset(self, name):
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(path):
+            return None
+        return ds.dataset(path, format="parquet", partitioning=PARTITIONING, schema=self._schema(name))
+
+    def _schema(self, name):
+        return SCHEMAS[name].append(pa.field("day", pa.string()))
+
+    def _filter(self, date_range):
+        # Day bounds prune whole partitions, timestamp bounds skip row groups through their statistics
+        if date_range is None:
+            return None
+        start, end = date_range
+        bounds = []
+        if start is not None:
+            bounds.append(ds.field("day") >= start.date().isoformat())
+            bounds.append(ds.field("timestamp") >= pa.scalar(start, pa.timestamp("us")))
+        if end is not None:
+            bounds.append(ds.field("day") <= end.date().isoformat())
+            bounds.append(ds.field("timestamp") < pa.scalar(end, pa.timestamp("us")))
+        expression = None
+        for bound in bounds:
+            expression = bound if expression is None else expression & bound
+        return expression
+
+    def scan(self, name, date_range=None, columns=None):
+        # Arrow table of the archived events in the range, None when nothing is archived
+        dataset = self.dataset(name)
+        if dataset is None:
+            return None
+        columns = columns or SCHEMAS[name].names
+        return dataset.to_table(columns=columns, filter=self._filter(date_range))
+
+    def read(self, name, date_range=None, columns=None):
+        # DataFrame shaped like the loader's frames
+        table = self.scan(name, date_range, columns)
+        if table is None or table.num_rows == 0:
+            return pd.DataFrame()
+        return arrow_frame(table).drop_duplicates("_id", ignore_index=True)
+
+    def latest(self, name, date_range=None, n=10):
+        # The n newest archived events in the range, newest first, reading one day partition at
+        # a time from the newest until enough are found
+        dataset = self.dataset(name)
+        if dataset is None:
+            return pd.DataFrame()
+        start, end = date_range or (None, None)
+        frames, found = [], 0
+        for day in reversed(self.days(name)):
+            day_start = datetime.fromisoformat(day)
+            day_range = (max(day_start, start) if start else day_start,
+                         min(day_start + timedelta(days=1), end) if end else day_start + timedelta(days=1))
+            if day_range[0] >= day_range[1]:
+                continue
+            table = dataset.to_table(columns=SCHEMAS[name].names, filter=self._filter(day_range))
+            if table.num_rows:
+                frames.append(arrow_frame(table))
+                found += table.num_rows
+            if found >= n:
+                break
+        if not frames:
+            return pd.DataFrame()
+        df = pd.concat(frames, ignore_index=True).drop_duplicates("_id")
+        return df.sort_values("timestamp", ascending=False).head(n).reset_index(drop=True)
+
+    def batches(self, name, batch_size=10000):
+        # Archived events as lists of dicts, for recomputing the rollups
+        dataset = self.dataset(name)
+        if dataset is None:
+            return
+        for batch in dataset.to_batches(columns=SCHEMAS[name].names, batch_size=batch_size):
+            yield batch.to_pylist()
+
+    def days(self, name):
+        # Archived days, from the partition directory names without opening any file
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(path):
+            return []
+        return sorted(entry[4:] for entry in os.listdir(path) if entry.startswith("day="))
+
+
+def stats(root=ARCHIVE_DIR):
+    reader = ArchiveReader(root)
+    for name in SCHEMAS:
+        dataset = reader.dataset(name)
+        if dataset is None:
+            print(f"{name}: nothing archived")
+            continue
+        days = reader.days(name)
+        size = sum(os.path.getsize(path) for path in dataset.files)
+        print(f"{name}: {dataset.count_rows()} events, {len(days)} days ({days[0]} to {days[-1]}), "
+              f"{len(dataset.files)} files, {size / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo.mongo_client import MongoClient
+    from pymongo.server_api import ServerApi
+
+    load_dotenv()
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "run":
+        client = MongoClient(os.getenv("MONGODB_URL"), server_api=ServerApi('1'))
+        db = client[os.getenv('DB')]
+        cutoff = retention_cutoff()
+        print(f"Archiving events before {cutoff.date()} to {ARCHIVE_DIR}")
+        for name in SCHEMAS:
+            archive_collection(db[name], ARCHIVE_DIR, cutoff)
+        client.close()
+    elif command == "stats":
+        stats()
+    else:
+        print("Usage: python archive.py [run|stats]")
+        sys.exit(2)
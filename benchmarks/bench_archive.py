@@ -0,0 +1,53 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import bson
+
+from fakes import random_events
+from archive import ArchiveReader, write_day
+
+N_EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+DAYS = 90
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+if __name__ == "__main__":
+    # Documents as the consumer stores them, grouped the way archive_collection writes them
+    by_day = {"user_activities": defaultdict(list), "orders": defaultdict(list)}
+    for i, event in enumerate(random_events(N_EVENTS, days=DAYS)):
+        event["_id"] = f"event-{i}"
+        event["timestamp"] = event["ingested_at"] = datetime.fromisoformat(event["timestamp"])
+        name = "user_activities" if event["event_type"] == "add_to_cart" else "orders"
+        by_day[name][event["timestamp"].date().isoformat()].append(event)
+
+    root = tempfile.mkdtemp(prefix="bench_archive_")
+    try:
+        print(f"{N_EVENTS} events over {DAYS} days")
+        reader = ArchiveReader(root)
+        for name, days in by_day.items():
+            bson_bytes = sum(len(bson.encode(doc)) for docs in days.values() for doc in docs)
+            for day, docs in days.items():
+                write_day(root, name, day, docs)
+            files = reader.dataset(name).files
+            parquet_bytes = sum(os.path.getsize(path) for path in files)
+            print(f"{name:<16} BSON {bson_bytes / 1e6:6.2f} MB -> Parquet/zstd {parquet_bytes / 1e6:6.2f} MB "
+                  f"in {len(files)} day partitions")
+
+        # A one-week range only opens 7 partitions, a full scan opens them all
+        end = datetime.utcnow() - timedelta(days=30)
+        week = (end - timedelta(days=7), end)
+        for label, date_range in (("one week", week), ("everything", None)):
+            df, elapsed = timed(reader.read, "orders", date_range)
+            print(f"orders, {label:<10} {len(df):>7} rows in {elapsed:7.1f}ms")
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,71 @@
+import json
+import time
+from datetime import datetime
+
+import bson
+import pandas as pd
+
+from fakes import FakeMessage
+from catalog import enrich, lookup
+from consumer import to_document
+from load_generator import SessionGenerator
+from serializers import JsonSerializer, SchemaMsgpackSerializer, msgpack
+
+N_EVENTS = 50000
+ENRICH_ROWS = 1_000_000
+
+
+def denormalized(event):
+    # The event as emitted before it was slimmed, with names and categories copied in
+    event = dict(event)
+    if event["event_type"] == "add_to_cart":
+        product = lookup(event["product_id"])
+        event["product_name"], event["category"] = product["name"], product["category"]
+    else:
+        event["cart_items"] = [dict(item, product_name=lookup(item["product_id"])["name"])
+                               for item in event["cart_items"]]
+    return event
+
+
+def stored(event):
+    # The MongoDB document the consumer writes for an event, stamped as the sink does
+    doc = to_document(FakeMessage(json.dumps(event).encode("utf-8")))
+    doc["ingested_at"] = datetime.utcnow()
+    return doc
+
+
+def mean_size(sizes):
+    sizes = list(sizes)
+    return sum(sizes) / len(sizes)
+
+
+def sizes(events, msgpack_version):
+    result = {
+        "json": mean_size(len(JsonSerializer().encode(event)[0]) for event in events),
+        "bson": mean_size(len(bson.encode(stored(event))) for event in events),
+    }
+    if msgpack is not None:
+        serializer = SchemaMsgpackSerializer(msgpack_version)
+        result["msgpack"] = mean_size(len(serializer.encode(event)[0]) for event in events)
+    return result
+
+
+if __name__ == "__main__":
+    generator = SessionGenerator(seed=0).events()
+    slim = [next(generator)[1] for _ in range(N_EVENTS)]
+    full = [denormalized(event) for event in slim]
+
+    print(f"{N_EVENTS} storefront events, mean bytes per event")
+    before, after = sizes(full, "1"), sizes(slim, "2")
+    for name in before:
+        saving = 1 - after[name] / before[name]
+        print(f"{name:<8} {before[name]:7.1f} -> {after[name]:7.1f}  ({saving:.0%} smaller)")
+
+    # Cost of joining the names back on the dashboard side
+    ids = pd.Series([event["product_id"] for event in slim if "product_id" in event])
+    activity_df = pd.DataFrame({"product_id": ids.sample(ENRICH_ROWS, replace=True, random_state=0).values})
+    start = time.perf_counter()
+    enriched = enrich(activity_df)
+    elapsed = time.perf_counter() - start
+    assert enriched["product_name"].notna().all()
+    print(f"enrich {ENRICH_ROWS:,} activity rows: {elapsed * 1000:.1f}ms")
@@ -0,0 +1,35 @@
+import contextlib
+import io
+import time
+
+import mongomock
+
+from fakes import FakeConsumer, SlowCollection, sample_messages
+import consumer
+from sink import BatchSink
+
+N_EVENTS = 10000
+RTT_MS = 0.5  # Simulated network round-trip per MongoDB call
+
+
+def bench(batch_size, messages):
+    db = mongomock.MongoClient().db
+    fake = FakeConsumer(messages)
+    sink = BatchSink(
+        {"add_to_cart": SlowCollection(db.user_activities, RTT_MS), "checkout": SlowCollection(db.orders, RTT_MS)},
+        batch_size=batch_size,
+        linger_ms=1000,
+    )
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        consumer.run(fake, sink, should_stop=lambda: fake.exhausted)
+    elapsed = time.perf_counter() - start
+    assert db.user_activities.count_documents({}) + db.orders.count_documents({}) == len(messages)
+    return len(messages) / elapsed
+
+
+if __name__ == "__main__":
+    messages = sample_messages(N_EVENTS)
+    print(f"{N_EVENTS} events against mongomock with {RTT_MS}ms simulated round-trip")
+    for batch_size in (1, 100, 1000):
+        print(f"batch_size={batch_size:>5}: {bench(batch_size, messages):>10,.0f} events/sec")
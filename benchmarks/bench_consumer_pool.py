@@ -0,0 +1,98 @@
+import contextlib
+import functools
+import io
+import time
+
+import mongomock
+
+from fakes import FakeConsumer, FakeGroup, FakeGroupConsumer, SlowCollection, partitioned_messages, sample_messages
+import consumer
+from consumer_pool import ConsumerPool
+from sink import BatchSink
+
+N_EVENTS = 40000
+PARTITIONS = 4
+RTT_MS = 5  # Simulated MongoDB round-trip, the pool overlaps these across workers
+BATCH_SIZE = 100
+
+
+def fake_resources(pool_size, index):
+    # Worker `index` of the pool reads every message of its share of the partitions. Passed to
+    # the pool bound to its size, so it pickles for workers started with spawn as well as fork.
+    messages = [m for i, m in enumerate(sample_messages(N_EVENTS)) if i % PARTITIONS % pool_size == index]
+    db = mongomock.MongoClient().db
+    sink = BatchSink(
+        {"add_to_cart": SlowCollection(db.user_activities, RTT_MS), "checkout": SlowCollection(db.orders, RTT_MS)},
+        batch_size=BATCH_SIZE,
+    )
+    return FakeConsumer(messages), sink, lambda: None
+
+
+def bench(n_workers):
+    pool = ConsumerPool(n_workers, resources=functools.partial(fake_resources, n_workers))
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        pool.start()
+        while pool.written.value < N_EVENTS:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        pool.shutdown()
+    return N_EVENTS / elapsed, pool.written.value
+
+
+def rebalance(n_events=N_EVENTS // 4, flush_on_revoke=True):
+    # Two workers of one group in this process, sharing one database. The first is assigned
+    # every partition and buffers events from them, then the second joins and the group
+    # rebalances. Returns the messages delivered to either worker and the events stored.
+    group = FakeGroup(partitioned_messages(n_events, PARTITIONS))
+    db = mongomock.MongoClient().db
+    collections = {"add_to_cart": db.user_activities, "checkout": db.orders}
+    members = []
+
+    def join():
+        fake = FakeGroupConsumer(group)
+        sink = BatchSink(collections, batch_size=BATCH_SIZE, linger_ms=60000)
+        members.append((fake, sink))
+        if flush_on_revoke:
+            consumer.subscribe(fake, sink)
+        else:
+            fake.subscribe([consumer.topic])
+
+    join()
+    first, first_sink = members[0]
+    for _ in range(3):
+        consumer.handle_messages(first.consume(BATCH_SIZE // 2), first_sink)
+    assert first_sink.pending
+    join()
+    while True:
+        consumed = 0
+        for fake, sink in members:
+            msgs = fake.consume(BATCH_SIZE)
+            consumed += len(msgs)
+            consumer.handle_messages(msgs, sink)
+            if sink.should_flush():
+                consumer.flush_and_commit(fake, sink)
+        if not consumed:
+            break
+    for fake, sink in members:
+        consumer.drain(fake, sink)
+    assert group.exhausted
+    return group.delivered, db.user_activities.count_documents({}) + db.orders.count_documents({})
+
+
+if __name__ == "__main__":
+    print(f"{N_EVENTS} events over {PARTITIONS} partitions, {RTT_MS}ms simulated MongoDB round-trip")
+    for n_workers in (1, 2, 4):
+        rate, written = bench(n_workers)
+        print(f"{n_workers} workers: {rate:>10,.0f} events/sec")
+        assert written == N_EVENTS, written
+
+    n_events = N_EVENTS // 4
+    print(f"rebalance: a second worker joins while the first has {3 * BATCH_SIZE // 2} events buffered")
+    for flush_on_revoke in (False, True):
+        delivered, stored = rebalance(n_events, flush_on_revoke)
+        label = "flush and commit on revoke" if flush_on_revoke else "no revoke callback"
+        print(f"  {label:<28} {delivered:,} messages delivered, {delivered - n_events:,} redelivered, "
+              f"{stored:,}/{n_events:,} stored")
+        assert stored == n_events
+    assert delivered == n_events
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+
+import pandas as pd
+
+from fakes import load_database, random_events
+from analytics import MongoMetrics, PandasMetrics
+
+N_EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+# Aggregation pipelines need a real server; mongomock lacks $dateTrunc/$toDate
+MONGODB_URL = os.getenv("BENCH_MONGODB_URL")
+
+
+def render(metrics):
+    # Everything a dashboard page load asks for
+    return {
+        "key_metrics": metrics.key_metrics(),
+        "daily_orders": metrics.daily_orders(),
+        "product_distribution": metrics.product_distribution(),
+        "category_distribution": metrics.category_distribution(),
+        "top_products": metrics.top_products(10),
+        "recent_activities": metrics.recent_activities(10),
+        "recent_orders": metrics.recent_orders(10),
+    }
+
+
+def pandas_page(db):
+    # The previous get_data(): load both collections, then compute in pandas
+    activity_df = pd.DataFrame(list(db.user_activities.find({}, {'_id': 0})))
+    order_df = pd.DataFrame(list(db.orders.find({}, {'_id': 0})))
+    activity_df['timestamp'] = pd.to_datetime(activity_df['timestamp'])
+    order_df['timestamp'] = pd.to_datetime(order_df['timestamp'])
+    return render(PandasMetrics(activity_df, order_df))
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    events = random_events(N_EVENTS)
+    if MONGODB_URL:
+        from pymongo import MongoClient
+        db = MongoClient(MONGODB_URL).bench_dashboard_metrics
+        db.user_activities.drop()
+        db.orders.drop()
+        load_database(events, db)
+    else:
+        db = load_database(events)
+    print(f"{N_EVENTS} events, {'MongoDB at ' + MONGODB_URL if MONGODB_URL else 'mongomock'}")
+
+    pandas_result, pandas_time = timed(pandas_page, db)
+    print(f"pandas:      {pandas_time * 1000:8.1f}ms per page load")
+
+    if MONGODB_URL:
+        mongo_result, mongo_time = timed(render, MongoMetrics(db))
+        print(f"aggregation: {mongo_time * 1000:8.1f}ms per page load")
+        assert mongo_result["key_metrics"]["total_orders"] == pandas_result["key_metrics"]["total_orders"]
+        assert mongo_result["daily_orders"]["count"].tolist() == pandas_result["daily_orders"]["count"].tolist()
+    else:
+        print("aggregation: skipped, set BENCH_MONGODB_URL to a mongod to compare")
@@ -0,0 +1,141 @@
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import mongomock
+from pymongo.errors import AutoReconnect
+
+from fakes import FakeConsumer, FakeMessage, SlowCollection, sample_messages
+import consumer
+from dlq import FileDLQ, MemoryDLQ, RetryWorker, read_dead_letters
+from serializers import CONTENT_TYPE, msgpack
+from sink import BatchSink
+
+N_EVENTS = 20000
+BATCH_SIZE = 500
+RTT_MS = 0.5  # Simulated network round-trip per MongoDB call
+FAILURE_RATE = 0.05
+FAILURE_MS = 20  # What a failed write costs before the error surfaces
+
+
+class FlakyCollection(SlowCollection):
+    # insert_many fails with a transient error at `rate`, after waiting `failure_ms`
+    def __init__(self, collection, rate, rng, rtt_ms=RTT_MS, failure_ms=FAILURE_MS):
+        super().__init__(collection, rtt_ms)
+        self.rate = rate
+        self.rng = rng
+        self.failure = failure_ms / 1000.0
+
+    def insert_many(self, docs, ordered=True):
+        if self.rng.random() < self.rate:
+            time.sleep(self.failure)
+            raise AutoReconnect("simulated connection reset")
+        time.sleep(self.rtt)
+        return self.collection.insert_many(docs, ordered=ordered)
+
+
+# Undecodable bytes, then payloads that decode but are not events
+MSGPACK = [(CONTENT_TYPE, b"msgpack")]
+POISON = [(b"\xff not an event", None), (b"123", None), (b"[1, 2]", None), (b'{"event_type": [1]}', None)]
+if msgpack is not None:
+    POISON += [(msgpack.packb(7), MSGPACK), (msgpack.packb(["x"]), MSGPACK), (msgpack.packb([]), MSGPACK)]
+
+
+def poison(messages, rate, payloads=POISON, seed=0):
+    # Replace `rate` of the messages with the poison payloads, in turn
+    rng = random.Random(seed)
+    bad = sorted(rng.sample(range(len(messages)), int(len(messages) * rate)))
+    poisoned = list(messages)
+    for n, i in enumerate(bad):
+        value, headers = payloads[n % len(payloads)]
+        poisoned[i] = FakeMessage(value, offset=messages[i].offset(), headers=headers)
+    return poisoned, len(bad)
+
+
+def bench(messages, write_failure_rate=0.0, retry=True):
+    db = mongomock.MongoClient().db
+    rng = random.Random(1)
+    collections = {
+        "add_to_cart": FlakyCollection(db.user_activities, write_failure_rate, rng),
+        "checkout": FlakyCollection(db.orders, write_failure_rate, rng),
+    }
+    root = tempfile.mkdtemp(prefix="bench_dlq_")
+    dlq = FileDLQ(os.path.join(root, "dlq.jsonl"))
+    retries = None
+    if retry:
+        retries = RetryWorker(BatchSink(collections, dlq=dlq), dlq, base_delay=0.05, max_delay=1)
+    sink = BatchSink(collections, batch_size=BATCH_SIZE, dlq=dlq, retries=retries, retry_base_delay=0.05,
+                     retry_max_delay=1)
+    fake = FakeConsumer(messages)
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            consumer.run(fake, sink, should_stop=lambda: fake.exhausted)
+        elapsed = time.perf_counter() - start
+        with contextlib.redirect_stdout(io.StringIO()):
+            sink.close()  # Outside the timing: drains the retries still waiting
+        stored = db.user_activities.count_documents({}) + db.orders.count_documents({})
+        return len(messages) / elapsed, stored, len(read_dead_letters(dlq.path)), retries
+    finally:
+        shutil.rmtree(root)
+
+
+def outage(messages, seconds=3.0, max_pending=5000, drain_seconds=0.5):
+    # MongoDB down and no retry worker: the consumer must stop polling at the cap and back off
+    # between attempts instead of buffering every message and hammering the server. On shutdown
+    # the buffer is retried for `drain_seconds`, then dead-lettered and committed, not dropped.
+    db = mongomock.MongoClient().db
+    collections = {
+        "add_to_cart": FlakyCollection(db.user_activities, 1.0, random.Random(0), failure_ms=0),
+        "checkout": FlakyCollection(db.orders, 1.0, random.Random(0), failure_ms=0),
+    }
+    attempts = []
+    for collection in collections.values():
+        insert_many = collection.insert_many
+        collection.insert_many = lambda docs, ordered=True, insert_many=insert_many: (
+            attempts.append(time.monotonic()), insert_many(docs, ordered))[1]
+    dlq = MemoryDLQ()
+    sink = BatchSink(collections, batch_size=BATCH_SIZE, max_pending=max_pending, dlq=dlq, retry_base_delay=0.1,
+                     retry_max_delay=1)
+    fake = FakeConsumer(messages)
+    deadline = time.monotonic() + seconds
+    buffered = []
+
+    def should_stop():
+        if time.monotonic() < deadline:
+            return False
+        buffered.append(sink.pending)
+        return True
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        consumer.run(fake, sink, should_stop=should_stop, drain_timeout=drain_seconds)
+    return buffered[0], fake.position, fake.committed, len(dlq.records), sink.pending, len(attempts)
+
+
+if __name__ == "__main__":
+    messages = sample_messages(N_EVENTS)
+    poisoned, n_bad = poison(messages, FAILURE_RATE)
+    print(f"{N_EVENTS} events against mongomock with {RTT_MS}ms simulated round-trip, batches of {BATCH_SIZE}")
+    scenarios = [
+        ("no failures", messages, 0.0, True),
+        (f"{FAILURE_RATE:.0%} malformed messages", poisoned, 0.0, True),
+        (f"{FAILURE_RATE:.0%} failed writes, retried inline", messages, FAILURE_RATE, False),
+        (f"{FAILURE_RATE:.0%} failed writes, retry worker", messages, FAILURE_RATE, True),
+    ]
+    for label, msgs, write_failure_rate, retry in scenarios:
+        rate, stored, dead, retries = bench(msgs, write_failure_rate, retry)
+        good = len(msgs) - (n_bad if msgs is poisoned else 0)
+        retried = f"  retry batches {dict(retries.stats)}" if retries and retries.stats else ""
+        print(f"{label:<38} {rate:>9,.0f} events/sec   stored {stored}/{good}   dead letters {dead}{retried}")
+        assert stored == good
+        assert dead == (n_bad if msgs is poisoned else 0)
+
+    buffered, consumed, committed, dead, pending, attempts = outage(messages)
+    print(f"MongoDB down for 3s, no retry worker: {buffered} events buffered (cap 5000), {attempts} insert attempts; "
+          f"on shutdown {dead} dead-lettered, {committed}/{consumed} committed")
+    assert buffered < 5000 + BATCH_SIZE
+    assert pending == 0 and dead == consumed and committed == consumed
@@ -0,0 +1,48 @@
+import json
+import statistics
+import time
+
+from fakes import FakeProducer, sample_events
+from emitter import EventEmitter
+
+N_CLICKS = 200
+BROKER_RTT_MS = 20  # Simulated produce + flush round-trip
+
+
+def blocking_handler(producer, event):
+    # The previous log_activity body: produce then flush on every click
+    producer.produce("events", key=str(event.get("product_id")), value=json.dumps(event))
+    producer.flush(timeout=10)
+
+
+def emitter_handler(emitter, event):
+    emitter.emit(str(event.get("product_id")), event)
+
+
+def timings(handler, target, events):
+    samples = []
+    for event in events:
+        start = time.perf_counter()
+        handler(target, event)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    p50 = statistics.median(samples)
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    print(f"{name:<10} p50={p50:8.3f}ms  p99={p99:8.3f}ms")
+
+
+if __name__ == "__main__":
+    events = sample_events(N_CLICKS)
+    print(f"{N_CLICKS} click handlers, {BROKER_RTT_MS}ms simulated broker round-trip")
+
+    report("blocking", timings(blocking_handler, FakeProducer(BROKER_RTT_MS), events))
+
+    producer = FakeProducer(BROKER_RTT_MS)
+    emitter = EventEmitter(producer, "events")
+    report("emitter", timings(emitter_handler, emitter, events))
+    emitter.close()
+    assert len(producer.produced) == N_CLICKS
@@ -0,0 +1,45 @@
+import os
+import time
+
+import pandas as pd
+
+from fakes import random_events
+from analytics import flatten_orders
+
+# The row-wise path takes minutes at 1M line items, set BENCH_FULL=1 to include it
+FULL = os.getenv("BENCH_FULL") == "1"
+
+
+def explode_apply(order_df):
+    # The previous flattening used by "Top Selling Products" and "Recent Orders"
+    order_items = order_df.explode('cart_items')
+    return pd.concat([order_items.drop(['cart_items'], axis=1), order_items['cart_items'].apply(pd.Series)], axis=1)
+
+
+def order_frame(n_items):
+    # Checkout events averaging two line items each
+    orders = []
+    for event in random_events(n_items * 3):
+        if event["event_type"] == "checkout":
+            orders.append(event)
+            n_items -= len(event["cart_items"])
+            if n_items <= 0:
+                break
+    return pd.DataFrame(orders)
+
+
+def timed(fn, df):
+    start = time.perf_counter()
+    fn(df)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    for n_items in (10_000, 100_000, 1_000_000):
+        order_df = order_frame(n_items)
+        vectorized = timed(flatten_orders, order_df)
+        if n_items <= 100_000 or FULL:
+            row_wise = f"{timed(explode_apply, order_df) * 1000:9.1f}ms"
+        else:
+            row_wise = "  skipped"
+        print(f"{n_items:>9,} line items: explode+apply {row_wise}   vectorized {vectorized * 1000:8.1f}ms")
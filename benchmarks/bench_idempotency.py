@@ -0,0 +1,48 @@
+import contextlib
+import io
+import time
+
+import mongomock
+
+from fakes import SlowCollection, sample_events
+from sink import BatchSink
+
+N_EVENTS = 20000
+BATCH_SIZE = 500
+RTT_MS = 0.5  # Simulated network round-trip per MongoDB call
+
+
+def write_all(sink, events):
+    for event in events:
+        sink.add(dict(event))
+        if sink.should_flush():
+            sink.flush()
+    sink.flush()
+
+
+def bench(events, replays=1):
+    db = mongomock.MongoClient().db
+    sink = BatchSink(
+        {"add_to_cart": SlowCollection(db.user_activities, RTT_MS), "checkout": SlowCollection(db.orders, RTT_MS)},
+        batch_size=BATCH_SIZE,
+    )
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(replays):
+            write_all(sink, events)
+    elapsed = time.perf_counter() - start
+    stored = db.user_activities.count_documents({}) + db.orders.count_documents({})
+    return len(events) * replays / elapsed, stored
+
+
+if __name__ == "__main__":
+    events = sample_events(N_EVENTS)
+    # What consumer.handle_messages assigns: the producer's event_id or the message coordinates
+    keyed = [dict(event, _id=f"events-0-{offset}") for offset, event in enumerate(events)]
+    print(f"{N_EVENTS} events, batch_size={BATCH_SIZE}, {RTT_MS}ms simulated round-trip")
+    rate, stored = bench(events)
+    print(f"server-assigned _id:       {rate:>10,.0f} events/sec, {stored} documents")
+    rate, stored = bench(keyed)
+    print(f"deterministic _id:         {rate:>10,.0f} events/sec, {stored} documents")
+    rate, stored = bench(keyed, replays=2)
+    print(f"deterministic _id, replay: {rate:>10,.0f} events/sec, {stored} documents")
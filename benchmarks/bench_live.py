@@ -0,0 +1,30 @@
+import time
+
+from fakes import random_events
+from live import LiveAggregates
+
+NEW_EVENTS = 1000
+
+
+def refresh(aggregates):
+    # What one live refresh reads
+    aggregates.key_metrics()
+    aggregates.timeline()
+    aggregates.top_products(10)
+    aggregates.recent()
+
+
+if __name__ == "__main__":
+    new = [dict(event, _id=f"new-{i}") for i, event in enumerate(random_events(NEW_EVENTS, days=0.01, seed=1))]
+    for history in (10_000, 100_000, 1_000_000):
+        aggregates = LiveAggregates()
+        aggregates.apply(dict(event, _id=i) for i, event in enumerate(random_events(history, days=0.04)))
+
+        start = time.perf_counter()
+        aggregates.apply(new)
+        apply_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        refresh(aggregates)
+        refresh_ms = (time.perf_counter() - start) * 1000
+        print(f"{history:>9,} events of history: apply {NEW_EVENTS} new {apply_ms:6.2f}ms   refresh {refresh_ms:6.3f}ms")
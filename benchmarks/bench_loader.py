@@ -0,0 +1,110 @@
+import gc
+import resource
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import bson
+from pymongo import MongoClient
+from pymongo.collection import Collection
+
+from fakes import random_events
+import loader
+
+N_EVENTS = int(sys.argv[-1]) if sys.argv[-1].isdigit() else 1_000_000
+CHUNK = 50000
+APPROACHES = ("list", "batches", "arrow")
+
+
+class ServedCollection(Collection):
+    # A pymongo Collection answering find() and find_raw_batches() from pre-encoded BSON in
+    # place of a server, so each reader pays the same decoding as against a real one, minus the
+    # network. Queries and projections are not applied: the stored documents only carry the
+    # fields the consumer writes, all of which the loader keeps.
+    def __init__(self, name, encoded):
+        super().__init__(MongoClient(connect=False).db, name)
+        self.encoded = encoded
+
+    def _batches(self, batch_size):
+        batch_size = batch_size or 101
+        for i in range(0, len(self.encoded), batch_size):
+            yield b"".join(self.encoded[i:i + batch_size])
+
+    def find(self, *args, **kwargs):
+        return ServedCursor(self)
+
+    def find_raw_batches(self, *args, batch_size=0, **kwargs):
+        return self._batches(batch_size)
+
+
+class ServedCursor:
+    def __init__(self, collection):
+        self.collection = collection
+        self.size = 0
+
+    def batch_size(self, size):
+        self.size = size
+        return self
+
+    def __iter__(self):
+        for batch in self.collection._batches(self.size):
+            yield from bson.decode_all(batch)
+
+
+def stored_documents(name, n):
+    # BSON of the documents the consumer writes for n random events, encoded chunk by chunk so
+    # the generator's dicts are gone before the measured load
+    event_type = "add_to_cart" if name == "user_activities" else "checkout"
+    encoded = []
+    for seed in range(0, n, CHUNK):
+        for event in random_events(min(CHUNK, n - seed), seed=seed):
+            if event["event_type"] != event_type:
+                continue
+            event.update(_id=str(uuid.uuid4()), session_id=str(uuid.uuid4()), ingested_at=datetime.utcnow(),
+                         timestamp=datetime.fromisoformat(event["timestamp"]))
+            encoded.append(bson.encode(event))
+    return encoded
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+def measure(approach, name):
+    # Runs in its own process so the peak RSS is this load's alone
+    collection = ServedCollection(name, stored_documents(name, N_EVENTS))
+    gc.collect()
+    before = rss_mb()
+    start = time.perf_counter()
+    if approach == "list":
+        # What FrameCache did before: default cursor, every document as a dict, then the frame
+        df = loader.to_frame(list(collection.find({})))
+    else:
+        if approach == "batches":
+            loader.find_arrow_all = None
+        df = loader.read_frame(collection, {})
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    checksum = df["total_price"].sum() if "total_price" in df else df["price"].sum()
+    print(f"{len(df)} {elapsed:.3f} {peak - before:.1f} {checksum:.2f}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--run"]:
+        measure(*sys.argv[2:4])
+        sys.exit()
+    print(f"{N_EVENTS:,} events, pymongoarrow {'installed' if loader.find_arrow_all else 'missing'}")
+    for name in ("user_activities", "orders"):
+        results = {}
+        for approach in APPROACHES:
+            if approach == "arrow" and loader.find_arrow_all is None:
+                continue
+            output = subprocess.run([sys.executable, "-W", "ignore", __file__, "--run", approach, name, str(N_EVENTS)],
+                                    capture_output=True, text=True, check=True).stdout.split()
+            rows, seconds, peak, checksum = int(output[0]), float(output[1]), float(output[2]), output[3]
+            results[approach] = checksum
+            print(f"{name:<16} {approach:<8} {rows:>9,} rows {seconds:7.2f}s  peak RSS +{peak:7.1f} MB")
+        assert len(set(results.values())) == 1, results
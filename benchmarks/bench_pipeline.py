@@ -0,0 +1,245 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import mongomock
+
+from fakes import FakeConsumer, FakeMessage
+import consumer
+from analytics import PandasMetrics, RollupMetrics
+from load_generator import SessionGenerator
+from loader import FrameCache
+from rollups import RollupWriter
+from sink import BatchSink
+
+# Metrics where a larger value is better, everything else is a duration or a size
+HIGHER_IS_BETTER = {"ingest_events_per_sec"}
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results.json")
+
+
+class StreamConsumer:
+    # Generates storefront messages on demand so 10M-event runs do not hold the stream in memory.
+    # Time spent generating is tracked and left out of the ingest measurement.
+    def __init__(self, n_events, seed=0):
+        self.events = SessionGenerator(seed=seed).events()
+        self.remaining = n_events
+        self.offset = 0
+        self.committed = 0
+        self.paused = False
+        self.generation_time = 0.0
+
+    @property
+    def exhausted(self):
+        return self.remaining == 0
+
+    def assignment(self):
+        return [0]
+
+    def pause(self, partitions):
+        self.paused = True
+
+    def resume(self, partitions):
+        self.paused = False
+
+    def consume(self, num_messages=1, timeout=1.0):
+        # Paused while the sink is at its cap, like a real consumer it then returns nothing
+        if self.paused:
+            time.sleep(min(timeout, 0.001))
+            return []
+        start = time.perf_counter()
+        batch = []
+        for _ in range(min(num_messages, self.remaining)):
+            key, event = next(self.events)
+            batch.append(FakeMessage(json.dumps(event).encode("utf-8"), key=key, offset=self.offset))
+            self.offset += 1
+        self.remaining -= len(batch)
+        self.generation_time += time.perf_counter() - start
+        return batch
+
+    def commit(self, asynchronous=True):
+        self.committed = self.offset
+
+
+class TimingCollection:
+    # Records when each inserted document became visible
+    def __init__(self, collection, visible_at):
+        self.collection = collection
+        self.visible_at = visible_at
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def insert_many(self, docs, ordered=True):
+        result = self.collection.insert_many(docs, ordered=ordered)
+        now = time.perf_counter()
+        for doc in docs:
+            self.visible_at[doc["_id"]] = now
+        return result
+
+
+def make_sink(db, batch_size, linger_ms=1000, wrap=lambda collection: collection):
+    return BatchSink(
+        {"add_to_cart": wrap(db.user_activities), "checkout": wrap(db.orders)},
+        batch_size=batch_size,
+        linger_ms=linger_ms,
+        rollups=RollupWriter(db),
+    )
+
+
+def ingest(db, n_events, batch_size):
+    # Consumer throughput and memory over a stream of n_events messages.
+    # Memory is the process peak RSS, tracemalloc would slow the loop down several times.
+    stream = StreamConsumer(n_events)
+    sink = make_sink(db, batch_size)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        consumer.run(stream, sink, should_stop=lambda: stream.exhausted)
+    elapsed = time.perf_counter() - start - stream.generation_time
+    return {
+        "ingest_events_per_sec": n_events / elapsed,
+        "process_max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def end_to_end_latency(n_events, rate, batch_size, linger_ms):
+    # Produce timestamp to document visible, with a paced producer thread feeding the consumer
+    db = mongomock.MongoClient().db
+    messages, produced_at, visible_at = [], {}, {}
+    done = threading.Event()
+
+    def produce():
+        events = SessionGenerator(seed=1).events()
+        start = time.perf_counter()
+        for offset in range(n_events):
+            delay = offset / rate - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+            key, event = next(events)
+            produced_at[event["event_id"]] = time.perf_counter()
+            messages.append(FakeMessage(json.dumps(event).encode("utf-8"), key=key, offset=offset))
+        done.set()
+
+    fake = FakeConsumer(messages)
+    sink = make_sink(db, batch_size, linger_ms, wrap=lambda collection: TimingCollection(collection, visible_at))
+    producer = threading.Thread(target=produce)
+    producer.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        consumer.run(fake, sink, should_stop=lambda: done.is_set() and fake.exhausted)
+    producer.join()
+
+    latencies = sorted((visible_at[key] - produced_at[key]) * 1000 for key in produced_at)
+    return {
+        "e2e_latency_p50_ms": statistics.median(latencies),
+        "e2e_latency_p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "e2e_latency_max_ms": latencies[-1],
+    }
+
+
+def dashboard_load(db):
+    # Page data-load time: a cold pandas load of both collections, then the rollup reads
+    def render(metrics):
+        metrics.key_metrics()
+        metrics.daily_orders()
+        metrics.product_distribution()
+        metrics.category_distribution()
+        metrics.top_products(10)
+        metrics.recent_activities(10)
+        metrics.recent_orders(10)
+
+    start = time.perf_counter()
+    cache = FrameCache()
+    render(PandasMetrics(cache.get(db.user_activities), cache.get(db.orders)))
+    pandas_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    render(RollupMetrics(db))
+    rollups_ms = (time.perf_counter() - start) * 1000
+    return {"dashboard_pandas_load_ms": pandas_ms, "dashboard_rollups_load_ms": rollups_ms}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results, baseline, tolerance):
+    # Metrics that got worse than the baseline by more than `tolerance`
+    regressions = []
+    for size, metrics in results["results"].items():
+        for name, value in metrics.items():
+            before = baseline.get("results", {}).get(size, {}).get(name)
+            if not before:
+                continue
+            change = (value - before) / before
+            worse = -change if name in HIGHER_IS_BETTER else change
+            print(f"{size:>10} {name:<28} {before:>12.2f} -> {value:>12.2f} ({change:+.1%})")
+            if worse > tolerance:
+                regressions.append((size, name, before, value))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline producer -> consumer -> MongoDB -> dashboard benchmark.")
+    parser.add_argument("--sizes", default="10000", help="Comma-separated event counts, e.g. 10000,1000000,10000000")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--mongodb-url", default=None, help="Use a local mongod instead of mongomock")
+    parser.add_argument("--latency-events", type=int, default=5000)
+    parser.add_argument("--latency-rate", type=float, default=2000, help="Events/sec for the latency run")
+    parser.add_argument("--linger-ms", type=int, default=50, help="Consumer linger for the latency run")
+    parser.add_argument("--skip-dashboard", action="store_true", help="Skip the pandas load on large sizes")
+    parser.add_argument("--output", default=RESULTS)
+    parser.add_argument("--compare", default=None, help="Baseline results file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "store": "mongod" if args.mongodb_url else "mongomock",
+            "batch_size": args.batch_size,
+        },
+        "results": {},
+    }
+    for size in (int(value) for value in args.sizes.split(",")):
+        if args.mongodb_url:
+            from pymongo import MongoClient
+            db = MongoClient(args.mongodb_url).bench_pipeline
+            for name in db.list_collection_names():
+                db.drop_collection(name)
+        else:
+            db = mongomock.MongoClient().db
+        metrics = ingest(db, size, args.batch_size)
+        if not args.skip_dashboard:
+            metrics.update(dashboard_load(db))
+        results["results"][str(size)] = metrics
+        print(f"{size:>10} events: " + ", ".join(f"{name}={value:,.2f}" for name, value in metrics.items()))
+
+    latency = end_to_end_latency(args.latency_events, args.latency_rate, args.batch_size, args.linger_ms)
+    results["results"]["latency"] = latency
+    print(f"{args.latency_events} events at {args.latency_rate:,.0f}/s: "
+          + ", ".join(f"{name}={value:,.2f}" for name, value in latency.items()))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} metrics regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
@@ -0,0 +1,31 @@
+import time
+
+from fakes import FakeMessage
+from load_generator import SessionGenerator
+from serializers import JsonSerializer, SchemaMsgpackSerializer, decode
+
+N_EVENTS = 50000
+
+
+def bench(serializer, events):
+    start = time.perf_counter()
+    encoded = [serializer.encode(event) for event in events]
+    encode_us = (time.perf_counter() - start) / len(events) * 1e6
+
+    messages = [FakeMessage(value, headers=headers) for value, headers in encoded]
+    start = time.perf_counter()
+    decoded = [decode(message.value(), message.headers()) for message in messages]
+    decode_us = (time.perf_counter() - start) / len(events) * 1e6
+
+    assert decoded == events
+    size = sum(len(value) for value, _ in encoded) / len(events)
+    return size, encode_us, decode_us
+
+
+if __name__ == "__main__":
+    generator = SessionGenerator(seed=0).events()
+    events = [next(generator)[1] for _ in range(N_EVENTS)]
+    print(f"{N_EVENTS} storefront events")
+    for name, serializer in (("json", JsonSerializer()), ("msgpack+schema", SchemaMsgpackSerializer())):
+        size, encode_us, decode_us = bench(serializer, events)
+        print(f"{name:<15} {size:6.1f} bytes/event  encode {encode_us:5.2f}us  decode {decode_us:5.2f}us")
@@ -0,0 +1,94 @@
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import mongomock
+import pandas as pd
+
+from fakes import load_database
+from analytics import funnel_summary
+from rollups import FUNNELS
+from sessions import SESSION_TIMEOUT_MINUTES, SessionAggregator
+
+N_SHOPPERS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+DAYS = 7
+BATCH_SIZE = 500
+TIMEOUT = timedelta(minutes=SESSION_TIMEOUT_MINUTES)
+
+
+def shopper_events(n_shoppers, days=DAYS, seed=0):
+    # Shoppers come back a few times over the period, each visit a burst of adds a few minutes
+    # apart, a third of them ending in a checkout. Returned in arrival (time) order.
+    rng = random.Random(seed)
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=days)
+    events = []
+    for _ in range(n_shoppers):
+        session_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        visit = start + timedelta(seconds=rng.uniform(0, days * 86400))
+        for _ in range(rng.randint(1, 3)):
+            timestamp = visit
+            for _ in range(rng.randint(0, 4)):
+                timestamp += timedelta(minutes=rng.uniform(0.5, 10))
+                events.append({"event_type": "add_to_cart", "session_id": session_id, "product_id": 1,
+                               "price": 10.0, "timestamp": timestamp})
+            if rng.random() < 0.33:
+                timestamp += timedelta(minutes=rng.uniform(0.5, 10))
+                events.append({"event_type": "checkout", "session_id": session_id, "timestamp": timestamp,
+                               "cart_items": [], "total_price": 10.0})
+            visit = timestamp + timedelta(hours=rng.uniform(0.6, 48))
+    events.sort(key=lambda event: event["timestamp"])
+    for i, event in enumerate(events):
+        event["_id"] = f"event-{i}"
+    return events
+
+
+def funnel_from_raw(events):
+    # What answering the funnel on demand costs once every event has been read: sessionize, count
+    df = pd.DataFrame(events, columns=["session_id", "event_type", "timestamp"])
+    df = df.sort_values(["session_id", "timestamp"])
+    gap = df["timestamp"].diff() >= TIMEOUT
+    new_session = gap | (df["session_id"] != df["session_id"].shift())
+    df["session"] = new_session.cumsum()
+    df["carted"] = df["event_type"] == "add_to_cart"
+    df["checked_out"] = df["event_type"] == "checkout"
+    sessions = df.groupby("session").agg(start=("timestamp", "min"), carted=("carted", "max"),
+                                         checked_out=("checked_out", "max"))
+    sessions["day"] = sessions["start"].dt.strftime("%Y-%m-%d")
+    return sessions.groupby("day").agg(sessions=("start", "size"), carts=("carted", "sum"),
+                                       checkouts=("checked_out", "sum"))
+
+
+if __name__ == "__main__":
+    events = shopper_events(N_SHOPPERS)
+    db = load_database(events, mongomock.MongoClient().db)
+    print(f"{len(events):,} events from {N_SHOPPERS:,} shoppers over {DAYS} days")
+
+    aggregator = SessionAggregator(db)
+    peak_open = 0
+    start = time.perf_counter()
+    for i in range(0, len(events), BATCH_SIZE):
+        aggregator.apply(events[i:i + BATCH_SIZE])
+        peak_open = max(peak_open, len(aggregator.open))
+    elapsed = time.perf_counter() - start
+    # End of the stream: close whatever is still open
+    aggregator.watermark = datetime.max
+    aggregator.expire()
+    print(f"aggregator: {len(events) / elapsed:,.0f} events/sec, at most {peak_open:,} sessions open")
+
+    start = time.perf_counter()
+    expected = funnel_from_raw(events)
+    raw_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    summary = funnel_summary(db)
+    read_ms = (time.perf_counter() - start) * 1000
+    print(f"funnel from raw events in memory {raw_ms:8.1f}ms   from {db[FUNNELS].count_documents({})} funnel documents "
+          f"{read_ms:6.1f}ms")
+
+    stored = {doc["_id"]: doc for doc in db[FUNNELS].find({})}
+    for day, row in expected.iterrows():
+        for field in ("sessions", "carts", "checkouts"):
+            assert stored[day][field] == row[field], (day, field, stored[day][field], row[field])
+    assert len(stored) == len(expected)
+    print(f"funnels match the batch sessionization: {dict(zip(summary['stage'], summary['count']))}")
@@ -0,0 +1,80 @@
+import math
+import sys
+import time
+from datetime import datetime, timedelta
+
+import mongomock
+import pandas as pd
+
+from fakes import zipf_add_to_cart
+from analytics import day_match
+from sketches import ADDED, CMS_WIDTH, HLL_PRECISION, SketchWriter, merged_sketch
+
+N_EVENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+N_PRODUCTS = 1_000_000  # A large catalog with Zipf popularity: a few heads, a very long tail
+DAYS = 30
+BATCH_SIZE = 500
+TOP_N = 10
+TOP_EXACT = 5  # Leading products the sketches must rank exactly as pandas does
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def exact(df, start, end):
+    # What the pandas backend does over the loaded frame
+    rows = df[(df["day"] >= start) & (df["day"] < end)]
+    counts = rows["product_id"].value_counts()
+    return rows["product_id"].nunique(), list(counts.head(TOP_N).items()), len(rows)
+
+
+def estimated(db, start, end):
+    sketch = merged_sketch(db, ADDED, day_match((start, end)))
+    return sketch.distinct(), sketch.top(TOP_N)
+
+
+def check_bounds(sketch_distinct, sketch_top, exact_distinct, exact_counts, total):
+    # HyperLogLog within 3 standard errors (1.04 / sqrt(2^p)); Count-Min never under the exact
+    # count and over it by at most e/width of the total, its bound with probability 1 - e^-depth
+    assert abs(sketch_distinct / exact_distinct - 1) <= 3 * 1.04 / math.sqrt(1 << HLL_PRECISION), \
+        (sketch_distinct, exact_distinct)
+    for key, count in sketch_top:
+        if key in exact_counts:
+            assert 0 <= count - exact_counts[key] <= math.e / CMS_WIDTH * total, (key, count, exact_counts[key])
+    leading = [key for key, _ in sorted(exact_counts.items(), key=lambda pair: -pair[1])[:TOP_EXACT]]
+    assert [key for key, _ in sketch_top[:TOP_EXACT]] == leading, (sketch_top[:TOP_EXACT], leading)
+
+
+if __name__ == "__main__":
+    first_day = datetime(2025, 1, 1)
+    events = zipf_add_to_cart(N_EVENTS, N_PRODUCTS, DAYS, first_day)
+    df = pd.DataFrame({"day": [event["timestamp"].date().isoformat() for event in events],
+                       "product_id": [event["product_id"] for event in events]})
+    print(f"{len(df):,} add_to_cart events over {DAYS} days, {df['product_id'].nunique():,} distinct "
+          f"of {N_PRODUCTS:,} products")
+
+    db = mongomock.MongoClient().db
+    writer = SketchWriter(db, flush_seconds=float("inf"))
+    start = time.perf_counter()
+    for i in range(0, len(events), BATCH_SIZE):
+        writer.apply(events[i:i + BATCH_SIZE])
+    elapsed = time.perf_counter() - start
+    writer.close()
+    print(f"consumer side: {len(events) / elapsed:,.0f} events/sec into the sketches, "
+          f"{len(writer.sketches)} day sketches")
+
+    for n_days in (1, 7, DAYS):
+        start, end = first_day, first_day + timedelta(days=n_days)
+        (exact_distinct, exact_top, total), exact_ms = timed(exact, df, start.date().isoformat(),
+                                                             end.date().isoformat())
+        (distinct, top), sketch_ms = timed(estimated, db, start, end)
+        exact_counts = dict(exact_top)
+        recall = len(set(exact_counts) & {key for key, _ in top}) / TOP_N
+        count_error = max(abs(count / exact_counts[key] - 1) for key, count in top if key in exact_counts)
+        print(f"{n_days:>2} days: exact {exact_ms:7.1f}ms  sketches {sketch_ms:6.1f}ms | distinct "
+              f"{distinct:,} vs {exact_distinct:,} ({distinct / exact_distinct - 1:+.2%}) | "
+              f"top-{TOP_N} recall {recall:.0%}, max count error {count_error:.2%}")
+        check_bounds(distinct, top, exact_distinct, exact_counts, total)
@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+from types import MappingProxyType
+
+import confluent_kafka
+from streamlit.testing.v1 import AppTest
+
+from fakes import FakeProducer
+import catalog
+
+SIZES = [int(arg) for arg in sys.argv[1:]] or [40, 1000, 10000]
+# (label, STOREFRONT_PAGE_SIZE, STOREFRONT_IMAGE_WIDTH): every product with full-size images is
+# the storefront before paging and scaled images, skipped past FULL_RENDER_LIMIT products
+VARIANTS = (("before", 0, 0), ("all", 0, 480), ("20/category", 20, 480))
+FULL_RENDER_LIMIT = 1000
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "customer_data_producer.py")
+
+
+def scale_catalog(n):
+    # The 40 real products repeated under new ids until the catalog has n of them
+    base = catalog.products
+    products = tuple(MappingProxyType(dict(base[i % len(base)], id=i + 1, name=f"{base[i % len(base)]['name']} {i + 1}"))
+                     for i in range(n))
+    catalog.products = products
+    catalog.PRODUCTS_BY_ID = MappingProxyType({product["id"]: product for product in products})
+    catalog.PRODUCTS_BY_CATEGORY = catalog.by_category(products)
+
+
+def timed_run(app):
+    start = time.perf_counter()
+    app.run()
+    assert not app.exception, [e.value for e in app.exception]
+    return (time.perf_counter() - start) * 1000
+
+
+if __name__ == "__main__":
+    # The app's script runs in this process, against a producer that never touches a broker
+    confluent_kafka.Producer = lambda conf: FakeProducer(rtt_ms=0)
+    os.chdir(os.path.dirname(APP))  # Local images are relative to the repo root
+    original = catalog.products
+    print("server time per script run: first page view of a session, then an add-to-cart click")
+    for n in SIZES:
+        catalog.products = original
+        scale_catalog(n)
+        for label, page_size, image_width in VARIANTS:
+            if label == "before" and n > FULL_RENDER_LIMIT:
+                print(f"{n:>6,} products, {label:<12} skipped, every full-size image is resized on every run")
+                continue
+            os.environ["STOREFRONT_PAGE_SIZE"] = str(page_size)
+            os.environ["STOREFRONT_IMAGE_WIDTH"] = str(image_width)
+            app = AppTest.from_file(APP, default_timeout=600)
+            first_ms = timed_run(app)
+            app.button(key="add_1").click()
+            click_ms = timed_run(app)
+            print(f"{n:>6,} products, {label:<12} {first_ms:9.1f}ms first view  {click_ms:9.1f}ms per click "
+                  f"({len(app.button):,} buttons)")
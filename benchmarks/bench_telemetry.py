@@ -0,0 +1,60 @@
+import contextlib
+import logging
+import os
+import tempfile
+import time
+import timeit
+
+import mongomock
+
+from fakes import FakeConsumer, SlowCollection, sample_messages
+import consumer
+from sink import BatchSink
+from telemetry import CONSUMED, POLL_TO_WRITE, SamplingProfiler, configure_logging, prometheus_client
+
+N_CALLS = 100000
+N_EVENTS = 20000
+RTT_MS = 0.5  # Simulated network round-trip per MongoDB call
+
+
+def consume(messages, profile=None):
+    db = mongomock.MongoClient().db
+    fake = FakeConsumer(messages)
+    sink = BatchSink(
+        {"add_to_cart": SlowCollection(db.user_activities, RTT_MS), "checkout": SlowCollection(db.orders, RTT_MS)},
+        batch_size=500,
+    )
+    start = time.perf_counter()
+    with SamplingProfiler(profile) if profile else contextlib.nullcontext():
+        consumer.run(fake, sink, should_stop=lambda: fake.exhausted)
+    return len(messages) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    print(f"prometheus_client {'installed' if prometheus_client else 'missing, metrics are no-ops'}")
+    # What a per-message print costs next to a disabled debug line and a metric update,
+    # with output going to /dev/null; a terminal or log shipper makes the first two dearer
+    log = logging.getLogger("bench")
+    timings = [
+        ("print() per message", lambda: print("Message delivered to events [0]")),
+        ("log.debug() below the level", lambda: log.debug("Message delivered to %s [%d]", "events", 0)),
+        ("log.info() as JSON", lambda: log.info("Inserted %d documents", 500, extra={"count": 500})),
+        ("counter.labels().inc()", lambda: CONSUMED.labels("checkout", "stored").inc()),
+        ("histogram.observe()", lambda: POLL_TO_WRITE.observe(0.01)),
+    ]
+    for label, stmt in timings:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            configure_logging("INFO", "json")
+            seconds = min(timeit.repeat(stmt, number=N_CALLS, repeat=3))
+        print(f"{label:<30} {seconds / N_CALLS * 1e6:7.3f}us per call")
+
+    configure_logging("WARNING")
+    messages = sample_messages(N_EVENTS)
+    print(f"\n{N_EVENTS} events through consumer.run, {RTT_MS}ms simulated round-trip")
+    print(f"instrumented                   {consume(messages):>9,.0f} events/sec")
+    with tempfile.TemporaryDirectory() as root:
+        output = os.path.join(root, "consumer.folded")
+        rate = consume(messages, profile=output)
+        with open(output) as f:
+            samples = sum(int(line.rsplit(" ", 1)[1]) for line in f)
+        print(f"with the sampling profiler     {rate:>9,.0f} events/sec ({samples} samples)")
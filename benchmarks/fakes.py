@@ -0,0 +1,311 @@
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Make the top-level modules importable when running benchmarks/<script>.py directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeMessage:
+    # Minimal stand-in for confluent_kafka.Message
+    def __init__(self, value, key=None, topic="events", partition=0, offset=0, headers=None):
+        self._value = value
+        self._headers = headers
+        self._key = key
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+
+    def value(self):
+        return self._value
+
+    def key(self):
+        return self._key
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def headers(self):
+        return self._headers
+
+    def error(self):
+        return None
+
+
+class FakeConsumer:
+    # In-process consumer that hands out a prebuilt list of messages
+    def __init__(self, messages):
+        self.messages = messages
+        self.position = 0
+        self.committed = 0
+        self.on_revoke = None
+        self.paused = False
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        self.on_revoke = on_revoke
+
+    @property
+    def exhausted(self):
+        return self.position >= len(self.messages)
+
+    def assignment(self):
+        return [0]
+
+    def pause(self, partitions):
+        self.paused = True
+
+    def resume(self, partitions):
+        self.paused = False
+
+    def consume(self, num_messages=1, timeout=1.0):
+        # `messages` may still be growing when a producer thread shares the list
+        if self.paused:
+            time.sleep(min(timeout, 0.001))
+            return []
+        batch = self.messages[self.position:self.position + num_messages]
+        self.position += len(batch)
+        if not batch:
+            time.sleep(min(timeout, 0.001))
+        return batch
+
+    def poll(self, timeout=1.0):
+        batch = self.consume(1, timeout)
+        return batch[0] if batch else None
+
+    def commit(self, asynchronous=True):
+        self.committed = self.position
+
+    def close(self):
+        # Closing leaves the group, which revokes the assignment
+        if self.on_revoke:
+            self.on_revoke(self, [])
+
+
+class FakeGroup:
+    """A partitioned topic and one consumer group's committed offsets, for FakeGroupConsumers
+    in the same process. Every join or leave revokes all partitions, then deals them out
+    round-robin, like Kafka's eager rebalancing."""
+
+    def __init__(self, partitions):
+        self.partitions = partitions  # One list of messages per partition
+        self.committed = [0] * len(partitions)
+        self.members = []
+        self.delivered = 0  # Messages handed to any member, redeliveries included
+
+    def join(self, member):
+        self.members.append(member)
+        self.rebalance()
+
+    def leave(self, member):
+        self.members.remove(member)
+        member.revoke()
+        self.rebalance()
+
+    def rebalance(self):
+        for member in self.members:
+            member.revoke()
+        for partition in range(len(self.partitions)):
+            self.members[partition % len(self.members)].assign(partition)
+
+    @property
+    def exhausted(self):
+        return all(committed >= len(messages) for committed, messages in zip(self.committed, self.partitions))
+
+
+class FakeGroupConsumer:
+    # Consumer of a FakeGroup: reads its assigned partitions from their committed offsets
+    def __init__(self, group):
+        self.group = group
+        self.positions = {}  # Assigned partition -> next offset
+        self.on_revoke = None
+        self.paused = False
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None):
+        self.on_revoke = on_revoke
+        self.group.join(self)
+
+    def assign(self, partition):
+        self.positions[partition] = self.group.committed[partition]
+
+    def revoke(self):
+        if self.positions and self.on_revoke:
+            self.on_revoke(self, list(self.positions))
+        self.positions = {}
+
+    def assignment(self):
+        return list(self.positions)
+
+    def pause(self, partitions):
+        self.paused = True
+
+    def resume(self, partitions):
+        self.paused = False
+
+    def consume(self, num_messages=1, timeout=1.0):
+        batch = []
+        if not self.paused:
+            for partition, position in self.positions.items():
+                taken = self.group.partitions[partition][position:position + num_messages - len(batch)]
+                self.positions[partition] = position + len(taken)
+                batch.extend(taken)
+        self.group.delivered += len(batch)
+        return batch
+
+    def commit(self, asynchronous=True):
+        for partition, position in self.positions.items():
+            self.group.committed[partition] = position
+
+    def close(self):
+        self.group.leave(self)
+
+
+class FakeProducer:
+    # In-process producer; flush() costs one simulated broker round-trip
+    def __init__(self, rtt_ms=20):
+        self.rtt = rtt_ms / 1000.0
+        self.produced = []
+        self.pending = []
+
+    def produce(self, topic, key=None, value=None, callback=None, headers=None):
+        message = FakeMessage(value, key=key, topic=topic, offset=len(self.produced), headers=headers)
+        self.produced.append(message)
+        self.pending.append((callback, message))
+
+    def poll(self, timeout=0):
+        # Deliver everything produced so far
+        pending, self.pending = self.pending, []
+        for callback, message in pending:
+            if callback:
+                callback(None, message)
+        return len(pending)
+
+    def flush(self, timeout=None):
+        if self.pending:
+            time.sleep(self.rtt)
+        self.poll(0)
+        return 0
+
+    def __len__(self):
+        return len(self.pending)
+
+
+class SlowCollection:
+    # Wraps a mongomock collection and adds a fixed round-trip delay per write call
+    def __init__(self, collection, rtt_ms=0.5):
+        self.collection = collection
+        self.rtt = rtt_ms / 1000.0
+
+    def __getattr__(self, name):
+        attr = getattr(self.collection, name)
+        if name in ("insert_one", "insert_many", "update_one", "update_many", "bulk_write", "replace_one"):
+            def call(*args, **kwargs):
+                time.sleep(self.rtt)
+                return attr(*args, **kwargs)
+            return call
+        return attr
+
+
+def sample_events(n):
+    # Alternate add_to_cart and checkout events shaped like the storefront's
+    now = datetime.utcnow().isoformat()
+    events = []
+    for i in range(n):
+        if i % 2 == 0:
+            events.append({
+                "event_type": "add_to_cart",
+                "product_id": i % 40 + 1,
+                "price": 15.99,
+                "timestamp": now,
+            })
+        else:
+            events.append({
+                "event_type": "checkout",
+                "timestamp": now,
+                "cart_items": [
+                    {"product_id": i % 40 + 1, "quantity": 1, "price": 15.99}
+                ],
+                "total_price": 15.99,
+            })
+    return events
+
+
+def partitioned_messages(n, partitions, topic="events"):
+    # sample_events spread round-robin over the partitions, offsets counted per partition
+    split = [[] for _ in range(partitions)]
+    for i, event in enumerate(sample_events(n)):
+        messages = split[i % partitions]
+        messages.append(FakeMessage(json.dumps(event).encode("utf-8"), topic=topic, partition=i % partitions,
+                                    offset=len(messages)))
+    return split
+
+
+def sample_messages(n, topic="events"):
+    return [
+        FakeMessage(json.dumps(event).encode("utf-8"), topic=topic, offset=i)
+        for i, event in enumerate(sample_events(n))
+    ]
+
+
+def random_events(n, days=30, n_products=40, seed=0):
+    # Events spread over the last `days` days; roughly one checkout per four add_to_cart
+    rng = random.Random(seed)
+    start = datetime.utcnow() - timedelta(days=days)
+    events = []
+    for _ in range(n):
+        timestamp = (start + timedelta(seconds=rng.uniform(0, days * 86400))).isoformat()
+        product_id = rng.randint(1, n_products)
+        if rng.random() < 0.8:
+            events.append({
+                "event_type": "add_to_cart",
+                "product_id": product_id,
+                "price": float(product_id),
+                "timestamp": timestamp,
+            })
+        else:
+            items = []
+            for item_id in rng.sample(range(1, n_products + 1), rng.randint(1, 3)):
+                items.append({"product_id": item_id, "quantity": rng.randint(1, 3), "price": float(item_id)})
+            events.append({
+                "event_type": "checkout",
+                "timestamp": timestamp,
+                "cart_items": items,
+                "total_price": sum(item["price"] * item["quantity"] for item in items),
+            })
+    return events
+
+
+def zipf_add_to_cart(n, n_products, days, first_day, zipf_s=1.1, seed=0):
+    # add_to_cart events for a large catalog with Zipf popularity, a few heads and a very long
+    # tail, spread over `days` days from `first_day` in timestamp order
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    product_ids = rng.zipf(zipf_s, n * 2)
+    product_ids = product_ids[product_ids <= n_products][:n]
+    offsets = np.sort(rng.integers(0, days, len(product_ids)))
+    dates = {day: first_day + timedelta(days=int(day)) for day in range(days)}
+    return [{"event_type": "add_to_cart", "product_id": int(product_id), "timestamp": dates[day]}
+            for product_id, day in zip(product_ids.tolist(), offsets.tolist())]
+
+
+def load_database(events, db=None):
+    # Insert events into user_activities/orders, mongomock when no database is given
+    if db is None:
+        import mongomock
+        db = mongomock.MongoClient().db
+    activities = [dict(e) for e in events if e["event_type"] == "add_to_cart"]
+    orders = [dict(e) for e in events if e["event_type"] == "checkout"]
+    if activities:
+        db.user_activities.insert_many(activities)
+    if orders:
+        db.orders.insert_many(orders)
+    return db
@@ -0,0 +1,139 @@
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, DESCENDING
+from analytics import timestamp_match
+
+log = logging.getLogger(__name__)
+
+# Indexes backing the dashboard queries: time ranges, "Recent ..." sorts and per-field breakdowns
+ACTIVITY_INDEXES = [
+    [("timestamp", DESCENDING)],
+    [("ingested_at", ASCENDING)],
+    [("event_type", ASCENDING)],
+    [("product_id", ASCENDING)],
+]
+ORDER_INDEXES = [
+    [("timestamp", DESCENDING)],
+    [("ingested_at", ASCENDING)],
+    [("event_type", ASCENDING)],
+    [("cart_items.product_id", ASCENDING)],
+]
+
+
+def create_activity_collection(db, name, timeseries=False):
+    # Optionally store user_activities as a time-series collection bucketed on timestamp.
+    # Time-series collections cannot enforce a unique _id: the consumer's duplicate detection
+    # does not work there, so replayed or retried add_to_cart events are stored and counted again.
+    if not timeseries:
+        return
+    if name not in db.list_collection_names():
+        db.create_collection(name, timeseries={"timeField": "timestamp", "metaField": "product_id",
+                                               "granularity": "seconds"})
+        log.info("Created time-series collection %s", name)
+    log.warning("%s is a time-series collection: replayed add_to_cart events are not deduplicated and "
+                "inflate the rollups, sessions and sketches until `rollups.py rebuild`", name)
+
+
+def ensure_indexes(activity_col, order_col):
+    # Idempotent, safe to run on every consumer start
+    for keys in ACTIVITY_INDEXES:
+        activity_col.create_index(keys)
+    for keys in ORDER_INDEXES:
+        order_col.create_index(keys)
+
+
+def migrate_timestamps(collection):
+    # Convert ISO string timestamps written before events were stored as BSON dates
+    result = collection.update_many(
+        {"timestamp": {"$type": "string"}},
+        [{"$set": {"timestamp": {"$toDate": "$timestamp"}}}],
+    )
+    print(f"Converted {result.modified_count} timestamps in {collection.name}")
+
+
+def plan_stages(plan):
+    # Every stage name in an explain() plan tree
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+def winning_stages(explain):
+    # Stages of the winning plan for find() and aggregate() explain output
+    planner = explain.get("queryPlanner")
+    if planner is None:
+        planner = explain["stages"][0]["$cursor"]["queryPlanner"]
+    return plan_stages(planner["winningPlan"])
+
+
+def dashboard_queries(activity_col, order_col):
+    # (description, explain output) for the queries the dashboard issues per page load
+    week = (datetime.utcnow() - timedelta(days=7), None)
+    match = timestamp_match(week)
+    db = activity_col.database
+    return [
+        ("recent activities", activity_col.find({}).sort("timestamp", -1).limit(10).explain()),
+        ("recent orders", order_col.find({}).sort("timestamp", -1).limit(10).explain()),
+        ("activities in range", activity_col.find(match).explain()),
+        ("orders in range", order_col.find(match).explain()),
+        ("first activity", activity_col.find({}).sort("timestamp", 1).limit(1).explain()),
+        ("product filter", activity_col.find({"product_id": 1}).explain()),
+        ("product in orders", order_col.find({"cart_items.product_id": 1}).explain()),
+        ("orders by day in range", db.command(
+            "explain",
+            {"aggregate": order_col.name, "pipeline": [{"$match": match}, {"$count": "n"}], "cursor": {}},
+            verbosity="queryPlanner",
+        )),
+    ]
+
+
+def check_index_usage(activity_col, order_col):
+    # Returns the queries whose winning plan still scans the whole collection
+    collection_scans = []
+    for description, explain in dashboard_queries(activity_col, order_col):
+        stages = winning_stages(explain)
+        status = "COLLSCAN" if "COLLSCAN" in stages else "ok"
+        print(f"{description:<24} {status:<9} {' <- '.join(stages)}")
+        if status == "COLLSCAN":
+            collection_scans.append(description)
+    return collection_scans
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo.mongo_client import MongoClient
+    from pymongo.server_api import ServerApi
+    from telemetry import configure_logging
+
+    load_dotenv()
+    configure_logging()
+    command = sys.argv[1] if len(sys.argv) > 1 else "indexes"
+    client = MongoClient(os.getenv("MONGODB_URL"), server_api=ServerApi('1'))
+    db = client[os.getenv('DB')]
+    Order_col = db[os.getenv('Order_col')]
+    activity_col = db[os.getenv('activity')]
+
+    status = 0
+    if command == "indexes":
+        create_activity_collection(db, activity_col.name, timeseries="--timeseries" in sys.argv)
+        ensure_indexes(activity_col, Order_col)
+        print("Indexes are in place")
+    elif command == "migrate-timestamps":
+        migrate_timestamps(activity_col)
+        migrate_timestamps(Order_col)
+    elif command == "explain":
+        status = 1 if check_index_usage(activity_col, Order_col) else 0
+    else:
+        print("Usage: python bootstrap.py [indexes [--timeseries]|migrate-timestamps|explain]")
+        status = 2
+    client.close()
+    sys.exit(status)
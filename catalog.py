@@ -0,0 +1,111 @@
+from functools import lru_cache
+from types import MappingProxyType
+
+import pandas as pd
+
+# Product data with valid names
+products = [
+    # Books
+    {"id": i, "name": name, "price": price, "image": "atomic_habits.jpg", "description": desc, "category": "Books"}
+    for i, (name, price, desc) in enumerate([
+        ("Atomic Habits", 15.99, "Transform your habits and change your life."),
+        ("The Power of Now", 13.99, "A guide to spiritual enlightenment."),
+        ("The 5 AM Club", 14.99, "Own your morning, elevate your life."),
+        ("Think and Grow Rich", 12.99, "Classic book on success mindset."),
+        ("The Subtle Art of Not Giving a F*ck", 16.99, "A counterintuitive approach to living a good life."),
+        ("You Are a Badass", 14.49, "How to stop doubting and start living."),
+        ("Daring Greatly", 17.49, "The power of vulnerability."),
+        ("Grit", 18.99, "Passion and perseverance for long-term goals."),
+        ("Mindset", 19.99, "The new psychology of success."),
+        ("Can't Hurt Me", 20.99, "Master your mind and defy the odds.")
+    ], 1)
+] + [
+    # Electronics
+    {"id": i, "name": name, "price": price, "image": f"https://via.placeholder.com/150?text={name.replace(' ', '+')}", "description": desc, "category": "Electronics"}
+    for i, (name, price, desc) in enumerate([
+        ("iPhone 15", 999.99, "Latest Apple iPhone with A17 chip."),
+        ("Samsung Galaxy S24", 899.99, "Flagship smartphone from Samsung."),
+        ("MacBook Pro", 1299.99, "Apple's latest powerful laptop."),
+        ("Sony WH-1000XM5", 349.99, "Noise-canceling wireless headphones."),
+        ("iPad Air", 599.99, "Powerful tablet from Apple."),
+        ("Dell XPS 15", 1399.99, "High-performance laptop from Dell."),
+        ("Bose QuietComfort 45", 329.99, "Premium noise-canceling headphones."),
+        ("GoPro Hero 11", 499.99, "Action camera for adventurers."),
+        ("Nintendo Switch", 299.99, "Hybrid gaming console."),
+        ("Kindle Paperwhite", 129.99, "E-reader with glare-free display.")
+    ], 11)
+] + [
+    # Fashion
+    {"id": i, "name": name, "price": price, "image": f"https://via.placeholder.com/150?text={name.replace(' ', '+')}", "description": desc, "category": "Fashion"}
+    for i, (name, price, desc) in enumerate([
+        ("Nike Air Max", 149.99, "Comfortable and stylish sneakers."),
+        ("Adidas Ultraboost", 179.99, "Premium running shoes."),
+        ("Levi's 501 Jeans", 69.99, "Classic straight fit jeans."),
+        ("Ray-Ban Aviators", 129.99, "Iconic sunglasses for a cool look."),
+        ("Casio G-Shock Watch", 99.99, "Durable and stylish wristwatch."),
+        ("North Face Jacket", 199.99, "Warm and waterproof winter jacket."),
+        ("Michael Kors Handbag", 249.99, "Elegant designer handbag."),
+        ("Polo Ralph Lauren Shirt", 89.99, "Casual and sophisticated shirt."),
+        ("Timberland Boots", 159.99, "Classic outdoor boots."),
+        ("Fossil Leather Wallet", 49.99, "Premium leather wallet.")
+    ], 21)
+] + [
+    # Digital Subscriptions
+    {"id": i, "name": name, "price": price, "image": f"https://via.placeholder.com/150?text={name.replace(' ', '+')}", "description": desc, "category": "Digital Subscriptions"}
+    for i, (name, price, desc) in enumerate([
+        ("Netflix Premium", 15.99, "Unlimited movies and TV shows."),
+        ("Spotify Family", 14.99, "Ad-free music streaming for the family."),
+        ("Amazon Prime", 12.99, "Fast delivery and streaming benefits."),
+        ("Disney+", 7.99, "Stream Disney, Pixar, Marvel, and Star Wars."),
+        ("Adobe Creative Cloud", 52.99, "Suite of creative apps."),
+        ("Microsoft 365", 69.99, "Office apps and cloud storage."),
+        ("YouTube Premium", 11.99, "Ad-free videos and music."),
+        ("Audible", 14.95, "Unlimited audiobooks and podcasts."),
+        ("NYTimes Digital", 9.99, "Unlimited news articles online."),
+        ("PlayStation Plus", 9.99, "Online gaming and free monthly games.")
+    ], 31)
+]
+
+
+def by_category(products):
+    # Category -> its products in catalog order, categories in the order they first appear
+    index = {}
+    for product in products:
+        index.setdefault(product["category"], []).append(product)
+    return MappingProxyType({category: tuple(items) for category, items in index.items()})
+
+
+# Built once at import and read-only from then on. Events only carry product_id and the
+# price at the time, names and categories are joined back from this index.
+products = tuple(MappingProxyType(product) for product in products)
+PRODUCTS_BY_ID = MappingProxyType({product["id"]: product for product in products})
+PRODUCTS_BY_CATEGORY = by_category(products)  # What the storefront renders on every rerun
+
+# Columns enrich() adds to event rows
+CATALOG_COLUMNS = {"name": "product_name", "category": "category"}
+
+
+def lookup(product_id):
+    # Catalog entry for an id, empty for products no longer in the catalog
+    return PRODUCTS_BY_ID.get(product_id, MappingProxyType({}))
+
+
+@lru_cache(maxsize=1)
+def catalog_frame():
+    # product_id-indexed DataFrame of the enrichment columns, shared by every join
+    return pd.DataFrame(
+        {column: [product[field] for product in products] for field, column in CATALOG_COLUMNS.items()},
+        index=pd.Index([product["id"] for product in products], name="product_id"),
+    )
+
+
+def enrich(df):
+    # Join product_name and category onto rows carrying a product_id, keeping the row index.
+    # Documents written before events were slimmed keep their stored values for unknown ids.
+    if df.empty or "product_id" not in df:
+        return df
+    stored = [column for column in CATALOG_COLUMNS.values() if column in df]
+    df = df.join(catalog_frame(), on="product_id", rsuffix="_catalog")
+    for column in stored:
+        df[column] = df.pop(f"{column}_catalog").fillna(df[column])
+    return df
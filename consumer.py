@@ -1,94 +1,253 @@
 from confluent_kafka import Consumer, KafkaError
-import json
+import logging
 import time
+from datetime import datetime
 from dotenv import load_dotenv
 import os
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
+from sink import BatchSink
+from dlq import DLQ_PATH, FileDLQ, RetryWorker
+from serializers import SerializationError, decode
+from rollups import RollupWriter
+from sessions import SessionAggregator
+from sketches import SketchWriter
+from bootstrap import create_activity_collection, ensure_indexes
+from telemetry import configure_logging, kafka_stats, profiled, start_metrics_server
+
+log = logging.getLogger(__name__)
 
 # Load environment variables from the .env file
 load_dotenv()
 
 # Kafka consumer configuration
 conf = {
-    'bootstrap.servers': os.getenv("bootstrap_server"), 
-    'security.protocol': 'SASL_SSL',    
-    'sasl.mechanisms': 'PLAIN',     
+    'bootstrap.servers': os.getenv("bootstrap_server"),
+    'security.protocol': 'SASL_SSL',
+    'sasl.mechanisms': 'PLAIN',
     'sasl.username': os.getenv('api_key'),
     'sasl.password': os.getenv('api_secret'),
     'group.id': 'customer_analytics',  # Add a unique consumer group ID
     'auto.offset.reset': 'earliest',  # Start reading from the earliest message
+    'enable.auto.commit': False,  # Offsets are committed once a batch is in MongoDB
+    # Periodic librdkafka statistics feed the consumer lag gauge, 0 turns them off
+    'statistics.interval.ms': int(os.getenv("KAFKA_STATS_INTERVAL_MS", 5000)),
+    'stats_cb': kafka_stats,
 }
 topic = os.getenv("topic")
 
-# Create a consumer instance
-consumer = Consumer(conf)
-
-# Fetch environment variables
-uri = os.getenv("MONGODB_URL")
+# Batching configuration
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", 500))  # Max events per insert_many
+LINGER_MS = int(os.getenv("LINGER_MS", 1000))  # Max time an event waits in the buffer
+MAX_PENDING = int(os.getenv("MAX_PENDING", 10000))  # Buffered events at which polling pauses
+# Seconds a shutdown keeps retrying buffered events before dead-lettering them
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 30))
+# Create user_activities as a time-series collection. Time-series collections do not enforce a
+# unique _id, which everything downstream relies on to skip replays: add_to_cart events written
+# again after a restart, a retried write or `dlq.py replay` are stored twice and counted twice in
+# the rollups, funnels and sketches. Only use it where at-least-once counts are acceptable, and
+# run `rollups.py rebuild` after replays. A warning is logged on every start while it is in use.
+ACTIVITY_TIMESERIES = os.getenv("ACTIVITY_TIMESERIES") == "1"
+# Hand batches that fail to write to a background retry worker instead of stalling the loop
+RETRY_WORKER = os.getenv("RETRY_WORKER", "1") == "1"
+# Sessionize stored events into the conversion funnels as they arrive
+SESSIONIZE = os.getenv("SESSIONIZE", "1") == "1"
 
-# MongoDB connection
-client = MongoClient(uri, server_api=ServerApi('1'))
 
-# Test MongoDB connection
-try:
-    client.admin.command('ping')
-    print("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    print(f"MongoDB connection error: {e}")
-    exit(1)  # Exit the script if MongoDB connection fails
+def to_document(msg):
+    # The document stored for a Kafka message. Raises SerializationError for values that
+    # cannot be decoded or are not an event object, and ValueError for invalid timestamps.
+    # Decode the message value in the format its headers announce
+    data = decode(msg.value(), msg.headers())
+    if not isinstance(data, dict):
+        raise SerializationError(f"Expected an event object, got {type(data).__name__}")
 
-# Access the database and collections
-db = client[os.getenv('DB')]
-Order_col = db[os.getenv('Order_col')]  # Collection for checkout events
-activity_col = db[os.getenv('activity')]  # Collection for add_to_cart events
+    # Deterministic _id so a replayed message collides with the document it already wrote:
+    # the producer's event_id, or the message coordinates for events emitted without one
+    data["_id"] = data.pop("event_id", None) or f"{msg.topic()}-{msg.partition()}-{msg.offset()}"
 
-# Subscribe to the topic
-consumer.subscribe([topic])
-print("Listening to the messages.............")
+    # Store timestamps as native BSON dates so range filters and sorts can use the index
+    if isinstance(data.get("timestamp"), str):
+        data["timestamp"] = datetime.fromisoformat(data["timestamp"])
+    return data
 
-try:
-    while True:
-        # Poll for messages (wait up to 1 second)
-        msg = consumer.poll(timeout=1.0)
-        
-        if msg is None:
-            continue  # No message received
 
+def handle_messages(msgs, sink):
+    # Decode a batch of Kafka messages and buffer them in the sink
+    for msg in msgs:
         if msg.error():
             # Handle errors
             if msg.error().code() == KafkaError._PARTITION_EOF:
                 # End of partition event
-                print(f"End of partition reached {msg.partition()}")
+                log.debug("End of partition reached %d", msg.partition())
             else:
-                print(f"Consumer Error: {msg.error()}")
+                log.error("Consumer error: %s", msg.error())
             continue
 
+        # Messages that cannot be stored go to the dead-letter queue, the batch carries on.
+        # Nothing a single message contains may escape the loop: offsets of the batch would be
+        # committed on the way out, losing the valid events consumed after it.
         try:
-            # Decode the message value
-            data = json.loads(msg.value().decode('utf-8'))
-            print(f"Data to insert: {data}")  # Debug print
-
-            # Check the event_type and insert into the appropriate collection
-            if data.get("event_type") == "add_to_cart":
-                activity_col.insert_one(data)
-                print(f"Inserted into activity_col: {data}")
-            elif data.get("event_type") == "checkout":
-                Order_col.insert_one(data)
-                print(f"Inserted into Order_col: {data}")
-            else:
-                print(f"Unknown event_type: {data.get('event_type')}")
+            data = to_document(msg)
+        except SerializationError as e:
+            sink.reject("decode_error", e, msg=msg)
+            continue
+        except ValueError as e:
+            sink.reject("invalid_timestamp", f"Invalid timestamp: {e}", msg=msg)
+            continue
+        except Exception as e:
+            sink.reject("malformed_event", f"{type(e).__name__}: {e}", msg=msg)
+            continue
 
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error: {e}")
+        # Check the event_type and buffer it for the appropriate collection
+        try:
+            added = sink.add(data)
         except Exception as e:
-            print(f"MongoDB insert error: {e}")
+            sink.reject("malformed_event", f"{type(e).__name__}: {e}", msg=msg)
+            continue
+        if not added:
+            sink.reject("unknown_event_type", f"Unknown event_type: {data.get('event_type')}", msg=msg, event=data)
+
+
+def commit(consumer):
+    try:
+        consumer.commit(asynchronous=False)
+    except Exception as e:
+        # Nothing consumed since the last commit, or the group is rebalancing
+        log.info("Offset commit skipped: %s", e)
+
+
+def flush_and_commit(consumer, sink):
+    # Commit offsets only after the buffered batch has landed in MongoDB
+    if sink.pending and sink.flush():
+        commit(consumer)
+
+
+def drain(consumer, sink, timeout=SHUTDOWN_TIMEOUT):
+    # Flush what is still buffered on shutdown, waiting out the sink's backoff between attempts.
+    # Events still unwritten after `timeout` seconds are dead-lettered and their offsets
+    # committed; without a dead-letter queue they stay uncommitted and are consumed again.
+    deadline = time.monotonic() + timeout
+    while sink.pending and time.monotonic() < deadline:
+        wait = min(sink.retry_at, deadline) - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+            continue
+        flush_and_commit(consumer, sink)
+        sink.tick()
+    if not sink.pending:
+        return
+    log.error("%d events still unwritten after %.0fs of shutdown, dead-lettering them", sink.pending, timeout,
+              extra={"count": sink.pending})
+    if sink.dead_letter_pending("shutdown", "MongoDB unavailable at shutdown"):
+        commit(consumer)
+
+
+def run(consumer, sink, should_stop=lambda: False, drain_timeout=SHUTDOWN_TIMEOUT):
+    # Consume in batches until should_stop() returns True, then drain the buffer. While MongoDB
+    # is failing and the buffered events reach the sink's cap, the assigned partitions are
+    # paused: consume() keeps the group membership alive but returns nothing until a flush succeeds.
+    paused = False
+    while not should_stop():
+        if sink.full and not paused:
+            consumer.pause(consumer.assignment())
+            paused = True
+            log.warning("Paused consuming with %d events pending", sink.pending)
+        msgs = consumer.consume(num_messages=sink.batch_size, timeout=1.0)
+        handle_messages(msgs, sink)
+        if sink.should_flush():
+            flush_and_commit(consumer, sink)
+        if paused and not sink.full:
+            consumer.resume(consumer.assignment())
+            paused = False
+            log.info("Resumed consuming")
+        sink.tick()
+    drain(consumer, sink, drain_timeout)
+
+
+def connect_mongo():
+    # MongoDB connection, exits the process if the deployment is unreachable
+    client = MongoClient(os.getenv("MONGODB_URL"), server_api=ServerApi('1'))
+
+    # Test MongoDB connection
+    try:
+        client.admin.command('ping')
+        log.info("Pinged your deployment. You successfully connected to MongoDB!")
+    except Exception as e:
+        log.critical("MongoDB connection error: %s", e)
+        exit(1)  # Exit the script if MongoDB connection fails
+    return client
+
+
+def create_sink(client, dlq=None, retry=RETRY_WORKER, sessionize=SESSIONIZE):
+    # Access the database and collections
+    db = client[os.getenv('DB')]
+    Order_col = db[os.getenv('Order_col')]  # Collection for checkout events
+    activity_col = db[os.getenv('activity')]  # Collection for add_to_cart events
+    create_activity_collection(db, activity_col.name, timeseries=ACTIVITY_TIMESERIES)
+    ensure_indexes(activity_col, Order_col)
+
+    collections = {"add_to_cart": activity_col, "checkout": Order_col}
+    sketches = SketchWriter(db)
+    dlq = dlq or FileDLQ(DLQ_PATH)
+    sessions = None
+    if sessionize:
+        sessions = SessionAggregator(db)
+        sessions.restore()
+    retries = None
+    if retry:
+        # The worker writes through its own sink, the consumer loop never waits on it
+        retry_sink = BatchSink(collections, rollups=RollupWriter(db), dlq=dlq, sessions=sessions, sketches=sketches)
+        retries = RetryWorker(retry_sink, dlq)
+    return BatchSink(
+        collections,
+        batch_size=BATCH_SIZE,
+        linger_ms=LINGER_MS,
+        max_pending=MAX_PENDING,
+        rollups=RollupWriter(db),
+        dlq=dlq,
+        retries=retries,
+        sessions=sessions,
+        sketches=sketches,
+    )
+
+
+def subscribe(consumer, sink):
+    # Flush in-flight events and commit before partitions move to another group member
+    def on_revoke(consumer, partitions):
+        flush_and_commit(consumer, sink)
+
+    consumer.subscribe([topic], on_revoke=on_revoke)
+
+
+if __name__ == "__main__":
+    configure_logging()
+    start_metrics_server()
+
+    # Create a consumer instance
+    consumer = Consumer(conf)
+    client = connect_mongo()
+    sink = create_sink(client)
+
+    # Subscribe to the topic
+    subscribe(consumer, sink)
+    log.info("Listening to the messages")
+
+    try:
+        # Samples the poll loop into PROFILE_OUTPUT when it is set
+        with profiled():
+            run(consumer, sink)
+
+    except KeyboardInterrupt:
+        pass
 
-except Exception as e:
-    print(f"An error occurred: {e}")
+    except Exception as e:
+        log.exception("An error occurred: %s", e)
 
-finally:
-    # Close the consumer and MongoDB client gracefully
-    consumer.close()
-    client.close()
-    print("Consumer and MongoDB client closed.")
\ No newline at end of file
+    finally:
+        # Flush what is still buffered, then close the consumer and MongoDB client gracefully
+        drain(consumer, sink)
+        consumer.close()
+        sink.close()
+        client.close()
+        log.info("Consumer and MongoDB client closed")
@@ -0,0 +1,134 @@
+import logging
+import multiprocessing as mp
+import os
+import signal
+import time
+
+import consumer as single
+from telemetry import METRICS_PORT, configure_logging, start_metrics_server
+
+log = logging.getLogger(__name__)
+
+# Pool configuration
+WORKERS = int(os.getenv("CONSUMER_WORKERS", 0))  # 0 = one worker per topic partition, else per CPU
+REPORT_INTERVAL = float(os.getenv("POOL_REPORT_INTERVAL", 10))  # Seconds between throughput reports
+
+
+def default_workers():
+    # One worker per partition of the topic, or per CPU when the metadata is unavailable
+    probe = single.Consumer(single.conf)
+    try:
+        metadata = probe.list_topics(single.topic, timeout=10)
+        partitions = len(metadata.topics[single.topic].partitions)
+        if partitions:
+            return partitions
+    except Exception as e:
+        log.warning("Could not read partition count: %s", e)
+    finally:
+        probe.close()
+    return os.cpu_count() or 1
+
+
+def kafka_worker_resources(index):
+    # Each worker process owns its own Kafka consumer and MongoDB client
+    client = single.connect_mongo()
+    return single.Consumer(single.conf), single.create_sink(client), client.close
+
+
+def worker(index, stop, written, resources=kafka_worker_resources):
+    # Consume until the supervisor sets `stop`, publishing landed events to the shared counter
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Shutdown is driven by the supervisor
+    configure_logging()
+    if METRICS_PORT:
+        # One endpoint per worker process, on consecutive ports
+        start_metrics_server(METRICS_PORT + index)
+    consumer, sink, close = resources(index)
+    single.subscribe(consumer, sink)
+    reported = 0
+
+    def should_stop():
+        nonlocal reported
+        if sink.written != reported:
+            with written.get_lock():
+                written.value += sink.written - reported
+            reported = sink.written
+        return stop.is_set()
+
+    try:
+        single.run(consumer, sink, should_stop=should_stop)
+    except Exception as e:
+        log.exception("Worker %d error: %s", index, e)
+    finally:
+        single.drain(consumer, sink)
+        should_stop()
+        consumer.close()
+        sink.close()
+        close()
+        log.info("Worker %d closed", index)
+
+
+class ConsumerPool:
+    """Supervises N consumer processes in the same consumer group."""
+
+    def __init__(self, n_workers, resources=kafka_worker_resources):
+        self.n_workers = n_workers
+        self.resources = resources
+        self.stop = mp.Event()
+        self.written = mp.Value('q', 0)
+        self.processes = {}
+
+    def _spawn(self, index):
+        process = mp.Process(
+            target=worker,
+            args=(index, self.stop, self.written, self.resources),
+            name=f"consumer-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.n_workers):
+            self._spawn(index)
+
+    def restart_dead(self):
+        # Replace workers that exited on their own, the group rebalances their partitions meanwhile
+        for index, process in list(self.processes.items()):
+            if not process.is_alive() and not self.stop.is_set():
+                log.warning("Worker %d exited with %s, restarting", index, process.exitcode)
+                self._spawn(index)
+
+    def alive(self):
+        return sum(process.is_alive() for process in self.processes.values())
+
+    def shutdown(self, timeout=30):
+        self.stop.set()
+        for process in self.processes.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+    def supervise(self, interval=REPORT_INTERVAL):
+        # Report aggregate throughput until interrupted
+        last_written, last_time = self.written.value, time.monotonic()
+        try:
+            while True:
+                time.sleep(interval)
+                self.restart_dead()
+                now, written = time.monotonic(), self.written.value
+                rate = (written - last_written) / (now - last_time)
+                log.info("%d workers, %d events written, %.0f events/sec", self.alive(), written, rate,
+                         extra={"workers": self.alive(), "written": written, "rate": rate})
+                last_written, last_time = written, now
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+
+if __name__ == "__main__":
+    configure_logging()
+    n_workers = WORKERS or default_workers()
+    log.info("Starting %d consumer workers", n_workers)
+    pool = ConsumerPool(n_workers)
+    pool.start()
+    pool.supervise()
@@ -1,11 +1,17 @@
 import streamlit as st
+import logging
 from itertools import cycle
 from confluent_kafka import Producer
-import json
-from datetime import datetime
 from dotenv import load_dotenv
+import io
 import os
 import sys
+import uuid
+from PIL import Image
+import catalog
+from emitter import EventEmitter, producer_conf
+from events import activity_event, checkout_event
+from telemetry import configure_logging, start_metrics_server
 sys.path.append("F:\\Data Engineering\\kafka_fraud_detection")
 
 # Load environment variables
@@ -20,12 +26,21 @@ conf = {
     'sasl.password': os.getenv("api_secret"), 
 }
 
-# Create a producer instance
-producer = Producer(conf)
-
 # Topic to produce messages to
 topic = os.getenv("topic")
 
+log = logging.getLogger(__name__)
+
+# One producer per server process, kept alive across reruns and shared by all sessions
+@st.cache_resource
+def get_emitter():
+    configure_logging()
+    start_metrics_server()
+    producer = Producer(producer_conf(conf))
+    return EventEmitter(producer, topic, max_queue=int(os.getenv("EMIT_QUEUE_SIZE", 10000)))
+
+emitter = get_emitter()
+
 
 
 # Page configuration
@@ -63,95 +78,31 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-# Product data with valid names
-products = [
-    # Books
-    {"id": i, "name": name, "price": price, "image": "atomic_habits.jpg", "description": desc, "category": "Books"}
-    for i, (name, price, desc) in enumerate([
-        ("Atomic Habits", 15.99, "Transform your habits and change your life."),
-        ("The Power of Now", 13.99, "A guide to spiritual enlightenment."),
-        ("The 5 AM Club", 14.99, "Own your morning, elevate your life."),
-        ("Think and Grow Rich", 12.99, "Classic book on success mindset."),
-        ("The Subtle Art of Not Giving a F*ck", 16.99, "A counterintuitive approach to living a good life."),
-        ("You Are a Badass", 14.49, "How to stop doubting and start living."),
-        ("Daring Greatly", 17.49, "The power of vulnerability."),
-        ("Grit", 18.99, "Passion and perseverance for long-term goals."),
-        ("Mindset", 19.99, "The new psychology of success."),
-        ("Can't Hurt Me", 20.99, "Master your mind and defy the odds.")
-    ], 1)
-] + [
-    # Electronics
-    {"id": i, "name": name, "price": price, "image": f"https://via.placeholder.com/150?text={name.replace(' ', '+')}", "description": desc, "category": "Electronics"}
-    for i, (name, price, desc) in enumerate([
-        ("iPhone 15", 999.99, "Latest Apple iPhone with A17 chip."),
-        ("Samsung Galaxy S24", 899.99, "Flagship smartphone from Samsung."),
-        ("MacBook Pro", 1299.99, "Apple's latest powerful laptop."),
-        ("Sony WH-1000XM5", 349.99, "Noise-canceling wireless headphones."),
-        ("iPad Air", 599.99, "Powerful tablet from Apple."),
-        ("Dell XPS 15", 1399.99, "High-performance laptop from Dell."),
-        ("Bose QuietComfort 45", 329.99, "Premium noise-canceling headphones."),
-        ("GoPro Hero 11", 499.99, "Action camera for adventurers."),
-        ("Nintendo Switch", 299.99, "Hybrid gaming console."),
-        ("Kindle Paperwhite", 129.99, "E-reader with glare-free display.")
-    ], 11)
-] + [
-    # Fashion
-    {"id": i, "name": name, "price": price, "image": f"https://via.placeholder.com/150?text={name.replace(' ', '+')}", "description": desc, "category": "Fashion"}
-    for i, (name, price, desc) in enumerate([
-        ("Nike Air Max", 149.99, "Comfortable and stylish sneakers."),
-        ("Adidas Ultraboost", 179.99, "Premium running shoes."),
-        ("Levi's 501 Jeans", 69.99, "Classic straight fit jeans."),
-        ("Ray-Ban Aviators", 129.99, "Iconic sunglasses for a cool look."),
-        ("Casio G-Shock Watch", 99.99, "Durable and stylish wristwatch."),
-        ("North Face Jacket", 199.99, "Warm and waterproof winter jacket."),
-        ("Michael Kors Handbag", 249.99, "Elegant designer handbag."),
-        ("Polo Ralph Lauren Shirt", 89.99, "Casual and sophisticated shirt."),
-        ("Timberland Boots", 159.99, "Classic outdoor boots."),
-        ("Fossil Leather Wallet", 49.99, "Premium leather wallet.")
-    ], 21)
-] + [
-    # Digital Subscriptions
-    {"id": i, "name": name, "price": price, "image": f"https://via.placeholder.com/150?text={name.replace(' ', '+')}", "description": desc, "category": "Digital Subscriptions"}
-    for i, (name, price, desc) in enumerate([
-        ("Netflix Premium", 15.99, "Unlimited movies and TV shows."),
-        ("Spotify Family", 14.99, "Ad-free music streaming for the family."),
-        ("Amazon Prime", 12.99, "Fast delivery and streaming benefits."),
-        ("Disney+", 7.99, "Stream Disney, Pixar, Marvel, and Star Wars."),
-        ("Adobe Creative Cloud", 52.99, "Suite of creative apps."),
-        ("Microsoft 365", 69.99, "Office apps and cloud storage."),
-        ("YouTube Premium", 11.99, "Ad-free videos and music."),
-        ("Audible", 14.95, "Unlimited audiobooks and podcasts."),
-        ("NYTimes Digital", 9.99, "Unlimited news articles online."),
-        ("PlayStation Plus", 9.99, "Online gaming and free monthly games.")
-    ], 31)
-]
+# Products shown per category until "Show more" is clicked, 0 shows them all
+PAGE_SIZE = int(os.getenv("STOREFRONT_PAGE_SIZE", 20))
+# Product images are scaled to this width, twice a card's in the five-column grid; 0 keeps the file's
+IMAGE_WIDTH = int(os.getenv("STOREFRONT_IMAGE_WIDTH", 480))
 
 # Initialize session state for cart
 if "cart" not in st.session_state:
     st.session_state.cart = {}
 
+# One id per browser session, carried by every event so the consumer can build funnels
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+
 def delivery_callback(err, msg):
+    # Delivery counts and latency are in the emitter's metrics, only failures are worth a line
     if err:
-        print(f'Message delivery failed: {err}')
+        log.warning("Message delivery failed: %s", err)
     else:
-        print(f'Message delivered to {msg.topic()} [{msg.partition()}]')
+        log.debug("Message delivered to %s [%d]", msg.topic(), msg.partition())
 
 def log_activity(event_type, product):
-    event = {
-        "event_type": event_type,
-        "product_id": product["id"],
-        "product_name": product["name"],
-        "category": product["category"],
-        "price": product["price"],
-        "timestamp": datetime.utcnow().isoformat()
-    }
-    try:
-        producer.produce(topic, key=str(product["id"]), value=json.dumps(event), callback=delivery_callback)
-    except Exception as e:
-        print(f"Error producing message: {e}")
-
-    producer.flush(timeout=10)  # Add a timeout to avoid indefinite blocking
-    print("All messages sent to Kafka")
+    event = activity_event(event_type, product, st.session_state.session_id)
+    # Hand off to the background emitter instead of waiting for the broker. Keyed by session so
+    # a session's events share a partition, and so a consumer worker, for sessionization.
+    emitter.emit(st.session_state.session_id, event, callback=delivery_callback)
 
 def remove_from_cart(product_id):
     if product_id in st.session_state.cart:
@@ -164,6 +115,23 @@ def update_quantity(product_id, quantity_change):
         if st.session_state.cart[product_id]["quantity"] <= 0:
             remove_from_cart(product_id)
 
+def show_more(category):
+    shown = st.session_state.get(f"shown_{category}", PAGE_SIZE)
+    st.session_state[f"shown_{category}"] = shown + PAGE_SIZE
+
+# Local images are read and scaled down to card size once per server process; given the
+# full-size file, st.image would decode and resize it on every rerun. URLs are fetched by the browser.
+@st.cache_resource
+def product_image(source, width):
+    if source.startswith(("http://", "https://")):
+        return source
+    image = Image.open(source)
+    if width and image.width > width:
+        image = image.resize((width, round(image.height * width / image.width)))
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
 def add_to_cart(product):
     if product["id"] in st.session_state.cart:
         st.session_state.cart[product["id"]]["quantity"] += 1
@@ -173,22 +141,23 @@ def add_to_cart(product):
     log_activity("add_to_cart", product)  # Log activity
     st.success(f"{product['name']} added to cart!")
 
-# Display products by category
-# Display products by category
-categories = set([p["category"] for p in products])
-for category in categories:
+# Display products by category, from the catalog's prebuilt index
+for category, category_products in catalog.PRODUCTS_BY_CATEGORY.items():
     st.header(category)
-    category_products = [p for p in products if p["category"] == category]
+    shown = st.session_state.get(f"shown_{category}", PAGE_SIZE) if PAGE_SIZE else len(category_products)
     cols = cycle(st.columns(5))
-    for product in category_products:
+    for product in category_products[:shown]:
         with next(cols):
             with st.container():
-                st.image(product["image"], use_container_width=True)  # Updated parameter
+                st.image(product_image(product["image"], IMAGE_WIDTH), use_container_width=True)  # Updated parameter
                 st.subheader(product["name"])
                 st.write(product["description"])
                 st.write(f"**Price:** ${product['price']}")
                 if st.button(f"Add to Cart 🛒", key=f"add_{product['id']}"):
                     add_to_cart(product)
+    if shown < len(category_products):
+        st.button(f"Show more ({len(category_products) - shown} left)", key=f"more_{category}",
+                  on_click=show_more, args=(category,))
 
 # Shopping cart sidebar
 st.sidebar.title("🛒 Shopping Cart")
@@ -217,30 +186,12 @@ if st.session_state.cart:
         st.sidebar.markdown("</div>", unsafe_allow_html=True)
 
 def log_checkout():
-    event = {
-        "event_type": "checkout",
-        "timestamp": datetime.utcnow().isoformat(),
-        "cart_items": [
-            {
-                "product_id": item["product"]["id"],
-                "product_name": item["product"]["name"],
-                "quantity": item["quantity"],
-                "price": item["product"]["price"]
-            }
-            for item in st.session_state.cart.values()
-        ],
-        "total_price": sum(item["product"]["price"] * item["quantity"] for item in st.session_state.cart.values())
-    }
-
-    try:
-        producer.produce(topic, key="checkout", value=json.dumps(event), callback=delivery_callback)
-    except Exception as e:
-        print(f"Error producing message: {e}")
-
-    producer.flush(timeout=10)  # Add a timeout to avoid indefinite blocking
-    print("All messages sent to Kafka")
+    event = checkout_event(st.session_state.cart.values(), st.session_state.session_id)
 
-    # Clear cart only after successful Kafka message production
+    # Clear cart only once the order is queued for Kafka
+    if not emitter.emit(st.session_state.session_id, event, callback=delivery_callback):
+        st.sidebar.error("We could not place your order right now, please try again.")
+        return
     st.session_state.cart = {}
     st.sidebar.success("Thank you for your purchase! Your order has been placed.")
 
@@ -4,9 +4,14 @@ from pymongo import MongoClient
 from pymongo.server_api import ServerApi
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime
+from datetime import datetime, time, timedelta
 import os
 from dotenv import load_dotenv
+from archive import ArchiveReader
+from analytics import MongoMetrics, PandasMetrics, RollupMetrics, SketchMetrics, funnel_summary
+from catalog import enrich
+from live import start_live_feed
+from loader import FrameCache
 
 # Load environment variables
 load_dotenv()
@@ -17,36 +22,182 @@ st.set_page_config(
     layout="wide"
 )
 
-# MongoDB Connection
+# MongoDB Connection, one client and connection pool shared by every session of the app.
+# Size the pool for the concurrent users: each rerun holds a connection per running query.
 @st.cache_resource
 def init_connection():
     uri = os.getenv("MONGODB_URL")  # Fetch MongoDB URI from environment variables
-    client = MongoClient(uri, server_api=ServerApi('1'))
+    client = MongoClient(
+        uri,
+        server_api=ServerApi('1'),
+        maxPoolSize=int(os.getenv("DASHBOARD_MAX_POOL_SIZE", 100)),
+        minPoolSize=int(os.getenv("DASHBOARD_MIN_POOL_SIZE", 0)),
+        maxIdleTimeMS=int(os.getenv("DASHBOARD_MAX_IDLE_TIME_MS", 300000)),
+        waitQueueTimeoutMS=int(os.getenv("DASHBOARD_POOL_WAIT_MS", 10000)),  # Fail a query instead of hanging the page
+    )
     return client
 
-# Fetch data from MongoDB
-def get_data():
+# Loaded frames shared across reruns and sessions, topped up with new documents after the TTL.
+# Ranges reaching back past the retention window also read the Parquet archive.
+@st.cache_resource
+def get_frame_cache():
+    return FrameCache(ttl=int(os.getenv("DASHBOARD_CACHE_TTL", 60)), archive=ArchiveReader())
+
+# Fetch data from MongoDB for the selected date range
+def get_data(date_range=None):
     client = init_connection()
     db = client[os.getenv('DB')]  # Fetch database name from environment variables
-    
-    # Fetch data from collections
-    activity_data = list(db.user_activities.find({}, {'_id': 0}))
-    order_data = list(db.orders.find({}, {'_id': 0}))
-    
-    # Convert to DataFrames
-    activity_df = pd.DataFrame(activity_data)
-    order_df = pd.DataFrame(order_data)
-    
-    # Convert timestamp to datetime
-    if 'timestamp' in activity_df:
-        activity_df['timestamp'] = pd.to_datetime(activity_df['timestamp'])
-    if 'timestamp' in order_df:
-        order_df['timestamp'] = pd.to_datetime(order_df['timestamp'])
-    
+    cache = get_frame_cache()
+
+    # Fetch data from collections, only the documents inside the range
+    activity_df = cache.get(db.user_activities, date_range)
+    order_df = cache.get(db.orders, date_range)
+
     return activity_df, order_df
 
+# Pick where the metrics are computed: "rollups" reads the counters maintained by the consumer,
+# "mongo" runs aggregation pipelines over the raw events server-side (hot events only, not the archive),
+# "pandas" loads both collections and computes everything client-side, "sketches" is "rollups" with
+# unique and top products estimated from mergeable per-day sketches, for catalogs too large to scan.
+# "rollups" and "sketches" fill the Recent tables of ranges past the retention window from the archive.
+METRICS_BACKEND = os.getenv("DASHBOARD_BACKEND", "rollups")
+
+def get_metrics(date_range=None):
+    if METRICS_BACKEND == "pandas":
+        return PandasMetrics(*get_data(date_range))
+    client = init_connection()
+    db = client[os.getenv('DB')]
+    if METRICS_BACKEND == "mongo":
+        return MongoMetrics(db, date_range)
+    if METRICS_BACKEND == "sketches":
+        return SketchMetrics(db, date_range, archive=ArchiveReader())
+    return RollupMetrics(db, date_range, archive=ArchiveReader())
+
+def get_date_bounds():
+    # Cheap first/last day lookup that never loads the raw collections
+    client = init_connection()
+    db = client[os.getenv('DB')]
+    if METRICS_BACKEND in ("rollups", "sketches"):
+        return RollupMetrics(db).date_bounds()
+    bounds = MongoMetrics(db).date_bounds()
+    archived = ArchiveReader().days("user_activities") if METRICS_BACKEND == "pandas" else []
+    if archived:
+        first = pd.Timestamp(archived[0]).date()
+        bounds = (first, bounds[1]) if bounds else (first, pd.Timestamp(archived[-1]).date())
+    return bounds
+
+def selected_range(date_range, min_date, max_date):
+    # Picker dates to a (start, end) datetime pair, end exclusive.
+    # Edges left at the data bounds stay open so events arriving today are included.
+    if len(date_range) != 2:
+        return None
+    start_date, end_date = date_range
+    start = None if start_date <= min_date else datetime.combine(start_date, time.min)
+    end = None if end_date >= max_date else datetime.combine(end_date + timedelta(days=1), time.min)
+    if start is None and end is None:
+        return None
+    return start, end
+
+# Live mode: one tail per server process feeding in-memory aggregates, shared by all sessions
+LIVE_REFRESH = float(os.getenv("DASHBOARD_LIVE_REFRESH", 2))  # Seconds between panel refreshes
+
+@st.cache_resource
+def get_live_feed():
+    client = init_connection()
+    return start_live_feed(client[os.getenv('DB')])
+
+def live_figure(aggregates, panel, build):
+    # Rebuild a panel's figure only when new events changed it since this session last drew it
+    figures = st.session_state.setdefault("live_figures", {})
+    version = aggregates.version(panel)
+    if panel not in figures or figures[panel][0] != version:
+        figures[panel] = (version, build())
+    return figures[panel][1]
+
+def render_live(aggregates):
+    # Each panel is a fragment rerun on its own timer, the rest of the page is not rerun
+    st.title("📡 Live E-Commerce Activity")
+
+    @st.fragment(run_every=LIVE_REFRESH)
+    def key_metrics_panel():
+        key_metrics = aggregates.key_metrics()
+        col_metrics = st.columns(4)
+        col_metrics[0].metric("Total Orders", key_metrics["total_orders"])
+        col_metrics[1].metric("Total Activities", key_metrics["total_activities"])
+        col_metrics[2].metric("Unique Products", key_metrics["unique_products"])
+        col_metrics[3].metric("Total Revenue", f"${key_metrics['total_revenue']:,.2f}")
+
+    @st.fragment(run_every=LIVE_REFRESH)
+    def timeline_panel():
+        st.subheader("Orders per Minute")
+        def build():
+            timeline = pd.DataFrame(aggregates.timeline(), columns=["minute", "count"])
+            figure = px.line(timeline, x="minute", y="count")
+            figure.update_layout(xaxis_title="Minute", yaxis_title="Number of Orders")
+            return figure
+        st.plotly_chart(live_figure(aggregates, "timeline", build), use_container_width=True)
+
+    @st.fragment(run_every=LIVE_REFRESH)
+    def top_products_panel():
+        st.subheader("Top Selling Products")
+        def build():
+            top = pd.DataFrame(aggregates.top_products(10), columns=["product_name", "total_quantity"])
+            figure = px.bar(top, x="product_name", y="total_quantity")
+            figure.update_layout(xaxis_title="Product", yaxis_title="Total Quantity Sold")
+            return figure
+        st.plotly_chart(live_figure(aggregates, "top_products", build), use_container_width=True)
+
+    @st.fragment(run_every=LIVE_REFRESH)
+    def recent_panel():
+        activities, orders = aggregates.recent()
+        st.subheader("Recent Activities")
+        if activities:
+            st.dataframe(enrich(pd.DataFrame(activities))[['timestamp', 'product_name', 'category', 'price']],
+                         use_container_width=True)
+        else:
+            st.write("Waiting for new activities...")
+        st.subheader("Recent Orders")
+        if orders:
+            order_items = pd.DataFrame(
+                [{"timestamp": order["timestamp"], **item} for order in orders for item in order.get("cart_items", [])]
+            )
+            st.dataframe(enrich(order_items)[['timestamp', 'product_name', 'quantity', 'price']],
+                         use_container_width=True)
+        else:
+            st.write("Waiting for new orders...")
+
+    key_metrics_panel()
+    col1, col2 = st.columns(2)
+    with col1:
+        timeline_panel()
+    with col2:
+        top_products_panel()
+    recent_panel()
+
+if st.sidebar.toggle("Live mode", value=os.getenv("DASHBOARD_LIVE") == "1"):
+    render_live(get_live_feed().aggregates)
+    st.stop()
+
+# Sidebar filters
+st.sidebar.title("Filters")
+# Date range filter
+date_bounds = get_date_bounds()
+date_range = None
+if date_bounds is not None:
+    min_date, max_date = date_bounds
+    picked = st.sidebar.date_input(
+        "Select Date Range",
+        value=(min_date, max_date),
+        min_value=min_date,
+        max_value=max_date
+    )
+    date_range = selected_range(picked, min_date, max_date)
+else:
+    st.sidebar.write("No activity data available for filtering.")
+
 # Load data
-activity_df, order_df = get_data()
+metrics = get_metrics(date_range)
+key_metrics = metrics.key_metrics()
 
 # Layout
 st.title("📊 E-Commerce Customer Behavior Analysis Dashboard")
@@ -56,19 +207,19 @@ st.subheader("Key Metrics")
 col_metrics = st.columns(4)
 
 with col_metrics[0]:
-    total_orders = len(order_df)
+    total_orders = key_metrics["total_orders"]
     st.metric("Total Orders", total_orders)
 
 with col_metrics[1]:
-    total_activities = len(activity_df)
+    total_activities = key_metrics["total_activities"]
     st.metric("Total Activities", total_activities)
 
 with col_metrics[2]:
-    unique_products = activity_df['product_name'].nunique()
+    unique_products = key_metrics["unique_products"]
     st.metric("Unique Products", unique_products)
 
 with col_metrics[3]:
-    total_revenue = order_df['total_price'].sum()
+    total_revenue = key_metrics["total_revenue"]
     st.metric("Total Revenue", f"${total_revenue:,.2f}")
 
 # Second row - Charts
@@ -76,14 +227,9 @@ col1, col2 = st.columns(2)
 
 with col1:
     st.subheader("Order Timeline")
-    if not order_df.empty:
-        # Group by date and count orders
-        daily_orders = order_df.groupby(order_df['timestamp'].dt.date).size().reset_index()
-        daily_orders.columns = ['date', 'count']
-        
-        # Convert the 'date' column to string format
-        daily_orders['date'] = daily_orders['date'].astype(str)
-        
+    # Orders counted per day, with the date already formatted as a string
+    daily_orders = metrics.daily_orders()
+    if not daily_orders.empty:
         # Create the line chart
         timeline = px.line(
             daily_orders,
@@ -102,11 +248,11 @@ with col1:
 
 with col2:
     st.subheader("Product Distribution")
-    if not activity_df.empty:
-        product_dist = activity_df['product_name'].value_counts()
+    product_dist = metrics.product_distribution()
+    if not product_dist.empty:
         product_pie = px.pie(
-            values=product_dist.values,
-            names=product_dist.index,
+            values=product_dist['count'],
+            names=product_dist['product_name'],
             title='Top Products Added to Cart'
         )
         st.plotly_chart(product_pie, use_container_width=True)
@@ -118,11 +264,11 @@ col3, col4 = st.columns(2)
 
 with col3:
     st.subheader("Category Distribution")
-    if not activity_df.empty:
-        category_dist = activity_df['category'].value_counts()
+    category_dist = metrics.category_distribution()
+    if not category_dist.empty:
         category_bar = px.bar(
-            x=category_dist.index,
-            y=category_dist.values,
+            x=category_dist['category'],
+            y=category_dist['count'],
             title='Activities by Category'
         )
         category_bar.update_layout(
@@ -135,15 +281,8 @@ with col3:
 
 with col4:
     st.subheader("Top Selling Products")
-    if not order_df.empty:
-        # Flatten cart_items to get product-level details
-        order_items = order_df.explode('cart_items')
-        order_items = pd.concat([order_items.drop(['cart_items'], axis=1), order_items['cart_items'].apply(pd.Series)], axis=1)
-        
-        top_products = order_items.groupby('product_name')['quantity'].sum().sort_values(ascending=False).head(10)
-        top_products_df = pd.DataFrame(top_products).reset_index()
-        top_products_df.columns = ['product_name', 'total_quantity']
-        
+    top_products_df = metrics.top_products(10)
+    if not top_products_df.empty:
         top_products_chart = px.bar(
             top_products_df,
             x='product_name',
@@ -158,10 +297,21 @@ with col4:
     else:
         st.write("No order data available.")
 
+# Session funnel, kept up to date by the consumer as sessions close
+funnel = funnel_summary(init_connection()[os.getenv('DB')], date_range)
+if not funnel.empty:
+    st.subheader("Conversion Funnel")
+    sessions, carts, checkouts = funnel['count']
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Sessions", f"{sessions:,}")
+    col2.metric("Cart → Checkout", f"{checkouts / carts:.1%}" if carts else "n/a")
+    col3.metric("Cart Abandonment", f"{(carts - checkouts) / carts:.1%}" if carts else "n/a")
+    st.plotly_chart(px.funnel(funnel, x='count', y='stage'), use_container_width=True)
+
 # Recent Activity Table
 st.subheader("Recent Activities")
-if not activity_df.empty:
-    recent_activities = activity_df.sort_values('timestamp', ascending=False).head(10)
+recent_activities = metrics.recent_activities(10)
+if not recent_activities.empty:
     st.dataframe(
         recent_activities[['timestamp', 'product_name', 'category', 'price']],
         use_container_width=True
@@ -171,13 +321,9 @@ else:
 
 # Recent Orders Table
 st.subheader("Recent Orders")
-if not order_df.empty:
-    recent_orders = order_df.sort_values('timestamp', ascending=False).head(10)
-    
-    # Flatten cart_items for display
-    recent_orders_flattened = recent_orders.explode('cart_items')
-    recent_orders_flattened = pd.concat([recent_orders_flattened.drop(['cart_items'], axis=1), recent_orders_flattened['cart_items'].apply(pd.Series)], axis=1)
-    
+# Last 10 orders, flattened to one row per cart item
+recent_orders_flattened = metrics.recent_orders(10)
+if not recent_orders_flattened.empty:
     # Display flattened data
     st.dataframe(
         recent_orders_flattened[['timestamp', 'product_name', 'quantity', 'price']],
@@ -185,18 +331,3 @@ if not order_df.empty:
     )
 else:
     st.write("No recent orders available.")
-
-# Sidebar filters
-st.sidebar.title("Filters")
-# Date range filter
-if not activity_df.empty:
-    min_date = activity_df['timestamp'].min().date()
-    max_date = activity_df['timestamp'].max().date()
-    date_range = st.sidebar.date_input(
-        "Select Date Range",
-        value=(min_date, max_date),
-        min_value=min_date,
-        max_value=max_date
-    )
-else:
-    st.sidebar.write("No activity data available for filtering.")
\ No newline at end of file
@@ -0,0 +1,356 @@
+import base64
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from telemetry import RETRY_PENDING
+
+log = logging.getLogger(__name__)
+
+# Dead-letter queue: an append-only JSON-lines file of events the consumer could not store,
+# with the reason, the error and where each event came from. `python dlq.py replay` feeds them
+# back through the sink once the cause is fixed; events already stored are skipped by _id.
+DLQ_PATH = os.getenv("DLQ_PATH", "dlq.jsonl")
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 5))  # Writes per batch before giving up
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 1))  # Seconds before the first retry, doubled after each
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 60))
+# Events waiting for a retry; beyond it failed batches stay buffered in the consumer, which
+# backs off and pauses polling at MAX_PENDING buffered events
+RETRY_MAX_PENDING = int(os.getenv("RETRY_MAX_PENDING", 50000))
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _b64(value):
+    if value is None:
+        return None
+    return base64.b64encode(value if isinstance(value, bytes) else str(value).encode("utf-8")).decode("ascii")
+
+
+def _unb64(value):
+    return None if value is None else base64.b64decode(value)
+
+
+def dead_letter(reason, error, msg=None, event=None, batch=None, attempts=0):
+    # One DLQ record; the raw message when there is one, so undecodable values can be replayed
+    record = {
+        "reason": reason,
+        "error": str(error),
+        "attempts": attempts,
+        "failed_at": datetime.utcnow().isoformat(),
+    }
+    if batch is not None:
+        record["batch"] = batch
+    if msg is not None:
+        record["source"] = {
+            "topic": msg.topic(),
+            "partition": msg.partition(),
+            "offset": msg.offset(),
+            "key": _b64(msg.key()),
+        }
+        record["value"] = _b64(msg.value())
+        record["headers"] = [[name, _b64(value)] for name, value in (msg.headers() or [])]
+    if event is not None:
+        record["event"] = event
+    return record
+
+
+class DeadLetterMessage:
+    """A dead-lettered Kafka message, shaped like confluent_kafka.Message for consumer.to_document."""
+
+    def __init__(self, record):
+        self.record = record
+        self.source = record.get("source", {})
+
+    def value(self):
+        return _unb64(self.record.get("value"))
+
+    def key(self):
+        return _unb64(self.source.get("key"))
+
+    def topic(self):
+        return self.source.get("topic")
+
+    def partition(self):
+        return self.source.get("partition")
+
+    def offset(self):
+        return self.source.get("offset")
+
+    def headers(self):
+        return [(name, _unb64(value)) for name, value in self.record.get("headers", [])]
+
+    def error(self):
+        return None
+
+
+class FileDLQ:
+    """Append-only JSON-lines file. Records are buffered until flush(), which fsyncs them."""
+
+    def __init__(self, path=DLQ_PATH):
+        self.path = path
+        self.buffer = []
+        self.written = 0
+        self.lock = threading.Lock()  # Shared by the consumer loop and the retry worker
+
+    def put(self, record):
+        line = json.dumps(record, default=_json_default)
+        with self.lock:
+            self.buffer.append(line)
+
+    def flush(self):
+        with self.lock:
+            if not self.buffer:
+                return
+            # A single write per flush keeps lines whole when several consumers share the file
+            with open(self.path, "a") as f:
+                f.write("\n".join(self.buffer) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.written += len(self.buffer)
+            self.buffer.clear()
+
+
+class MemoryDLQ:
+    """Collects records in a list, for replays and benchmarks."""
+
+    def __init__(self):
+        self.records = []
+
+    def put(self, record):
+        self.records.append(record)
+
+    def flush(self):
+        pass
+
+
+def read_dead_letters(path=DLQ_PATH):
+    # Records still dead: batches the retry worker later stored are dropped, and the
+    # attempts and last error of batches it gave up on are filled in
+    if not os.path.exists(path):
+        return []
+    records, resolved, gave_up = [], set(), {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "resolved" in record:
+                resolved.add(record["resolved"])
+            elif "gave_up" in record:
+                gave_up[record["gave_up"]] = record
+            else:
+                records.append(record)
+    dead = []
+    for record in records:
+        batch = record.get("batch")
+        if batch in resolved:
+            continue
+        if batch in gave_up:
+            record = dict(record, reason="retries_exhausted", attempts=gave_up[batch]["attempts"],
+                          error=gave_up[batch]["error"], failed_at=gave_up[batch]["failed_at"])
+        dead.append(record)
+    return dead
+
+
+class RetryBatch:
+    def __init__(self, event_type, docs):
+        self.id = uuid.uuid4().hex
+        self.event_type = event_type
+        self.docs = docs
+        self.attempts = 1  # The consumer's own write failed once already
+
+
+class RetryWorker:
+    """Retries batches that failed to write, in a background thread with exponential backoff.
+
+    The consumer hands a failed batch over and keeps polling. Each batch is journaled to the
+    DLQ first, so committing its offsets loses nothing if the process dies before the retry
+    lands; a marker is appended once it does. Batches still failing after `max_attempts`
+    writes stay in the DLQ for `python dlq.py replay`. At most `max_pending` events wait at
+    a time, past that submit() refuses and the consumer falls back to keeping its buffer.
+    """
+
+    def __init__(self, sink, dlq, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY, max_pending=RETRY_MAX_PENDING):
+        self.sink = sink  # BatchSink the retries write through, not shared with the consumer loop
+        self.dlq = dlq
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.queue = []  # Heap of (due, sequence, batch)
+        self.sequence = itertools.count()
+        self.pending = 0
+        self.stats = Counter()
+        self.cond = threading.Condition()
+        self.closed = False
+        RETRY_PENDING.set_function(lambda: self.pending)
+        self._thread = threading.Thread(target=self._run, name="retry-worker", daemon=True)
+        self._thread.start()
+
+    def backoff(self, attempts):
+        # Jitter keeps batches that failed together from retrying together
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    def submit(self, event_type, docs, error):
+        # Take over a failed batch; False when the retry queue is full
+        with self.cond:
+            if self.closed or self.pending + len(docs) > self.max_pending:
+                self.stats["refused"] += 1
+                return False
+            batch = RetryBatch(event_type, docs)
+            for doc in docs:
+                self.dlq.put(dead_letter("write_error", error, event=doc, batch=batch.id, attempts=1))
+            heapq.heappush(self.queue, (time.monotonic() + self.backoff(1), next(self.sequence), batch))
+            self.pending += len(docs)
+            self.stats["submitted"] += 1
+            self.cond.notify()
+        return True
+
+    def _next(self):
+        # The next batch that is due; on close, whatever is left without waiting
+        with self.cond:
+            while True:
+                if self.queue and (self.closed or self.queue[0][0] <= time.monotonic()):
+                    return heapq.heappop(self.queue)[2]
+                if self.closed:
+                    return None
+                self.cond.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+
+    def _run(self):
+        while True:
+            batch = self._next()
+            if batch is None:
+                return
+            self._retry(batch)
+
+    def _retry(self, batch):
+        try:
+            self.sink.write(batch.event_type, batch.docs, retried=True)
+        except Exception as e:
+            batch.attempts += 1
+            with self.cond:
+                if batch.attempts < self.max_attempts and not self.closed:
+                    due = time.monotonic() + self.backoff(batch.attempts)
+                    heapq.heappush(self.queue, (due, next(self.sequence), batch))
+                    self.stats["retried"] += 1
+                    return
+                self.pending -= len(batch.docs)
+                self.stats["gave_up"] += 1
+            log.error("Giving up on %d %s events after %d attempts: %s", len(batch.docs), batch.event_type,
+                      batch.attempts, e, extra={"batch": batch.id})
+            self.dlq.put({"gave_up": batch.id, "attempts": batch.attempts, "error": str(e),
+                          "failed_at": datetime.utcnow().isoformat()})
+        else:
+            with self.cond:
+                self.pending -= len(batch.docs)
+                self.stats["resolved"] += 1
+            self.dlq.put({"resolved": batch.id})
+        self.dlq.flush()
+
+    def close(self):
+        # Try every waiting batch once more, what still fails is left in the DLQ
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self._thread.join()
+        self.dlq.flush()
+
+
+def replay(sink, path=DLQ_PATH):
+    # Feed the dead letters back through the sink and append those still failing to the file.
+    # The sink should have a MemoryDLQ and no retry worker: what it rejects is kept here.
+    # The file is renamed aside first, so a running consumer appends its new dead letters to a
+    # fresh file instead of losing them to the rewrite; a replay that was interrupted resumes
+    # from the renamed copy.
+    from consumer import to_document
+
+    claimed = f"{path}.replaying"
+    if not os.path.exists(claimed):
+        if not os.path.exists(path):
+            return Counter(), []
+        os.replace(path, claimed)
+    records = read_dead_letters(claimed)
+    remaining, replayed = [], Counter()
+    for record in records:
+        try:
+            if "event" in record:
+                doc = dict(record["event"])
+                doc.pop("ingested_at", None)  # Stamped again when written
+                if isinstance(doc.get("timestamp"), str):
+                    doc["timestamp"] = datetime.fromisoformat(doc["timestamp"])
+            else:
+                doc = to_document(DeadLetterMessage(record))
+            added = sink.add(doc)
+        except Exception as e:
+            # Still undecodable or malformed, like when it was first dead-lettered
+            remaining.append(dict(record, error=str(e), attempts=record.get("attempts", 0) + 1))
+            continue
+        if not added:
+            remaining.append(dict(record, error=f"Unknown event_type: {doc.get('event_type')}"))
+            continue
+        replayed[record["reason"]] += 1
+    if not sink.flush():
+        log.warning("MongoDB is still unavailable, the dead letters are put back")
+        _put_back(path, records, claimed)
+        return replayed, None
+    rejected = sink.dlq.records if isinstance(sink.dlq, MemoryDLQ) else []
+    remaining.extend(rejected)
+    for record in rejected:
+        replayed[record["reason"]] -= 1
+    _put_back(path, remaining, claimed)
+    return replayed, remaining
+
+
+def _put_back(path, records, claimed):
+    # Append the records to the live file, then drop the renamed copy they were read from
+    dlq = FileDLQ(path)
+    for record in records:
+        dlq.put(record)
+    dlq.flush()
+    os.remove(claimed)
+
+
+def stats(path=DLQ_PATH):
+    records = read_dead_letters(path)
+    print(f"{len(records)} dead letters in {path}")
+    for reason, count in Counter(record["reason"] for record in records).most_common():
+        print(f"  {reason}: {count}")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if command == "replay":
+        import consumer
+
+        client = consumer.connect_mongo()
+        # Replayed events are not sessionized, the running consumer owns the open sessions
+        sink = consumer.create_sink(client, dlq=MemoryDLQ(), retry=False, sessionize=False)
+        replayed, remaining = replay(sink)
+        if remaining is None:
+            print(f"MongoDB is still unavailable, the dead letters are kept in {DLQ_PATH}")
+        else:
+            print(f"Replayed {sum(replayed.values())} dead letters {dict(replayed)}")
+            print(f"{len(remaining)} still failing, kept in {DLQ_PATH}")
+        sink.close()
+        client.close()
+    elif command == "stats":
+        stats()
+    else:
+        print("Usage: python dlq.py [replay|stats]")
+        sys.exit(2)
@@ -0,0 +1,102 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from serializers import get_serializer
+from telemetry import PRODUCE_LATENCY, PRODUCED, PRODUCER_QUEUE
+
+log = logging.getLogger(__name__)
+
+
+def producer_conf(base_conf):
+    # Batching and compression settings for the shared producer, overridable from the environment
+    conf = dict(base_conf)
+    conf.update({
+        'linger.ms': int(os.getenv("PRODUCER_LINGER_MS", 20)),
+        'batch.num.messages': int(os.getenv("PRODUCER_BATCH_NUM_MESSAGES", 1000)),
+        'compression.type': os.getenv("PRODUCER_COMPRESSION", "lz4"),
+    })
+    return conf
+
+
+class EventEmitter:
+    """Process-wide producer wrapper: callers enqueue events and a background thread produces them."""
+
+    def __init__(self, producer, topic, max_queue=10000, enqueue_timeout=0.05, serializer=None):
+        self.producer = producer
+        self.topic = topic
+        self.serializer = serializer or get_serializer()
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.enqueue_timeout = enqueue_timeout
+        self.dropped = 0
+        self._closed = False
+        self._stop = threading.Event()
+        # Sampled when /metrics is scraped, nothing is recorded per event
+        PRODUCER_QUEUE.labels("emitter").set_function(self.queue.qsize)
+        PRODUCER_QUEUE.labels("librdkafka").set_function(lambda: len(self.producer))
+        self._thread = threading.Thread(target=self._run, name="event-emitter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def emit(self, key, event, callback=None):
+        # Enqueue without waiting on the broker; returns False when the queue stays full
+        event_type = event.get("event_type")
+        try:
+            self.queue.put((key, event, callback, time.perf_counter()), timeout=self.enqueue_timeout)
+        except queue.Full:
+            self.dropped += 1
+            PRODUCED.labels(event_type, "dropped").inc()
+            log.warning("Event queue full, dropping %s event", event_type)
+            return False
+        PRODUCED.labels(event_type, "queued").inc()
+        return True
+
+    def _run(self):
+        # Drain the queue into the producer and serve delivery callbacks
+        while not (self._stop.is_set() and self.queue.empty()):
+            try:
+                key, event, callback, emitted_at = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                self.producer.poll(0)
+                continue
+            self._produce(key, event, callback, emitted_at)
+            self.producer.poll(0)
+
+    def _produce(self, key, event, callback, emitted_at):
+        value, headers = self.serializer.encode(event)
+        event_type = event.get("event_type")
+
+        def on_delivery(err, msg):
+            # Runs on this thread from producer.poll(), after the broker acknowledged
+            if err:
+                PRODUCED.labels(event_type, "failed").inc()
+            else:
+                PRODUCED.labels(event_type, "delivered").inc()
+                PRODUCE_LATENCY.observe(time.perf_counter() - emitted_at)
+            if callback:
+                callback(err, msg)
+
+        while True:
+            try:
+                self.producer.produce(self.topic, key=key, value=value, headers=headers, callback=on_delivery)
+                return
+            except BufferError:
+                # The local producer queue is full, wait for in-flight deliveries
+                self.producer.poll(0.1)
+            except Exception as e:
+                PRODUCED.labels(event_type, "failed").inc()
+                log.error("Error producing message: %s", e)
+                return
+
+    def close(self, timeout=10):
+        # Drain the queue and flush outstanding messages, called on interpreter shutdown
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        self._thread.join(timeout)
+        remaining = self.producer.flush(timeout)
+        if remaining:
+            log.warning("%d messages were not delivered before shutdown", remaining)
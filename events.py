@@ -0,0 +1,36 @@
+import uuid
+from datetime import datetime
+
+
+# Event shapes emitted by the storefront, shared with the load generator. Products are
+# referenced by id with the price at the time, names and categories live in the catalog.
+# session_id identifies the shopper's browser session, the consumer builds funnels from it.
+def activity_event(event_type, product, session_id=None):
+    return {
+        "event_id": str(uuid.uuid4()),  # Lets the consumer drop replayed duplicates
+        "event_type": event_type,
+        "session_id": session_id,
+        "product_id": product["id"],
+        "price": product["price"],
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+def checkout_event(cart_items, session_id=None):
+    # cart_items: {"product": product, "quantity": n} entries, as kept in the storefront cart
+    cart_items = list(cart_items)
+    return {
+        "event_id": str(uuid.uuid4()),
+        "event_type": "checkout",
+        "session_id": session_id,
+        "timestamp": datetime.utcnow().isoformat(),
+        "cart_items": [
+            {
+                "product_id": item["product"]["id"],
+                "quantity": item["quantity"],
+                "price": item["product"]["price"]
+            }
+            for item in cart_items
+        ],
+        "total_price": sum(item["product"]["price"] * item["quantity"] for item in cart_items)
+    }
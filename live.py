@@ -0,0 +1,276 @@
+import logging
+import os
+import threading
+import uuid
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timedelta
+
+from catalog import lookup
+from rollups import DAILY, PRODUCTS
+
+log = logging.getLogger(__name__)
+
+# Live mode configuration
+LIVE_SOURCE = os.getenv("LIVE_SOURCE", "auto")  # auto, changestream, kafka or poll
+LIVE_POLL_INTERVAL = float(os.getenv("LIVE_POLL_INTERVAL", 1))  # Seconds between polls when idle
+LIVE_WINDOW_MINUTES = int(os.getenv("LIVE_WINDOW_MINUTES", 60))  # Per-minute order counts kept
+
+# Panels the aggregates track, each with its own version so only changed charts are redrawn
+PANELS = ("totals", "timeline", "top_products", "recent")
+
+
+def event_time(event):
+    timestamp = event.get("timestamp")
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return timestamp or datetime.utcnow()
+
+
+class LiveAggregates:
+    """Running totals, per-minute order counts and top products, updated per event.
+
+    apply() costs O(events in the batch) and snapshots O(products + window), whatever the
+    size of the history. Replays of events already applied are skipped by id.
+    """
+
+    def __init__(self, window_minutes=LIVE_WINDOW_MINUTES, recent=10, max_seen=200000):
+        self.window = timedelta(minutes=window_minutes)
+        self.totals = Counter()
+        self.product_ids = set()
+        self.quantities = Counter()  # product_id -> quantity sold
+        self.orders_per_minute = OrderedDict()  # minute -> orders, oldest first
+        self.recent_activities = deque(maxlen=recent)
+        self.recent_orders = deque(maxlen=recent)
+        self.seen = OrderedDict()  # Recently applied event ids, oldest first
+        self.max_seen = max_seen
+        self.versions = Counter()
+        self.lock = threading.Lock()
+
+    def seed(self, db):
+        # Start the running totals from the rollups, O(days + products) instead of a history scan
+        totals, product_ids, quantities = Counter(), set(), Counter()
+        for doc in db[DAILY].find({}, {"orders": 1, "activities": 1, "revenue": 1}):
+            for field in ("orders", "activities", "revenue"):
+                totals[field] += doc.get(field, 0)
+        for doc in db[PRODUCTS].find({}, {"product_id": 1, "added_to_cart": 1, "quantity_sold": 1}):
+            if doc.get("added_to_cart"):
+                product_ids.add(doc["product_id"])
+            quantities[doc["product_id"]] += doc.get("quantity_sold", 0)
+        with self.lock:
+            self.totals.update(totals)
+            self.product_ids.update(product_ids)
+            self.quantities.update(quantities)
+            self.versions.update(PANELS)
+
+    def _is_new(self, event):
+        event_id = event.get("_id") or event.get("event_id")
+        if event_id is None:
+            return True
+        if event_id in self.seen:
+            return False
+        self.seen[event_id] = None
+        if len(self.seen) > self.max_seen:
+            self.seen.popitem(last=False)
+        return True
+
+    def apply(self, events):
+        # Fold new events in and bump the version of every panel they touch
+        changed = set()
+        with self.lock:
+            for event in events:
+                if not self._is_new(event):
+                    continue
+                if event.get("event_type") == "add_to_cart":
+                    self.totals["activities"] += 1
+                    self.product_ids.add(event.get("product_id"))
+                    self.recent_activities.appendleft(event)
+                    changed.update(("totals", "recent"))
+                elif event.get("event_type") == "checkout":
+                    self.totals["orders"] += 1
+                    self.totals["revenue"] += event.get("total_price", 0)
+                    for item in event.get("cart_items", []):
+                        self.quantities[item["product_id"]] += item["quantity"]
+                    minute = event_time(event).replace(second=0, microsecond=0)
+                    self.orders_per_minute[minute] = self.orders_per_minute.get(minute, 0) + 1
+                    self.recent_orders.appendleft(event)
+                    changed.update(("totals", "timeline", "top_products", "recent"))
+            self._trim()
+            self.versions.update(changed)
+        return changed
+
+    def _trim(self):
+        # Drop minutes that fell out of the window; late events can land out of order
+        if not self.orders_per_minute:
+            return
+        cutoff = max(self.orders_per_minute) - self.window
+        for minute in [minute for minute in self.orders_per_minute if minute <= cutoff]:
+            del self.orders_per_minute[minute]
+
+    def version(self, panel):
+        return self.versions[panel]
+
+    def key_metrics(self):
+        with self.lock:
+            return {
+                "total_orders": self.totals["orders"],
+                "total_activities": self.totals["activities"],
+                "unique_products": len(self.product_ids),
+                "total_revenue": self.totals["revenue"],
+            }
+
+    def timeline(self):
+        # (minute, orders) pairs in time order
+        with self.lock:
+            return sorted(self.orders_per_minute.items())
+
+    def top_products(self, n=10):
+        # Counter.most_common(n) selects with a heap, O(products log n)
+        with self.lock:
+            top = self.quantities.most_common(n)
+        return [(lookup(product_id).get("name", product_id), quantity) for product_id, quantity in top if quantity]
+
+    def recent(self):
+        with self.lock:
+            return list(self.recent_activities), list(self.recent_orders)
+
+
+class ChangeStreamTail:
+    """Inserts into the event collections through a MongoDB change stream (replica sets only)."""
+
+    def __init__(self, db, collections=("user_activities", "orders")):
+        pipeline = [{"$match": {"operationType": "insert", "ns.coll": {"$in": list(collections)}}}]
+        self.stream = db.watch(pipeline, max_await_time_ms=int(LIVE_POLL_INTERVAL * 1000))
+
+    def poll(self):
+        events = []
+        while True:
+            change = self.stream.try_next()
+            if change is None:
+                return events
+            events.append(change["fullDocument"])
+
+    def close(self):
+        self.stream.close()
+
+
+class PollingTail:
+    """Documents the consumer stamped with ingested_at since the previous poll.
+
+    Works against any deployment. Each poll re-reads a short overlap to cover batches stamped
+    just before the previous one; the aggregates drop those repeats by id. The overlap never
+    reaches back past the start, those events are already in the seeded totals.
+    """
+
+    def __init__(self, collections, overlap=timedelta(seconds=5)):
+        self.collections = collections
+        self.overlap = overlap
+        self.started = self.since = datetime.utcnow()
+
+    def poll(self):
+        started = datetime.utcnow()
+        events = []
+        for collection in self.collections:
+            events.extend(collection.find({"ingested_at": {"$gte": self.since}}).sort("ingested_at", 1))
+        self.since = max(started - self.overlap, self.started)
+        return events
+
+    def close(self):
+        pass
+
+
+class KafkaTail:
+    """Reads the storefront topic directly in a throwaway consumer group.
+
+    Starts at the offsets the storing consumer group has committed, the events the rollups are
+    about to include, rather than wherever the group assignment lands after the seed.
+    """
+
+    def __init__(self, batch_size=500):
+        import consumer as single
+        from confluent_kafka import OFFSET_BEGINNING, Consumer, TopicPartition
+
+        conf = dict(single.conf)
+        conf.update({"group.id": f"customer_analytics-live-{uuid.uuid4()}", "auto.offset.reset": "latest"})
+        self.consumer = Consumer(conf)
+        metadata = self.consumer.list_topics(single.topic, timeout=10)
+        partitions = [TopicPartition(single.topic, p) for p in metadata.topics[single.topic].partitions]
+        stored = Consumer(dict(single.conf))  # Never subscribes, only reads the group's offsets
+        try:
+            committed = stored.committed(partitions, timeout=10)
+        finally:
+            stored.close()
+        for partition in committed:
+            if partition.offset < 0:  # Nothing committed yet, the consumer starts at the beginning
+                partition.offset = OFFSET_BEGINNING
+        self.consumer.assign(committed)
+        self.batch_size = batch_size
+
+    def poll(self):
+        from serializers import SerializationError, decode
+
+        events = []
+        for msg in self.consumer.consume(num_messages=self.batch_size, timeout=0):
+            if msg.error():
+                continue
+            try:
+                events.append(decode(msg.value(), msg.headers()))
+            except SerializationError as e:
+                log.warning("%s", e)
+        return events
+
+    def close(self):
+        self.consumer.close()
+
+
+def open_tail(db, source=LIVE_SOURCE):
+    # "auto" prefers a change stream and falls back to polling on standalone servers
+    if source == "kafka":
+        return KafkaTail()
+    if source == "poll":
+        return PollingTail([db.user_activities, db.orders])
+    try:
+        return ChangeStreamTail(db)
+    except Exception as e:
+        if source == "changestream":
+            raise
+        log.info("Change streams unavailable (%s), polling instead", e)
+        return PollingTail([db.user_activities, db.orders])
+
+
+class LiveFeed:
+    """Background thread moving events from a tail into the aggregates."""
+
+    def __init__(self, tail, aggregates, interval=LIVE_POLL_INTERVAL):
+        self.tail = tail
+        self.aggregates = aggregates
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="live-feed", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                events = self.tail.poll()
+            except Exception as e:
+                log.error("Live feed error: %s", e)
+                events = []
+            if events:
+                self.aggregates.apply(events)
+            else:
+                self._stop.wait(self.interval)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.tail.close()
+
+
+def start_live_feed(db, source=LIVE_SOURCE):
+    # Open the tail before seeding from the rollups, so events stored while the seed runs are
+    # tailed. The other order loses them: they land after the seed's reads and before the tail's
+    # start. An event the rollups already include when the seed reads them can be counted twice.
+    tail = open_tail(db, source)
+    aggregates = LiveAggregates()
+    aggregates.seed(db)
+    return LiveFeed(tail, aggregates)
@@ -0,0 +1,184 @@
+import argparse
+import bisect
+import json
+import os
+import random
+import statistics
+import time
+import uuid
+from itertools import accumulate
+
+from catalog import products
+from events import activity_event, checkout_event
+from serializers import get_serializer
+
+
+# Sinks: send() hands one event off, latencies holds seconds per delivered event
+class KafkaSink:
+    def __init__(self):
+        from confluent_kafka import Producer
+        from dotenv import load_dotenv
+        from emitter import producer_conf
+
+        load_dotenv()
+        conf = {
+            'bootstrap.servers': os.getenv("bootstrap_server"),
+            'security.protocol': 'SASL_SSL',
+            'sasl.mechanisms': 'PLAIN',
+            'sasl.username': os.getenv("api_key"),
+            'sasl.password': os.getenv("api_secret"),
+        }
+        self.producer = Producer(producer_conf(conf))
+        self.topic = os.getenv("topic")
+        self.serializer = get_serializer()
+        self.latencies = []
+        self.failed = 0
+
+    def send(self, key, event):
+        # Produce latency is measured from produce() to the delivery report
+        sent_at = time.perf_counter()
+
+        def on_delivery(err, msg):
+            if err:
+                self.failed += 1
+            else:
+                self.latencies.append(time.perf_counter() - sent_at)
+
+        value, headers = self.serializer.encode(event)
+        while True:
+            try:
+                self.producer.produce(self.topic, key=key, value=value, headers=headers, callback=on_delivery)
+                break
+            except BufferError:
+                self.producer.poll(0.1)
+        self.producer.poll(0)
+
+    def close(self):
+        self.producer.flush(30)
+
+
+class FileSink:
+    # Appends one JSON line per event
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+        self.latencies = []
+        self.failed = 0
+
+    def send(self, key, event):
+        sent_at = time.perf_counter()
+        self.file.write(json.dumps(event) + "\n")
+        self.latencies.append(time.perf_counter() - sent_at)
+
+    def close(self):
+        self.file.close()
+
+
+class MemorySink:
+    def __init__(self):
+        self.events = []
+        self.latencies = []
+        self.failed = 0
+
+    def send(self, key, event):
+        sent_at = time.perf_counter()
+        self.events.append((key, json.dumps(event)))
+        self.latencies.append(time.perf_counter() - sent_at)
+
+    def close(self):
+        pass
+
+
+class SessionGenerator:
+    """Shopping sessions over the storefront catalog with Zipf-distributed product popularity."""
+
+    def __init__(self, catalog=products, zipf_s=1.1, mean_adds=3, checkout_rate=0.3, seed=None):
+        self.rng = random.Random(seed)
+        # Popularity rank is a random permutation of the catalog, weight 1 / rank^s
+        self.catalog = list(catalog)
+        self.rng.shuffle(self.catalog)
+        self.cum_weights = list(accumulate(1 / rank ** zipf_s for rank in range(1, len(self.catalog) + 1)))
+        self.mean_adds = mean_adds
+        self.checkout_rate = checkout_rate
+
+    def pick(self):
+        position = self.rng.random() * self.cum_weights[-1]
+        return self.catalog[bisect.bisect_left(self.cum_weights, position)]
+
+    def session(self):
+        # A burst of add_to_cart events, optionally followed by a checkout of that cart
+        cart = {}
+        session_id = str(uuid.UUID(int=self.rng.getrandbits(128)))
+        n_adds = 1 + int(self.rng.expovariate(1 / max(self.mean_adds - 1, 1e-9)))
+        for _ in range(n_adds):
+            product = self.pick()
+            item = cart.setdefault(product["id"], {"product": product, "quantity": 0})
+            item["quantity"] += 1
+            yield session_id, activity_event("add_to_cart", product, session_id)
+        if self.rng.random() < self.checkout_rate:
+            yield session_id, checkout_event(cart.values(), session_id)
+
+    def events(self):
+        while True:
+            yield from self.session()
+
+
+def run(sink, generator, rate, duration=None, max_events=None):
+    # Send events paced to `rate` per second until the duration or event budget runs out
+    interval = 1.0 / rate if rate else 0
+    start = time.perf_counter()
+    sent = 0
+    for key, event in generator.events():
+        if max_events is not None and sent >= max_events:
+            break
+        elapsed = time.perf_counter() - start
+        if duration is not None and elapsed >= duration:
+            break
+        delay = sent * interval - elapsed
+        if delay > 0:
+            time.sleep(delay)
+        sink.send(key, event)
+        sent += 1
+    sink.close()
+    elapsed = time.perf_counter() - start
+    return sent, elapsed
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def report(sent, elapsed, sink):
+    print(f"Sent {sent} events in {elapsed:.2f}s: {sent / elapsed:,.0f} events/sec")
+    if sink.latencies:
+        p50 = statistics.median(sink.latencies) * 1000
+        p99 = percentile(sink.latencies, 0.99) * 1000
+        print(f"Produce latency p50={p50:.3f}ms p99={p99:.3f}ms over {len(sink.latencies)} deliveries")
+    if sink.failed:
+        print(f"{sink.failed} deliveries failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic storefront traffic.")
+    parser.add_argument("--sink", choices=["kafka", "file", "memory"], default="memory")
+    parser.add_argument("--output", default="events.jsonl", help="Path for --sink file")
+    parser.add_argument("--rate", type=float, default=1000, help="Target events per second, 0 for unthrottled")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds to run")
+    parser.add_argument("--events", type=int, default=None, help="Number of events to send")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of product popularity")
+    parser.add_argument("--checkout-rate", type=float, default=0.3, help="Share of sessions ending in checkout")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.duration is None and args.events is None:
+        args.duration = 10
+
+    if args.sink == "kafka":
+        sink = KafkaSink()
+    elif args.sink == "file":
+        sink = FileSink(args.output)
+    else:
+        sink = MemorySink()
+    generator = SessionGenerator(zipf_s=args.zipf, checkout_rate=args.checkout_rate, seed=args.seed)
+    sent, elapsed = run(sink, generator, args.rate, duration=args.duration, max_events=args.events)
+    report(sent, elapsed, sink)
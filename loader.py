@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+from pymongo.collection import Collection
+
+from analytics import timestamp_match
+from archive import SCHEMAS, arrow_frame
+
+try:
+    from pymongoarrow.api import Schema, find_arrow_all
+except ImportError:
+    find_arrow_all = None
+
+# Refreshes re-read this much before the previous refresh, covering batches stamped
+# just before a refresh and clock skew between consumer workers
+REFRESH_OVERLAP = timedelta(seconds=30)
+READ_BATCH_SIZE = int(os.getenv("DASHBOARD_READ_BATCH_SIZE", 10000))  # Documents per cursor batch
+
+
+def to_frame(docs):
+    # Raw event documents to a DataFrame with a parsed timestamp column
+    df = pd.DataFrame(docs)
+    if 'timestamp' in df:
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+    return df
+
+
+def _arrow_schema(schema):
+    # pymongoarrow decodes BSON dates at millisecond resolution only
+    return Schema({field.name: pa.timestamp("ms") if pa.types.is_timestamp(field.type) else field.type
+                   for field in schema})
+
+
+def read_frame(collection, query, batch_size=READ_BATCH_SIZE):
+    # Events matching `query` as a DataFrame, projected to the fields the archive keeps, which
+    # are the ones the panels use. With pymongoarrow the raw BSON batches are decoded straight
+    # into Arrow columns; otherwise each cursor batch becomes a frame of its own, so the full
+    # list of documents never sits in memory next to the result.
+    schema = SCHEMAS.get(collection.name)
+    if schema is None:
+        return to_frame(list(collection.find(query).batch_size(batch_size)))
+    if find_arrow_all is not None and isinstance(collection, Collection):
+        # Values not matching the schema come back null: the ObjectId _ids of documents written
+        # before event ids, and string timestamps until `bootstrap.py migrate-timestamps` has run
+        table = find_arrow_all(collection, query, schema=_arrow_schema(schema), allow_invalid=True,
+                               batch_size=batch_size)
+        return arrow_frame(table)
+    frames, batch = [], []
+    for doc in collection.find(query, dict.fromkeys(schema.names, 1)).batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            frames.append(pd.DataFrame(batch, columns=schema.names))
+            batch = []
+    frames.append(pd.DataFrame(batch, columns=schema.names))
+    return to_frame(pd.concat(frames, ignore_index=True))
+
+
+class FrameCache:
+    """DataFrames per (collection, date range), refreshed incrementally once their TTL expires.
+
+    A refresh only fetches documents the consumer wrote since the previous refresh (by their
+    ingested_at stamp) and appends the ones not seen yet, so a page rerun costs O(new events)
+    instead of re-downloading the range. With an ArchiveReader, the archived part of the range
+    is scanned once when the entry is created; archived events never change.
+    """
+
+    def __init__(self, ttl=60, max_entries=8, archive=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.archive = archive
+        self.entries = OrderedDict()  # (collection, date_range) -> entry, least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, collection, date_range=None):
+        key = (collection.full_name, date_range)
+        # The shared lock only covers the bookkeeping; reads happen under the entry's own lock,
+        # so sessions loading different ranges do not wait for each other
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = {"df": None, "since": None, "fetched_at": None,
+                                             "lock": threading.Lock()}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        with entry["lock"]:
+            if entry["df"] is None:
+                entry["df"] = self.archive.read(collection.name, date_range) if self.archive else pd.DataFrame()
+            if entry["fetched_at"] is None or time.monotonic() - entry["fetched_at"] >= self.ttl:
+                self._refresh(collection, date_range, entry)
+            return entry["df"]
+
+    def _refresh(self, collection, date_range, entry):
+        # Push the date range down to MongoDB and only ask for recently ingested documents
+        started = datetime.utcnow()
+        query = timestamp_match(date_range)
+        if entry["since"] is not None:
+            query["ingested_at"] = {"$gte": entry["since"]}
+        new = read_frame(collection, query)
+        if not new.empty:
+            df = entry["df"]
+            if not df.empty:
+                new = new[~new['_id'].isin(df['_id'])]
+                new = pd.concat([df, new], ignore_index=True) if not new.empty else df
+            entry["df"] = new
+        entry["since"] = started - REFRESH_OVERLAP
+        entry["fetched_at"] = time.monotonic()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,184 @@
+import math
+import os
+import sys
+from collections import Counter, defaultdict
+from itertools import chain
+from datetime import datetime
+from pymongo import UpdateOne
+from catalog import lookup
+
+# Pre-aggregated counters maintained next to the raw event collections, bucketed per day
+# so any date range can be summed from a handful of documents
+DAILY = "rollup_daily"  # _id = "YYYY-MM-DD": orders, revenue, items_sold, activities
+PRODUCTS = "rollup_products"  # _id = "YYYY-MM-DD|product_id": added_to_cart, quantity_sold, revenue
+CATEGORIES = "rollup_categories"  # _id = "YYYY-MM-DD|category": activities, cart_value
+FUNNELS = "rollup_funnels"  # _id = "YYYY-MM-DD": sessions, carts, checkouts (by session start day)
+
+
+def event_day(timestamp):
+    # Day bucket for both ISO strings and native datetimes
+    if isinstance(timestamp, datetime):
+        return timestamp.date().isoformat()
+    return str(timestamp)[:10]
+
+
+def rollup_increments(events):
+    # Fold a batch of events into one set of counters per rollup document,
+    # keyed by day, (day, product_id) and (day, category). Names and categories come from
+    # the catalog, falling back to the values stored on events written before they were slimmed.
+    increments = {DAILY: defaultdict(Counter), PRODUCTS: defaultdict(Counter), CATEGORIES: defaultdict(Counter)}
+    product_names = {}
+    for event in events:
+        date = event_day(event.get("timestamp"))
+        day = increments[DAILY][date]
+        if event.get("event_type") == "add_to_cart":
+            day["activities"] += 1
+            product = increments[PRODUCTS][(date, event["product_id"])]
+            product["added_to_cart"] += 1
+            entry = lookup(event["product_id"])
+            product_names[event["product_id"]] = entry.get("name", event.get("product_name"))
+            category = increments[CATEGORIES][(date, entry.get("category", event.get("category")))]
+            category["activities"] += 1
+            category["cart_value"] += event.get("price", 0)
+        elif event.get("event_type") == "checkout":
+            day["orders"] += 1
+            day["revenue"] += event.get("total_price", 0)
+            for item in event.get("cart_items", []):
+                day["items_sold"] += item["quantity"]
+                product = increments[PRODUCTS][(date, item["product_id"])]
+                product["quantity_sold"] += item["quantity"]
+                product["revenue"] += item["quantity"] * item["price"]
+                product_names[item["product_id"]] = lookup(item["product_id"]).get("name", item.get("product_name"))
+    return increments, product_names
+
+
+def rollup_document(name, key, product_names):
+    # _id and descriptive fields of the rollup document for an increments key
+    if name == DAILY:
+        return key, {"day": key}
+    day, value = key
+    if name == PRODUCTS:
+        fields = {"day": day, "product_id": value}
+        if product_names.get(value) is not None:
+            fields["product_name"] = product_names[value]
+        return f"{day}|{value}", fields
+    return f"{day}|{value}", {"day": day, "category": value}
+
+
+class RollupWriter:
+    """Applies batched $inc upserts to the rollup collections."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def apply(self, events):
+        increments, product_names = rollup_increments(events)
+        for name, counters in increments.items():
+            requests = []
+            for key, counter in counters.items():
+                _id, fields = rollup_document(name, key, product_names)
+                update = {"$inc": dict(counter), "$set": fields}
+                requests.append(UpdateOne({"_id": _id}, update, upsert=True))
+            if requests:
+                self.db[name].bulk_write(requests, ordered=False)
+
+
+def compute_rollups(activity_col, order_col, chunk_size=10000, archived=()):
+    # Recompute every rollup document from the raw collections, plus any archived
+    # events given as chunks of documents
+    totals = {DAILY: defaultdict(Counter), PRODUCTS: defaultdict(Counter), CATEGORIES: defaultdict(Counter)}
+    names = {}
+    for chunk in archived:
+        _merge(totals, names, chunk)
+    for collection in (activity_col, order_col):
+        chunk = []
+        for event in collection.find({}, {"_id": 0}).batch_size(chunk_size):
+            chunk.append(event)
+            if len(chunk) >= chunk_size:
+                _merge(totals, names, chunk)
+                chunk = []
+        _merge(totals, names, chunk)
+
+    rollups = {}
+    for name, counters in totals.items():
+        docs = {}
+        for key, counter in counters.items():
+            _id, fields = rollup_document(name, key, names)
+            docs[_id] = {"_id": _id, **fields, **counter}
+        rollups[name] = docs
+    return rollups
+
+
+def _merge(totals, names, events):
+    increments, product_names = rollup_increments(events)
+    for name, counters in increments.items():
+        for key, counter in counters.items():
+            totals[name][key].update(counter)
+    names.update(product_names)
+
+
+def rebuild(db, activity_col, order_col, archived=()):
+    # Replace the rollup collections with values recomputed from raw data.
+    # Run it with the consumer stopped, increments applied meanwhile would be lost.
+    write_rollups(db, compute_rollups(activity_col, order_col, archived=archived))
+
+
+def write_rollups(db, rollups):
+    # rollups: collection name -> {_id: document}, each collection is replaced wholesale
+    for name, docs in rollups.items():
+        db[name].delete_many({})
+        if docs:
+            db[name].insert_many(list(docs.values()))
+        print(f"Rebuilt {name}: {len(docs)} documents")
+
+
+def check(db, activity_col, order_col, archived=()):
+    # Compare stored rollups with a fresh recomputation, returns the list of mismatches
+    expected = compute_rollups(activity_col, order_col, archived=archived)
+    mismatches = []
+    for name, docs in expected.items():
+        stored = {doc["_id"]: doc for doc in db[name].find({})}
+        for key in set(docs) | set(stored):
+            want, have = docs.get(key, {}), stored.get(key, {})
+            for field in (set(want) | set(have)) - {"_id", "day", "product_id", "product_name", "category"}:
+                if not math.isclose(want.get(field, 0), have.get(field, 0), rel_tol=1e-9, abs_tol=1e-6):
+                    mismatches.append((name, key, field, want.get(field, 0), have.get(field, 0)))
+    return mismatches
+
+
+def archived_events():
+    # Chunks of events moved to the Parquet archive, which the rollups still count
+    try:
+        from archive import SCHEMAS, ArchiveReader
+    except ImportError:  # pyarrow is not installed, so nothing can have been archived here
+        return ()
+    reader = ArchiveReader()
+    return chain.from_iterable(reader.batches(name) for name in SCHEMAS)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo.mongo_client import MongoClient
+    from pymongo.server_api import ServerApi
+
+    load_dotenv()
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    client = MongoClient(os.getenv("MONGODB_URL"), server_api=ServerApi('1'))
+    db = client[os.getenv('DB')]
+    Order_col = db[os.getenv('Order_col')]
+    activity_col = db[os.getenv('activity')]
+    archived = archived_events()
+
+    if command == "rebuild":
+        rebuild(db, activity_col, Order_col, archived)
+    elif command == "check":
+        mismatches = check(db, activity_col, Order_col, archived)
+        for name, key, field, want, have in mismatches:
+            print(f"{name} {key} {field}: expected {want}, stored {have}")
+        print(f"{len(mismatches)} mismatches")
+        client.close()
+        sys.exit(1 if mismatches else 0)
+    else:
+        print("Usage: python rollups.py [rebuild|check]")
+        sys.exit(2)
+    client.close()
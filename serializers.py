@@ -0,0 +1,116 @@
+import json
+import os
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, JSON keeps working without it
+    msgpack = None
+
+# Local schema registry: version -> event_type -> field order, shared by producer and consumer
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "event_schemas.json")
+with open(SCHEMA_FILE) as f:
+    SCHEMAS = json.load(f)
+LATEST_VERSION = max(SCHEMAS, key=int)
+
+# Message headers announcing how the value is encoded
+CONTENT_TYPE = "content-type"
+SCHEMA_VERSION = "schema-version"
+
+
+class SerializationError(ValueError):
+    pass
+
+
+class JsonSerializer:
+    content_type = "json"
+
+    def encode(self, event):
+        return json.dumps(event).encode("utf-8"), [(CONTENT_TYPE, b"json")]
+
+    def decode(self, value, version=None):
+        try:
+            return json.loads(value.decode("utf-8") if isinstance(value, bytes) else value)
+        except (ValueError, TypeError) as e:
+            raise SerializationError(f"JSON decode error: {e}") from e
+
+
+class SchemaMsgpackSerializer:
+    """msgpack arrays laid out by the schema registry, so field names never go over the wire.
+
+    A record is [event_type, *values in schema order] with a trailing map for any fields the
+    schema does not list. Checkout cart items are nested arrays in the cart_item layout.
+    """
+
+    content_type = "msgpack"
+
+    def __init__(self, version=LATEST_VERSION):
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed, use EVENT_FORMAT=json")
+        self.version = str(version)
+
+    def encode(self, event):
+        schema = SCHEMAS[self.version]
+        event_type = event.get("event_type")
+        fields = schema.get(event_type)
+        if fields is None:
+            # Unknown event types fall back to a plain map
+            record = [event_type, event]
+        else:
+            record = [event_type]
+            for field in fields:
+                value = event.get(field)
+                if field == "cart_items" and value is not None:
+                    value = [[item.get(name) for name in schema["cart_item"]] for item in value]
+                record.append(value)
+            extras = {k: v for k, v in event.items() if k != "event_type" and k not in fields}
+            if extras:
+                record.append(extras)
+        headers = [(CONTENT_TYPE, b"msgpack"), (SCHEMA_VERSION, self.version.encode())]
+        return msgpack.packb(record, use_bin_type=True), headers
+
+    def decode(self, value, version=None):
+        version = version or self.version
+        # Anything that does not unpack into a record of the schema's layout is undecodable,
+        # including well-formed msgpack of the wrong shape
+        try:
+            record = msgpack.unpackb(value, raw=False)
+            schema = SCHEMAS[version]
+            if not isinstance(record, list) or not record:
+                raise TypeError(f"expected a non-empty array, got {type(record).__name__}")
+            event_type, values = record[0], record[1:]
+            fields = schema.get(event_type) if isinstance(event_type, str) else None
+            if fields is None:
+                return dict(values[0], event_type=event_type)
+            event = {"event_type": event_type}
+            event.update(zip(fields, values))
+            if len(values) > len(fields):
+                event.update(values[len(fields)])
+            if event.get("cart_items") is not None:
+                event["cart_items"] = [dict(zip(schema["cart_item"], item)) for item in event["cart_items"]]
+            return event
+        except Exception as e:
+            raise SerializationError(f"msgpack decode error: {e}") from e
+
+
+SERIALIZERS = {"json": JsonSerializer, "msgpack": SchemaMsgpackSerializer}
+
+
+def get_serializer(name=None):
+    # EVENT_FORMAT picks what producers write; consumers read whatever each message announces
+    name = name or os.getenv("EVENT_FORMAT", "msgpack" if msgpack is not None else "json")
+    return SERIALIZERS[name]()
+
+
+_decoders = {}
+
+
+def decode(value, headers=None):
+    # Decode one message using its headers; messages without headers are JSON
+    headers = dict(headers or [])
+    content_type = headers.get(CONTENT_TYPE, b"json").decode()
+    version = headers.get(SCHEMA_VERSION, LATEST_VERSION.encode()).decode()
+    if content_type not in SERIALIZERS:
+        raise SerializationError(f"Unknown content-type: {content_type}")
+    if content_type not in _decoders:
+        _decoders[content_type] = SERIALIZERS[content_type]()
+    return _decoders[content_type].decode(value, version)
@@ -0,0 +1,187 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from datetime import datetime, timedelta
+
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from rollups import FUNNELS, event_day
+
+log = logging.getLogger(__name__)
+
+# Sessions are a session_id's events split on SESSION_TIMEOUT_MINUTES of inactivity, the same
+# rule spark_job.py applies in batch. Closed sessions land in SESSIONS and are counted into the
+# rollup_funnels document of the day they started.
+SESSION_TIMEOUT_MINUTES = int(os.getenv("SESSION_TIMEOUT_MINUTES", 30))
+SESSIONS = "sessions"  # _id = "session_id|start": start, end, events, adds, checkouts, cart_value, order_value
+SESSION_STATE = "sessions_open"  # Open sessions checkpointed on shutdown, restored on start
+
+DUPLICATE_KEY = 11000
+
+
+def _timestamp(event):
+    timestamp = event.get("timestamp")
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return timestamp
+
+
+class Session:
+    __slots__ = ("session_id", "start", "end", "events", "adds", "checkouts", "cart_value", "order_value",
+                 "touched")
+
+    def __init__(self, session_id, timestamp):
+        self.session_id = session_id
+        self.start = self.end = timestamp
+        self.events = self.adds = self.checkouts = 0
+        self.cart_value = self.order_value = 0.0
+        self.touched = time.monotonic()
+
+    def add(self, event, timestamp):
+        self.start = min(self.start, timestamp)  # Events can arrive slightly out of order
+        self.end = max(self.end, timestamp)
+        self.events += 1
+        if event.get("event_type") == "add_to_cart":
+            self.adds += 1
+            self.cart_value += event.get("price", 0)
+        elif event.get("event_type") == "checkout":
+            self.checkouts += 1
+            self.order_value += event.get("total_price", 0)
+        self.touched = time.monotonic()
+
+    def document(self):
+        return {
+            "_id": f"{self.session_id}|{self.start.isoformat()}",
+            "session_id": self.session_id,
+            "day": event_day(self.start),
+            "start": self.start,
+            "end": self.end,
+            "events": self.events,
+            "adds": self.adds,
+            "checkouts": self.checkouts,
+            "cart_value": self.cart_value,
+            "order_value": self.order_value,
+        }
+
+    @classmethod
+    def from_document(cls, doc):
+        session = cls(doc["session_id"], doc["start"])
+        session.end = doc["end"]
+        for field in ("events", "adds", "checkouts", "cart_value", "order_value"):
+            setattr(session, field, doc[field])
+        return session
+
+
+class SessionAggregator:
+    """Open sessions in memory, closed after `timeout` of inactivity and written once.
+
+    A session closes when the newest event time seen is `timeout` past its last event, so a
+    backfill sessionizes the same way as live traffic, or when nothing arrived for it for
+    `timeout` of wall-clock time, so quiet periods still close sessions. Open sessions are kept
+    in the order they were last touched, eviction only looks at the oldest ones.
+
+    Closed sessions are inserted by a deterministic _id and only newly inserted ones are
+    counted into the funnels, so writing a session twice does not count it twice.
+    """
+
+    def __init__(self, db, timeout_minutes=SESSION_TIMEOUT_MINUTES):
+        self.db = db
+        self.timeout = timedelta(minutes=timeout_minutes)
+        self.open = OrderedDict()  # session_id -> Session, least recently touched first
+        self.watermark = None  # Newest event time seen
+        self.closed = []
+        self.lock = threading.Lock()  # Shared by the consumer's sink and the retry worker's
+
+    def apply(self, events):
+        # Fold newly stored events into their sessions, then write the sessions that closed
+        with self.lock:
+            for event in events:
+                session_id = event.get("session_id")
+                timestamp = _timestamp(event)
+                if session_id is None or timestamp is None:
+                    continue
+                if self.watermark is None or timestamp > self.watermark:
+                    self.watermark = timestamp
+                session = self.open.get(session_id)
+                if session is not None and timestamp >= session.end + self.timeout:
+                    # Back after the timeout before the session was evicted: a new session
+                    self.closed.append(self.open.pop(session_id))
+                    session = None
+                if session is None:
+                    session = self.open[session_id] = Session(session_id, timestamp)
+                else:
+                    self.open.move_to_end(session_id)
+                session.add(event, timestamp)
+            self._evict()
+            closed, self.closed = self.closed, []
+        self._write(closed)
+
+    def expire(self):
+        # Close sessions idle for the timeout, called from the consumer loop between batches
+        with self.lock:
+            self._evict()
+            closed, self.closed = self.closed, []
+        self._write(closed)
+
+    def _evict(self):
+        idle_since = time.monotonic() - self.timeout.total_seconds()
+        while self.open:
+            session = next(iter(self.open.values()))
+            if session.end + self.timeout > self.watermark and session.touched > idle_since:
+                return
+            self.closed.append(self.open.pop(session.session_id))
+
+    def _write(self, sessions):
+        if not sessions:
+            return
+        docs = [session.document() for session in sessions]
+        try:
+            self.db[SESSIONS].insert_many(docs, ordered=False)
+            landed = docs
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            landed = [doc for i, doc in enumerate(docs) if i not in failed]
+        funnels = defaultdict(Counter)
+        for doc in landed:
+            day = funnels[doc["day"]]
+            day["sessions"] += 1
+            day["carts"] += doc["adds"] > 0
+            day["checkouts"] += doc["checkouts"] > 0
+        requests = [
+            UpdateOne({"_id": day}, {"$inc": dict(counter), "$set": {"day": day}}, upsert=True)
+            for day, counter in funnels.items()
+        ]
+        if requests:
+            self.db[FUNNELS].bulk_write(requests, ordered=False)
+        log.debug("Closed %d sessions", len(landed), extra={"count": len(landed)})
+
+    def restore(self):
+        # Reload the sessions checkpointed by close(). Each checkpoint is claimed by deleting it,
+        # so pool workers starting together split them instead of each resuming every session
+        # and counting it again when it closes.
+        restored = 0
+        while True:
+            doc = self.db[SESSION_STATE].find_one_and_delete({}, sort=[("end", 1)])
+            if doc is None:
+                break
+            session = Session.from_document(doc)
+            with self.lock:
+                self.open[session.session_id] = session
+                if self.watermark is None or session.end > self.watermark:
+                    self.watermark = session.end
+            restored += 1
+        if restored:
+            log.info("Restored %d open sessions", restored)
+
+    def close(self):
+        # Checkpoint the open sessions so a restart resumes them instead of splitting them.
+        # After a crash they are lost; `spark_job.py --write-mongo` recomputes the funnels.
+        with self.lock:
+            docs = [dict(session.document(), _id=session.session_id) for session in self.open.values()]
+            self.open.clear()
+        if docs:
+            self.db[SESSION_STATE].bulk_write([ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in docs])
+            log.info("Checkpointed %d open sessions", len(docs))
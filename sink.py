@@ -0,0 +1,219 @@
+import logging
+import time
+from datetime import datetime
+from pymongo.errors import BulkWriteError
+from dlq import RETRY_BASE_DELAY, RETRY_MAX_DELAY, dead_letter
+from telemetry import BATCH_SIZE, CONSUMED, POLL_TO_WRITE, WRITE_LATENCY
+
+log = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class BatchSink:
+    """Buffers events per target collection and writes them with unordered insert_many.
+
+    Documents carrying a deterministic _id are idempotent: an event replayed after a restart
+    hits the unique _id index and is skipped, without touching the rollups again. The flip side:
+    when an insert lands but the call still fails (a timeout or dropped connection), or the
+    process dies between the insert and the rollup update, the retry finds the documents
+    already stored and the rollups under-count them until `rollups.py rebuild`.
+
+    With a dead-letter queue, events that cannot be stored are recorded there instead of being
+    dropped. With a RetryWorker, a batch that fails to write is handed over to it and the
+    consumer moves on; without one, or when it is full, the batch stays buffered and is retried
+    with exponential backoff. The consumer stops polling once `max_pending` events are buffered.
+    """
+
+    def __init__(self, collections, batch_size=500, linger_ms=1000, rollups=None, dlq=None, retries=None,
+                 sessions=None, sketches=None, max_pending=10000, retry_base_delay=RETRY_BASE_DELAY,
+                 retry_max_delay=RETRY_MAX_DELAY):
+        self.collections = collections  # event_type -> MongoDB collection
+        self.rollups = rollups  # Optional RollupWriter updated with every landed batch
+        self.sessions = sessions  # Optional SessionAggregator fed with every landed batch
+        self.sketches = sketches  # Optional SketchWriter fed with every landed batch
+        self.dlq = dlq  # Optional dead-letter queue, see dlq.py
+        self.retries = retries  # Optional RetryWorker taking over failed batches
+        self.batch_size = batch_size
+        self.linger = linger_ms / 1000.0
+        self.max_pending = max_pending
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.failures = 0  # Consecutive failed flushes
+        self.retry_at = 0.0  # No flush attempt before this time after a failure
+        self.buffers = {event_type: [] for event_type in collections}
+        self.pending = 0
+        self.written = 0  # Events landed since the sink was created
+        self.first_buffered_at = None
+
+    def add(self, data):
+        # Route the event to its collection buffer, False for an unknown event_type
+        buffer = self.buffers.get(data.get("event_type"))
+        if buffer is None:
+            return False
+        if self.pending == 0:
+            self.first_buffered_at = time.monotonic()
+        buffer.append(data)
+        self.pending += 1
+        return True
+
+    def should_flush(self):
+        # Flush on a full batch or once the oldest buffered event has waited long enough
+        if self.pending == 0 or time.monotonic() < self.retry_at:
+            return False
+        if self.pending >= self.batch_size:
+            return True
+        return time.monotonic() - self.first_buffered_at >= self.linger
+
+    def reject(self, reason, error, msg=None, event=None):
+        # Record an event that cannot be stored, from a Kafka message and/or its decoded event
+        log.warning("Rejected event (%s): %s", reason, error, extra={"reason": reason})
+        CONSUMED.labels((event or {}).get("event_type", "unknown"), "rejected").inc()
+        if self.dlq is not None:
+            self.dlq.put(dead_letter(reason, error, msg=msg, event=event))
+
+    def flush(self):
+        # Write every non-empty buffer; returns True when everything buffered has landed
+        # or been handed to the retry worker, so offsets can be committed
+        if self.first_buffered_at is not None:
+            POLL_TO_WRITE.observe(time.monotonic() - self.first_buffered_at)
+        for event_type, docs in self.buffers.items():
+            if not docs:
+                continue
+            try:
+                self.write(event_type, docs, retried=self.failures > 0)
+            except Exception as e:
+                log.warning("MongoDB insert error: %s", e, extra={"event_type": event_type, "count": len(docs)})
+                if self.retries is None or not self.retries.submit(event_type, list(docs), e):
+                    # Keep the batch so it is retried after a backoff, offsets stay uncommitted
+                    self.failures += 1
+                    delay = min(self.retry_max_delay, self.retry_base_delay * 2 ** (self.failures - 1))
+                    self.retry_at = time.monotonic() + delay
+                    return False
+                CONSUMED.labels(event_type, "retrying").inc(len(docs))
+            self.pending -= len(docs)
+            docs.clear()
+        if self.dlq is not None:
+            # Dead letters must be durable before the offsets they cover are committed
+            self.dlq.flush()
+        self.first_buffered_at = None
+        self.failures = 0
+        self.retry_at = 0.0
+        return True
+
+    def dead_letter_pending(self, reason, error):
+        # Move every buffered event to the dead-letter queue, for a shutdown that could not write
+        # them. True once they are durable there; without a DLQ they stay buffered and uncommitted.
+        if self.dlq is None:
+            return False
+        for event_type, docs in self.buffers.items():
+            for doc in docs:
+                self.dlq.put(dead_letter(reason, error, event=doc))
+            CONSUMED.labels(event_type, "rejected").inc(len(docs))
+            docs.clear()
+        self.dlq.flush()
+        self.pending = 0
+        self.first_buffered_at = None
+        return True
+
+    @property
+    def full(self):
+        # Enough events buffered that the consumer should stop polling until some land
+        return self.pending >= self.max_pending
+
+    def tick(self):
+        # Time-driven upkeep between batches, so quiet periods still close idle sessions into the
+        # funnels and persist the sketches of the last events
+        if self.sessions is not None:
+            try:
+                self.sessions.expire()
+            except Exception as e:
+                log.error("Session write error: %s", e)
+        if self.sketches is not None:
+            try:
+                self.sketches.persist_due()
+            except Exception as e:
+                log.error("Sketch persist error: %s", e)
+
+    def close(self):
+        # Give the batches waiting for a retry a last attempt, then checkpoint the open sessions
+        # and persist the sketches
+        if self.retries is not None:
+            self.retries.close()
+        if self.sessions is not None:
+            self.sessions.close()
+        if self.sketches is not None:
+            self.sketches.close()
+
+    def write(self, event_type, docs, retried=False):
+        # Insert one batch of events and update the rollups, raises when MongoDB is unavailable.
+        # `retried` marks a batch an earlier attempt failed to write, see the class docstring.
+        started = time.perf_counter()
+        # Stamped at write time, the dashboard's incremental refresh follows this field
+        ingested_at = datetime.utcnow()
+        for doc in docs:
+            doc["ingested_at"] = ingested_at
+        BATCH_SIZE.observe(len(docs))
+        landed, duplicates = self._write(event_type, docs)
+        if retried and duplicates:
+            log.warning("%d documents of a retried %s batch were already stored; if the failed attempt "
+                        "wrote them, the rollups under-count them: run `python rollups.py check`",
+                        duplicates, event_type, extra={"event_type": event_type, "count": duplicates})
+        # Only newly inserted events count towards the rollups, sessions and sketches,
+        # replays are skipped
+        self._update_rollups(landed)
+        self._update_sessions(landed)
+        self._update_sketches(landed)
+        self.written += len(landed)
+        CONSUMED.labels(event_type, "stored").inc(len(landed))
+        WRITE_LATENCY.observe(time.perf_counter() - started)
+        log.debug("Inserted %d documents", len(landed), extra={"event_type": event_type, "count": len(landed)})
+        return landed
+
+    def _write(self, event_type, docs):
+        # Returns the documents that were newly written and the number skipped as duplicates
+        collection = self.collections[event_type]
+        try:
+            collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Unordered inserts keep going past bad documents, the rest have landed.
+            # A duplicate key means the event was written before and is being replayed.
+            errors = e.details.get('writeErrors', [])
+            failed = {error['index'] for error in errors}
+            duplicates = sum(1 for error in errors if error.get('code') == DUPLICATE_KEY)
+            if duplicates:
+                log.info("Skipped %d replayed documents in %s", duplicates, collection.name)
+                CONSUMED.labels(event_type, "duplicate").inc(duplicates)
+            for error in errors:
+                if error.get('code') != DUPLICATE_KEY:
+                    # Rejected by the server (validation, size...), retrying would fail the same way
+                    self.reject("write_rejected", error.get('errmsg'), event=docs[error['index']])
+            return [doc for i, doc in enumerate(docs) if i not in failed], duplicates
+        return docs, 0
+
+    def _update_rollups(self, docs):
+        # Raw events are the source of truth, a failed rollup update is repaired by `rollups.py rebuild`
+        if self.rollups is None or not docs:
+            return
+        try:
+            self.rollups.apply(docs)
+        except Exception as e:
+            log.error("Rollup update error: %s", e)
+
+    def _update_sessions(self, docs):
+        # Like the rollups, the funnels can be recomputed from raw events with spark_job.py
+        if self.sessions is None or not docs:
+            return
+        try:
+            self.sessions.apply(docs)
+        except Exception as e:
+            log.error("Session write error: %s", e)
+
+    def _update_sketches(self, docs):
+        # Approximate by design, a lost update only widens the error of the affected days
+        if self.sketches is None or not docs:
+            return
+        try:
+            self.sketches.apply(docs)
+        except Exception as e:
+            log.error("Sketch update error: %s", e)
@@ -0,0 +1,323 @@
+import heapq
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson import Binary
+from pymongo import ReplaceOne
+
+from rollups import event_day
+
+log = logging.getLogger(__name__)
+
+# Mergeable per-day sketches of product ids, for distinct counts and top-K over any range of days
+# without reading per-product data. Each consumer process owns its own document per day, so
+# the dashboard merges every document of the selected days; documents left behind by stopped
+# writers are folded into a live writer's, see SketchWriter.
+SKETCHES = "rollup_sketches"  # _id = "YYYY-MM-DD|name|writer": hll, cms, candidates
+SKETCH_FLUSH_SECONDS = float(os.getenv("SKETCH_FLUSH_SECONDS", 10))  # Persist interval of the consumer's sketches
+HLL_PRECISION = int(os.getenv("HLL_PRECISION", 14))  # 2^14 registers, ~0.8% standard error
+CMS_WIDTH = int(os.getenv("CMS_WIDTH", 2048))  # Overestimates by at most e/width of the total count...
+CMS_DEPTH = int(os.getenv("CMS_DEPTH", 4))  # ...with probability 1 - e^-depth
+TOPK_CAPACITY = int(os.getenv("TOPK_CAPACITY", 256))  # Heavy-hitter candidates kept per sketch
+
+# Sketch names: add_to_cart events per product, and quantities sold per product
+ADDED = "added"
+SOLD = "sold"
+
+_SEEDS = np.array([0x9E3779B97F4A7C15 * (i + 1) & 0xFFFFFFFFFFFFFFFF for i in range(16)], dtype=np.uint64)
+
+
+def _mix64(x):
+    # splitmix64 finalizer, a fast well-mixed 64-bit hash of uint64 arrays
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _hash(keys):
+    # Integer keys such as product ids
+    return _mix64(np.asarray(keys, dtype=np.int64).view(np.uint64))
+
+
+def _bit_length(x):
+    # Exact bit length of uint64 values, in two 32-bit halves so float64 represents them exactly
+    high, low = x >> np.uint64(32), x & np.uint64(0xFFFFFFFF)
+    high_bits = np.frexp(high.astype(np.float64))[1]
+    low_bits = np.frexp(low.astype(np.float64))[1]
+    return np.where(high > 0, 32 + high_bits, low_bits)
+
+
+class HyperLogLog:
+    """Distinct count estimate from 2^p one-byte registers; merging is an element-wise max."""
+
+    def __init__(self, p=HLL_PRECISION, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, dtype=np.uint8) if registers is None else registers
+
+    def add(self, keys):
+        h = _hash(keys)
+        index = (h >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = h & np.uint64((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - _bit_length(rest) + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.m and zeros:
+            # Small-range correction: linear counting over the empty registers
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+
+class CountMinSketch:
+    """Per-key counts that never underestimate; merging adds the tables."""
+
+    def __init__(self, width=CMS_WIDTH, depth=CMS_DEPTH, table=None):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64) if table is None else table
+
+    def _columns(self, keys):
+        h = _hash(keys)
+        return np.stack([_mix64(h ^ seed) % np.uint64(self.width) for seed in _SEEDS[:self.depth]]).astype(np.int64)
+
+    def add(self, keys, counts):
+        columns = self._columns(keys)
+        for row in range(self.depth):
+            self.table[row] += np.bincount(columns[row], weights=counts, minlength=self.width).astype(np.int64)
+
+    def estimate(self, keys):
+        columns = self._columns(keys)
+        return self.table[np.arange(self.depth)[:, None], columns].min(axis=0)
+
+    def merge(self, other):
+        self.table += other.table
+
+
+class ProductSketch:
+    """Distinct products, per-product counts and the likely heaviest products of one bucket.
+
+    Top-K pairs the Count-Min counts with a set of candidate keys: every key of a batch is
+    a candidate, and once there are twice `capacity` of them only the `capacity` with the
+    highest estimates are kept. A product heavy over a merged range is heavy in some bucket,
+    so the union of the buckets' candidates, ranked by the merged counts, finds it.
+    """
+
+    def __init__(self, hll=None, cms=None, candidates=(), capacity=TOPK_CAPACITY):
+        self.hll = hll or HyperLogLog()
+        self.cms = cms or CountMinSketch()
+        self.candidates = set(candidates)
+        self.capacity = capacity
+        self.total = 0
+
+    def add(self, keys, counts=None):
+        keys = np.asarray(keys, dtype=np.int64)
+        if not len(keys):
+            return
+        counts = np.ones(len(keys), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        unique, inverse = np.unique(keys, return_inverse=True)
+        sums = np.bincount(inverse, weights=counts)
+        self.hll.add(unique)
+        self.cms.add(unique, sums)
+        self.total += int(counts.sum())
+        self.candidates.update(unique.tolist())
+        if len(self.candidates) > 2 * self.capacity:
+            self.candidates = {key for key, _ in self.top(self.capacity)}
+
+    def merge(self, other):
+        self.hll.merge(other.hll)
+        self.cms.merge(other.cms)
+        self.candidates |= other.candidates
+        self.total += other.total
+
+    def distinct(self):
+        return self.hll.count()
+
+    def top(self, n):
+        # (key, estimated count) of the n heaviest candidates, largest first
+        if not self.candidates:
+            return []
+        keys = np.fromiter(self.candidates, dtype=np.int64, count=len(self.candidates))
+        estimates = self.cms.estimate(keys)
+        return heapq.nlargest(n, zip(keys.tolist(), estimates.tolist()), key=lambda pair: pair[1])
+
+    def document(self):
+        return {
+            "hll": Binary(self.hll.registers.tobytes()),
+            "cms": Binary(self.cms.table.tobytes()),
+            "width": self.cms.width,
+            "depth": self.cms.depth,
+            "candidates": sorted(self.candidates),
+            "total": self.total,
+        }
+
+    @classmethod
+    def from_document(cls, doc):
+        registers = np.frombuffer(doc["hll"], dtype=np.uint8).copy()
+        table = np.frombuffer(doc["cms"], dtype=np.int64).reshape(doc["depth"], doc["width"]).copy()
+        sketch = cls(HyperLogLog(int(math.log2(len(registers))), registers),
+                     CountMinSketch(doc["width"], doc["depth"], table), doc["candidates"])
+        sketch.total = doc.get("total", 0)
+        return sketch
+
+
+def merged_sketch(db, name, match=None):
+    # One sketch merged from every document of `name` matching the filter (a day range)
+    sketch = ProductSketch()
+    for doc in db[SKETCHES].find({**(match or {}), "name": name}):
+        sketch.merge(ProductSketch.from_document(doc))
+    return sketch
+
+
+class SketchWriter:
+    """Per-day sketches updated with every landed batch and persisted every `flush_seconds`,
+    from apply() or, when traffic stops, from the consumer loop's persist_due().
+
+    Each writer persists under its own writer id, so consumer processes never overwrite each
+    other's counts. Days not updated for `idle_seconds` are dropped from memory after they are
+    persisted; a late event for one reloads the writer's document. When a writer starts a
+    sketch, it also claims the documents of that day that no writer has updated for longer
+    than a writer keeps a day in memory, left by restarted or stopped processes, and merges
+    them into its own; find_one_and_delete hands each to a single writer. The collection
+    therefore keeps about one document per day and live writer.
+
+    Events that land between the last persist and a crash are missing from the sketches, as
+    are claimed documents when the claiming writer crashes before its next persist, within
+    their error bounds; the exact rollups are unaffected.
+    """
+
+    def __init__(self, db, flush_seconds=SKETCH_FLUSH_SECONDS, idle_seconds=3600):
+        self.db = db
+        self.flush_seconds = flush_seconds
+        self.idle_seconds = idle_seconds
+        self.writer = uuid.uuid4().hex
+        self.sketches = {}  # (day, name) -> [ProductSketch, last update]
+        self.dirty = set()
+        self.persisted_at = time.monotonic()
+        self.lock = threading.Lock()  # Shared by the consumer's sink and the retry worker's
+
+    def apply(self, events):
+        keys = defaultdict(list)
+        counts = defaultdict(list)
+        for event in events:
+            day = event_day(event.get("timestamp"))
+            if event.get("event_type") == "add_to_cart":
+                keys[(day, ADDED)].append(event["product_id"])
+                counts[(day, ADDED)].append(1)
+            elif event.get("event_type") == "checkout":
+                for item in event.get("cart_items", []):
+                    keys[(day, SOLD)].append(item["product_id"])
+                    counts[(day, SOLD)].append(item["quantity"])
+        with self.lock:
+            now = time.monotonic()
+            for bucket, bucket_keys in keys.items():
+                entry = self.sketches.get(bucket)
+                if entry is None:
+                    entry = self.sketches[bucket] = [self._load(*bucket), now]
+                entry[0].add(bucket_keys, counts[bucket])
+                entry[1] = now
+                self.dirty.add(bucket)
+            if now - self.persisted_at >= self.flush_seconds:
+                self._persist(now)
+
+    def _document_id(self, day, name):
+        return f"{day}|{name}|{self.writer}"
+
+    def _load(self, day, name):
+        # The writer's own document when the day was dropped from memory, merged with the
+        # documents of writers that stopped updating it
+        doc = self.db[SKETCHES].find_one({"_id": self._document_id(day, name)})
+        sketch = ProductSketch.from_document(doc) if doc else ProductSketch()
+        abandoned_after = self.idle_seconds + self.flush_seconds
+        if math.isinf(abandoned_after):
+            return sketch  # A writer that keeps every day in memory, as rebuild() does
+        abandoned = {"day": day, "name": name, "writer": {"$ne": self.writer},
+                     "updated_at": {"$lt": datetime.utcnow() - timedelta(seconds=abandoned_after)}}
+        claimed = 0
+        while True:
+            doc = self.db[SKETCHES].find_one_and_delete(abandoned)
+            if doc is None:
+                break
+            sketch.merge(ProductSketch.from_document(doc))
+            claimed += 1
+        if claimed:
+            self.dirty.add((day, name))
+            log.info("Merged %d abandoned %s sketches of %s", claimed, name, day)
+        return sketch
+
+    def persist_due(self):
+        # Called between batches: persists on time even when no new events arrive
+        with self.lock:
+            now = time.monotonic()
+            if now - self.persisted_at >= self.flush_seconds:
+                self._persist(now)
+
+    def _persist(self, now):
+        requests = []
+        for day, name in self.dirty:
+            sketch = self.sketches[(day, name)][0]
+            doc = {"_id": self._document_id(day, name), "day": day, "name": name, "writer": self.writer,
+                   "updated_at": datetime.utcnow(), **sketch.document()}
+            requests.append(ReplaceOne({"_id": doc["_id"]}, doc, upsert=True))
+        if requests:
+            self.db[SKETCHES].bulk_write(requests, ordered=False)
+            log.debug("Persisted %d sketches", len(requests))
+        self.dirty.clear()
+        self.persisted_at = now
+        for bucket in [bucket for bucket, entry in self.sketches.items() if now - entry[1] >= self.idle_seconds]:
+            del self.sketches[bucket]
+
+    def close(self):
+        with self.lock:
+            self._persist(time.monotonic())
+
+
+def rebuild(db, activity_col, order_col, archived=(), chunk_size=10000):
+    # Replace the sketches with ones built from the raw collections and archived chunks.
+    # Run it with the consumer stopped, as `rollups.py rebuild`.
+    db[SKETCHES].delete_many({})
+    writer = SketchWriter(db, flush_seconds=float("inf"), idle_seconds=float("inf"))
+    for chunk in archived:
+        writer.apply(chunk)
+    for collection in (activity_col, order_col):
+        chunk = []
+        for event in collection.find({}, {"_id": 0}).batch_size(chunk_size):
+            chunk.append(event)
+            if len(chunk) >= chunk_size:
+                writer.apply(chunk)
+                chunk = []
+        writer.apply(chunk)
+    writer.close()
+    print(f"Rebuilt {SKETCHES}: {len(writer.sketches)} sketches")
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from pymongo.mongo_client import MongoClient
+    from pymongo.server_api import ServerApi
+    from rollups import archived_events
+
+    load_dotenv()
+    if sys.argv[1:] != ["rebuild"]:
+        print("Usage: python sketches.py rebuild")
+        sys.exit(2)
+    client = MongoClient(os.getenv("MONGODB_URL"), server_api=ServerApi('1'))
+    db = client[os.getenv('DB')]
+    rebuild(db, db[os.getenv('activity')], db[os.getenv('Order_col')], archived_events())
+    client.close()
@@ -0,0 +1,199 @@
+import argparse
+import os
+from functools import reduce
+
+from pyspark.sql import SparkSession, functions as F, types as T
+
+from catalog import products
+from rollups import CATEGORIES, DAILY, FUNNELS, PRODUCTS
+from sessions import SESSION_TIMEOUT_MINUTES
+
+# Batch recomputation of the dashboard rollups and session funnels with Spark, for histories
+# too large for `python rollups.py rebuild`. Results have the rollup documents' shape, so the
+# dashboard reads them unchanged once they are written back to MongoDB.
+
+SPARK_MASTER = os.getenv("SPARK_MASTER", "local[*]")
+SESSION_GAP = os.getenv("SESSION_GAP", f"{SESSION_TIMEOUT_MINUTES} minutes")  # Inactivity that closes a session
+MONGO_SPARK_PACKAGE = os.getenv("MONGO_SPARK_PACKAGE", "org.mongodb.spark:mongo-spark-connector_2.13:10.4.0")
+
+CART_ITEM = T.StructType([
+    T.StructField("product_id", T.LongType()),
+    T.StructField("product_name", T.StringType()),  # Only on events written before schema 2
+    T.StructField("quantity", T.LongType()),
+    T.StructField("price", T.DoubleType()),
+])
+
+# Every field either event type may carry; readers fill the missing ones with nulls
+EVENT_SCHEMA = T.StructType([
+    T.StructField("_id", T.StringType()),
+    T.StructField("event_id", T.StringType()),
+    T.StructField("event_type", T.StringType()),
+    T.StructField("session_id", T.StringType()),
+    T.StructField("product_id", T.LongType()),
+    T.StructField("product_name", T.StringType()),
+    T.StructField("category", T.StringType()),
+    T.StructField("price", T.DoubleType()),
+    T.StructField("timestamp", T.StringType()),
+    T.StructField("cart_items", T.ArrayType(CART_ITEM)),
+    T.StructField("total_price", T.DoubleType()),
+])
+
+
+def create_session(master=SPARK_MASTER, packages=None):
+    builder = (
+        SparkSession.builder.master(master)
+        .appName("customer_analytics")
+        .config("spark.sql.session.timeZone", "UTC")  # Event timestamps are naive UTC
+    )
+    if packages:
+        builder = builder.config("spark.jars.packages", packages)
+    return builder.getOrCreate()
+
+
+def read_events(spark, source, fmt):
+    # JSONL as written by `load_generator.py --sink file`, Parquet such as the archive's
+    # collection directories (comma-separated), or the live collections
+    if fmt == "jsonl":
+        return spark.read.schema(EVENT_SCHEMA).json(source)
+    if fmt == "parquet":
+        return union(spark.read.parquet(path) for path in source.split(","))
+    reader = spark.read.format("mongodb").option("connection.uri", os.getenv("MONGODB_URL"))
+    reader = reader.option("database", os.getenv("DB"))
+    activities = reader.option("collection", os.getenv("activity", "user_activities")).load()
+    orders = reader.option("collection", os.getenv("Order_col", "orders")).load()
+    return union([activities, orders])
+
+
+def union(frames):
+    # Activities and orders have different columns, the missing ones become nulls
+    return reduce(lambda left, right: left.unionByName(right, allowMissingColumns=True), frames)
+
+
+def normalize(events):
+    # One row per distinct event with a timestamp, day bucket and id, whatever the source
+    for field in EVENT_SCHEMA:
+        if field.name not in events.columns:
+            events = events.withColumn(field.name, F.lit(None).cast(field.dataType))
+    events = (
+        events.withColumn("event_key", F.coalesce(F.col("event_id"), F.col("_id").cast("string")))
+        .withColumn("timestamp", F.col("timestamp").cast("timestamp"))
+        .withColumn("day", F.date_format("timestamp", "yyyy-MM-dd"))
+    )
+    # Replays share an id; events exported without one are all kept
+    keyed = events.where(F.col("event_key").isNotNull()).dropDuplicates(["event_key"])
+    return keyed.unionByName(events.where(F.col("event_key").isNull()))
+
+
+def catalog_frame(spark):
+    # Small enough to broadcast to every executor
+    rows = [(product["id"], product["name"], product["category"]) for product in products]
+    return F.broadcast(spark.createDataFrame(rows, "product_id long, catalog_name string, catalog_category string"))
+
+
+def compute(events, catalog):
+    # DataFrames shaped like the rollup documents, keyed by collection name
+    activities = (
+        events.where(F.col("event_type") == "add_to_cart")
+        .join(catalog, "product_id", "left")
+        .withColumn("product_name", F.coalesce("catalog_name", "product_name"))
+        .withColumn("category", F.coalesce("catalog_category", "category"))
+    )
+    orders = events.where(F.col("event_type") == "checkout")
+    items = (
+        orders.select("day", F.explode("cart_items").alias("item"))
+        .select("day", "item.product_id", "item.quantity", "item.price", "item.product_name")
+        .join(catalog, "product_id", "left")
+        .withColumn("product_name", F.coalesce("catalog_name", "product_name"))
+    )
+
+    daily = (
+        orders.groupBy("day").agg(F.count("*").alias("orders"), F.sum("total_price").alias("revenue"))
+        .join(items.groupBy("day").agg(F.sum("quantity").alias("items_sold")), "day", "full")
+        .join(activities.groupBy("day").agg(F.count("*").alias("activities")), "day", "full")
+        .fillna(0)
+        .withColumn("_id", F.col("day"))
+    )
+
+    added = activities.groupBy("day", "product_id").agg(
+        F.count("*").alias("added_to_cart"), F.max("product_name").alias("added_name"))
+    sold = items.groupBy("day", "product_id").agg(
+        F.sum("quantity").alias("quantity_sold"),
+        F.sum(F.col("quantity") * F.col("price")).alias("revenue"),
+        F.max("product_name").alias("sold_name"),
+    )
+    product_days = (
+        added.join(sold, ["day", "product_id"], "full")
+        .withColumn("product_name", F.coalesce("added_name", "sold_name"))
+        .drop("added_name", "sold_name")
+        .fillna(0, subset=["added_to_cart", "quantity_sold", "revenue"])
+        .withColumn("_id", F.concat_ws("|", "day", F.col("product_id").cast("string")))
+    )
+
+    categories = (
+        activities.groupBy("day", "category")
+        .agg(F.count("*").alias("activities"), F.sum("price").alias("cart_value"))
+        .withColumn("_id", F.concat_ws("|", "day", F.coalesce("category", F.lit("None"))))
+    )
+
+    return {DAILY: daily, PRODUCTS: product_days, CATEGORIES: categories, FUNNELS: funnels(events)}
+
+
+def funnels(events):
+    # Sessions are a session_id's events split on SESSION_GAP of inactivity, counted on the day
+    # they started: every session, those that added to the cart, those that checked out
+    sessions = (
+        events.where(F.col("session_id").isNotNull())
+        .groupBy("session_id", F.session_window("timestamp", SESSION_GAP).alias("window"))
+        .agg(
+            F.max((F.col("event_type") == "add_to_cart").cast("int")).alias("carted"),
+            F.max((F.col("event_type") == "checkout").cast("int")).alias("checked_out"),
+        )
+        .withColumn("day", F.date_format("window.start", "yyyy-MM-dd"))
+    )
+    return (
+        sessions.groupBy("day")
+        .agg(F.count("*").alias("sessions"), F.sum("carted").alias("carts"), F.sum("checked_out").alias("checkouts"))
+        .withColumn("_id", F.col("day"))
+    )
+
+
+def write_parquet(results, output):
+    # The results are a few rows per day, one file per rollup is plenty
+    for name, df in results.items():
+        df.coalesce(1).write.mode("overwrite").parquet(os.path.join(output, name))
+        print(f"Wrote {output}/{name}")
+
+
+def write_mongo(results):
+    # Replace the rollup collections with the recomputed documents, as `rollups.py rebuild` does
+    from dotenv import load_dotenv
+    from pymongo.mongo_client import MongoClient
+    from pymongo.server_api import ServerApi
+    from rollups import write_rollups
+
+    load_dotenv()
+    client = MongoClient(os.getenv("MONGODB_URL"), server_api=ServerApi('1'))
+    rollups = {name: {row["_id"]: row.asDict() for row in df.collect()} for name, df in results.items()}
+    write_rollups(client[os.getenv('DB')], rollups)
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute dashboard rollups and session funnels with Spark.")
+    parser.add_argument("--input", help="Events export: a JSONL file/directory or Parquet directory")
+    parser.add_argument("--format", choices=["jsonl", "parquet", "mongodb"], default="jsonl")
+    parser.add_argument("--output", default="spark_results", help="Directory for the Parquet results")
+    parser.add_argument("--write-mongo", action="store_true",
+                        help="Replace the rollup collections; stop the consumer first")
+    parser.add_argument("--master", default=SPARK_MASTER)
+    args = parser.parse_args()
+    if args.format != "mongodb" and not args.input:
+        parser.error("--input is required unless --format mongodb")
+
+    spark = create_session(args.master, MONGO_SPARK_PACKAGE if args.format == "mongodb" else None)
+    events = normalize(read_events(spark, args.input, args.format)).cache()
+    results = compute(events, catalog_frame(spark))
+    write_parquet(results, args.output)
+    if args.write_mongo:
+        write_mongo(results)
+    spark.stop()
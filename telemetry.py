@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import sys
+import threading
+from collections import Counter
+
+try:
+    import prometheus_client
+except ImportError:  # prometheus_client is optional, metrics become no-ops without it
+    prometheus_client = None
+
+# Metrics, logging and profiling shared by the producer and the consumer
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # Local /metrics endpoint, 0 disables it
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text or json (one object per line)
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT")  # Collapsed stacks of the hot loop are written here when set
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 10))
+
+# Seconds, from sub-millisecond local writes to multi-second broker stalls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BATCH_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def set_function(self, f):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+def _metric(kind, name, documentation, labels=(), **kwargs):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labels, **kwargs)
+
+
+# Producer
+PRODUCED = _metric("Counter", "producer_events_total", "Events handed to the producer, by outcome",
+                   ["event_type", "outcome"])  # queued, dropped, delivered, failed
+PRODUCE_LATENCY = _metric("Histogram", "producer_delivery_seconds", "Time from emit() to the delivery report",
+                          buckets=LATENCY_BUCKETS)
+PRODUCER_QUEUE = _metric("Gauge", "producer_queue_depth", "Messages waiting to be produced or delivered",
+                         ["queue"])  # emitter: before produce(), librdkafka: awaiting delivery
+
+# Consumer
+CONSUMED = _metric("Counter", "consumer_events_total", "Events consumed, by outcome",
+                   ["event_type", "outcome"])  # stored, duplicate, rejected, retrying
+BATCH_SIZE = _metric("Histogram", "consumer_batch_size", "Documents per insert_many", buckets=BATCH_BUCKETS)
+POLL_TO_WRITE = _metric("Histogram", "consumer_poll_to_write_seconds",
+                        "Time the oldest event of a batch waited between poll and write", buckets=LATENCY_BUCKETS)
+WRITE_LATENCY = _metric("Histogram", "consumer_write_seconds", "Duration of one batch write, rollups included",
+                        buckets=LATENCY_BUCKETS)
+CONSUMER_LAG = _metric("Gauge", "consumer_lag_messages", "Messages behind the partition's high watermark",
+                       ["topic", "partition"])
+RETRY_PENDING = _metric("Gauge", "consumer_retry_pending_events", "Events waiting in the retry worker")
+
+
+def start_metrics_server(port=METRICS_PORT):
+    # Serve /metrics from a daemon thread; False when disabled or prometheus_client is missing
+    if not port:
+        return False
+    if prometheus_client is None:
+        logging.getLogger(__name__).warning("prometheus_client is not installed, metrics are disabled")
+        return False
+    prometheus_client.start_http_server(port)
+    logging.getLogger(__name__).info("Serving metrics on :%d/metrics", port)
+    return True
+
+
+def kafka_stats(stats_json):
+    # librdkafka `stats_cb`: per-partition consumer lag from the periodic statistics,
+    # so lag costs no extra broker calls. Enabled by `statistics.interval.ms`.
+    stats = json.loads(stats_json)
+    for topic, topic_stats in stats.get("topics", {}).items():
+        for partition, partition_stats in topic_stats.get("partitions", {}).items():
+            lag = partition_stats.get("consumer_lag", -1)
+            if partition != "-1" and lag >= 0:
+                CONSUMER_LAG.labels(topic, partition).set(lag)
+
+
+# Logging
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with any `extra=` fields as top-level keys."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    # Called once by each entry point; modules only do logging.getLogger(__name__)
+    handler = logging.StreamHandler(sys.stdout)
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+
+
+# Profiling
+class SamplingProfiler:
+    """Samples one thread's stack every `interval` seconds from a background thread.
+
+    The sampled thread runs unmodified, so the overhead is the sampling thread's share of the
+    GIL and does not grow with the event rate. Stacks are written in the collapsed format
+    ("outer;inner count") read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, output, interval=PROFILE_INTERVAL_MS / 1000, thread_id=None):
+        self.output = output
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        with open(self.output, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logging.getLogger(__name__).info("Wrote %d profile samples to %s", sum(self.stacks.values()), self.output)
+
+
+class _NoProfiler:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def profiled(output=PROFILE_OUTPUT):
+    # Wrap a hot loop: samples it when PROFILE_OUTPUT is set, does nothing otherwise
+    return SamplingProfiler(output) if output else _NoProfiler()
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pandas as pd
+import pytest
+
+from fakes import load_database
+from test_metrics import pandas_metrics, recent, stored_events
+from analytics import RollupMetrics, SketchMetrics
+from archive import ArchiveReader, archive_collection
+
+CUTOFF = datetime.utcnow() - timedelta(days=10)
+RANGES = {
+    "archived": (CUTOFF - timedelta(days=7), CUTOFF),
+    "across the cutoff": (CUTOFF - timedelta(days=7), CUTOFF + timedelta(hours=1)),
+}
+
+
+@pytest.mark.parametrize("backend", [RollupMetrics, SketchMetrics])
+@pytest.mark.parametrize("range_name", RANGES)
+def test_recent_tables_continue_into_the_archive(tmp_path, backend, range_name):
+    db = load_database(stored_events(3000), mongomock.MongoClient().db)
+    # What the pandas backend shows, hot and archived events together
+    expected = pandas_metrics(db, RANGES[range_name])
+    for collection in (db.user_activities, db.orders):
+        archive_collection(collection, root=str(tmp_path), cutoff=CUTOFF)
+    assert db.user_activities.count_documents({"timestamp": {"$lt": CUTOFF}}) == 0
+
+    metrics = backend(db, RANGES[range_name], archive=ArchiveReader(str(tmp_path)))
+    assert len(metrics.recent_activities(10)) == 10
+    columns = ["timestamp", "product_id", "product_name", "category", "price"]
+    pd.testing.assert_frame_equal(recent(metrics.recent_activities(10), columns),
+                                  recent(expected.recent_activities(10), columns), check_dtype=False)
+    columns = ["timestamp", "total_price", "product_id", "product_name", "quantity", "price"]
+    pd.testing.assert_frame_equal(recent(metrics.recent_orders(10), columns),
+                                  recent(expected.recent_orders(10), columns), check_dtype=False)
+
+
+def test_recent_tables_without_an_archive_show_hot_events_only(tmp_path):
+    db = load_database(stored_events(3000), mongomock.MongoClient().db)
+    archive_collection(db.user_activities, root=str(tmp_path), cutoff=CUTOFF)
+    assert RollupMetrics(db, RANGES["archived"]).recent_activities(10).empty
@@ -0,0 +1,40 @@
+import os
+import uuid
+
+import pytest
+
+from fakes import load_database, random_events
+from bootstrap import check_index_usage, ensure_indexes, migrate_timestamps, winning_stages
+
+MONGODB_URL = os.getenv("MONGODB_URL")
+
+
+def test_winning_stages_reads_find_and_aggregate_plans():
+    fetch = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "timestamp_-1"}}
+    assert winning_stages({"queryPlanner": {"winningPlan": fetch}}) == ["FETCH", "IXSCAN"]
+    aggregate = {"stages": [{"$cursor": {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}}]}
+    assert winning_stages(aggregate) == ["COLLSCAN"]
+
+
+@pytest.fixture
+def db():
+    # A throwaway database on the deployment MONGODB_URL points at, explain() needs a real server
+    if not MONGODB_URL:
+        pytest.skip("MONGODB_URL is not set")
+    from pymongo import MongoClient
+
+    client = MongoClient(MONGODB_URL, serverSelectionTimeoutMS=5000)
+    name = f"test_bootstrap_{uuid.uuid4().hex[:8]}"
+    yield client[name]
+    client.drop_database(name)
+    client.close()
+
+
+def test_dashboard_queries_use_the_indexes(db):
+    load_database(random_events(2000), db)
+    # Stored as the consumer stores them, with BSON date timestamps
+    migrate_timestamps(db.user_activities)
+    migrate_timestamps(db.orders)
+    ensure_indexes(db.user_activities, db.orders)
+
+    assert check_index_usage(db.user_activities, db.orders) == []
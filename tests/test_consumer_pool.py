@@ -0,0 +1,14 @@
+from bench_consumer_pool import rebalance
+
+
+def test_a_rebalance_stores_every_event_exactly_once():
+    # The revoked worker flushes and commits what it buffered, so nothing is consumed twice
+    delivered, stored = rebalance(2000)
+    assert delivered == 2000
+    assert stored == 2000
+
+
+def test_without_the_revoke_callback_buffered_events_are_redelivered():
+    delivered, stored = rebalance(2000, flush_on_revoke=False)
+    assert delivered > 2000
+    assert stored == 2000  # Deduplicated by _id
@@ -0,0 +1,111 @@
+import os
+
+import mongomock
+import pytest
+from pymongo.errors import AutoReconnect
+
+from fakes import FakeConsumer, FakeMessage, sample_messages
+import consumer
+from dlq import FileDLQ, MemoryDLQ, RetryWorker, dead_letter, read_dead_letters, replay
+from sink import BatchSink
+
+N_EVENTS = 2000
+POISON = [b"\xff not an event", b"123", b"[1, 2]", b'{"event_type": [1]}', b'{"event_type": "refund"}']
+
+
+class FailingCollection:
+    # Wraps a mongomock collection; every `every`-th insert_many fails before writing anything
+    def __init__(self, collection, every=0):
+        self.collection = collection
+        self.every = every
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def insert_many(self, docs, ordered=True):
+        self.calls += 1
+        if self.every and self.calls % self.every == 0:
+            raise AutoReconnect("simulated connection reset")
+        return self.collection.insert_many(docs, ordered=ordered)
+
+
+def poisoned_messages(n, every=20):
+    # Every `every`-th message replaced by a payload that cannot be stored
+    messages = sample_messages(n)
+    bad = range(0, n, every)
+    for k, i in enumerate(bad):
+        messages[i] = FakeMessage(POISON[k % len(POISON)], offset=i)
+    return messages, len(bad)
+
+
+def stored(db):
+    return db.user_activities.count_documents({}) + db.orders.count_documents({})
+
+
+@pytest.fixture
+def dlq_path(tmp_path):
+    return str(tmp_path / "dlq.jsonl")
+
+
+@pytest.mark.parametrize("retry", [False, True])
+def test_every_event_is_stored_or_dead_lettered(dlq_path, retry):
+    db = mongomock.MongoClient().db
+    collections = {"add_to_cart": FailingCollection(db.user_activities, every=7),
+                   "checkout": FailingCollection(db.orders, every=5)}
+    dlq = FileDLQ(dlq_path)
+    retries = RetryWorker(BatchSink(collections, dlq=dlq), dlq, base_delay=0.01, max_delay=0.05) if retry else None
+    sink = BatchSink(collections, batch_size=100, dlq=dlq, retries=retries, retry_base_delay=0.01,
+                     retry_max_delay=0.05)
+    messages, n_bad = poisoned_messages(N_EVENTS)
+    fake = FakeConsumer(messages)
+
+    consumer.run(fake, sink, should_stop=lambda: fake.exhausted, drain_timeout=10)
+    sink.close()
+
+    dead = read_dead_letters(dlq_path)
+    assert stored(db) + len(dead) == N_EVENTS
+    assert stored(db) == N_EVENTS - n_bad
+    assert fake.committed == N_EVENTS
+
+
+def test_replay_resolves_the_dead_letters(dlq_path):
+    # Orders cannot be written at all: the shutdown dead-letters them, a replay stores them
+    db = mongomock.MongoClient().db
+    down = {"add_to_cart": db.user_activities, "checkout": FailingCollection(db.orders, every=1)}
+    sink = BatchSink(down, batch_size=100, dlq=FileDLQ(dlq_path), retry_base_delay=0.01, retry_max_delay=0.05)
+    fake = FakeConsumer(sample_messages(N_EVENTS))
+    consumer.run(fake, sink, should_stop=lambda: fake.exhausted, drain_timeout=0.2)
+    assert db.orders.count_documents({}) == 0
+    assert len(read_dead_letters(dlq_path)) == N_EVENTS // 2
+
+    healthy = BatchSink({"add_to_cart": db.user_activities, "checkout": db.orders}, dlq=MemoryDLQ())
+    replayed, remaining = replay(healthy, dlq_path)
+
+    assert replayed["shutdown"] == N_EVENTS // 2
+    assert remaining == []
+    assert read_dead_letters(dlq_path) == []
+    assert stored(db) == N_EVENTS
+    assert not os.path.exists(f"{dlq_path}.replaying")
+
+
+def test_replay_resumes_an_interrupted_replay(dlq_path):
+    # A replay that died after claiming the file left it renamed; the consumer has appended
+    # a new dead letter to the live file since
+    claimed = FileDLQ(f"{dlq_path}.replaying")
+    live = FileDLQ(dlq_path)
+    for i, message in enumerate(sample_messages(10)):
+        record = dead_letter("write_error", "simulated", msg=message)
+        (claimed if i < 9 else live).put(record)
+    claimed.flush()
+    live.flush()
+
+    db = mongomock.MongoClient().db
+    sink = BatchSink({"add_to_cart": db.user_activities, "checkout": db.orders}, dlq=MemoryDLQ())
+    replayed, remaining = replay(sink, dlq_path)
+
+    assert replayed["write_error"] == 9 and remaining == []
+    assert stored(db) == 9
+    assert not os.path.exists(f"{dlq_path}.replaying")
+    # The dead letter written meanwhile is still there for the next replay
+    assert [record["source"]["offset"] for record in read_dead_letters(dlq_path)] == [9]
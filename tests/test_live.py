@@ -0,0 +1,27 @@
+import time
+from datetime import datetime
+
+import mongomock
+
+from live import LiveAggregates, start_live_feed
+
+
+def test_events_stored_while_seeding_reach_the_feed(monkeypatch):
+    db = mongomock.MongoClient().db
+    seed = LiveAggregates.seed
+
+    def slow_seed(aggregates, db):
+        # The consumer stores an event while the seed runs, its rollups are not updated yet
+        db.orders.insert_one({"_id": "during-seed", "event_type": "checkout", "timestamp": datetime.utcnow(),
+                              "ingested_at": datetime.utcnow(), "cart_items": [], "total_price": 5.0})
+        seed(aggregates, db)
+
+    monkeypatch.setattr(LiveAggregates, "seed", slow_seed)
+    feed = start_live_feed(db, source="poll")
+    try:
+        deadline = time.monotonic() + 5
+        while feed.aggregates.key_metrics()["total_orders"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        feed.close()
+    assert feed.aggregates.key_metrics()["total_orders"] == 1
@@ -0,0 +1,164 @@
+import os
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import mongomock
+import pandas as pd
+import pytest
+
+from fakes import load_database, random_events
+from analytics import MongoMetrics, PandasMetrics, funnel_summary
+from sessions import SESSION_STATE, SESSION_TIMEOUT_MINUTES, SessionAggregator
+
+MONGODB_URL = os.getenv("MONGODB_URL")
+BACKENDS = ["mongomock", "mongodb"]
+
+
+def stored_events(n):
+    # Events as the consumer stores them, with BSON date timestamps
+    events = random_events(n, seed=1)
+    for event in events:
+        event["timestamp"] = datetime.fromisoformat(event["timestamp"])
+    return events
+
+
+@pytest.fixture(params=BACKENDS)
+def db(request):
+    if request.param == "mongomock":
+        yield mongomock.MongoClient().db
+        return
+    if not MONGODB_URL:
+        pytest.skip("MONGODB_URL is not set")
+    from pymongo import MongoClient
+
+    client = MongoClient(MONGODB_URL, serverSelectionTimeoutMS=5000)
+    name = f"test_metrics_{uuid.uuid4().hex[:8]}"
+    yield client[name]
+    client.drop_database(name)
+    client.close()
+
+
+def pandas_metrics(db, date_range=None):
+    # What the pandas backend computes from the loaded frames
+    activity_df = pd.DataFrame(list(db.user_activities.find({}, {"_id": 0})))
+    order_df = pd.DataFrame(list(db.orders.find({}, {"_id": 0})))
+    if date_range is not None:
+        start, end = date_range
+        activity_df = activity_df[(activity_df["timestamp"] >= start) & (activity_df["timestamp"] < end)]
+        order_df = order_df[(order_df["timestamp"] >= start) & (order_df["timestamp"] < end)]
+    return PandasMetrics(activity_df.reset_index(drop=True), order_df.reset_index(drop=True))
+
+
+def as_dict(df, key, value):
+    return dict(zip(df[key], df[value].astype("int64")))
+
+
+def recent(df, columns):
+    df = df.reset_index(drop=True)
+    return df.reindex(columns=columns).assign(timestamp=pd.to_datetime(df["timestamp"]).astype("datetime64[ms]"))
+
+
+RANGES = {
+    "all": None,
+    "last week": (datetime.utcnow() - timedelta(days=7), datetime.utcnow() + timedelta(days=1)),
+}
+
+
+@pytest.mark.parametrize("range_name", RANGES)
+def test_aggregation_pipelines_match_pandas(db, range_name):
+    load_database(stored_events(3000), db)
+    date_range = RANGES[range_name]
+    mongo, pandas = MongoMetrics(db, date_range), pandas_metrics(db, date_range)
+
+    got, expected = mongo.key_metrics(), pandas.key_metrics()
+    assert expected["total_orders"] > 0 and expected["total_activities"] > 0
+    assert got["total_revenue"] == pytest.approx(expected["total_revenue"])
+    for field in ("total_orders", "total_activities", "unique_products"):
+        assert got[field] == expected[field]
+
+    assert as_dict(mongo.product_distribution(), "product_name", "count") == \
+        as_dict(pandas.product_distribution(), "product_name", "count")
+    assert as_dict(mongo.category_distribution(), "category", "count") == \
+        as_dict(pandas.category_distribution(), "category", "count")
+    # The whole catalog, so products tied at the cut-off cannot make the two differ
+    assert as_dict(mongo.top_products(100), "product_name", "total_quantity") == \
+        as_dict(pandas.top_products(100), "product_name", "total_quantity")
+
+    assert len(mongo.recent_activities(10)) == 10
+    columns = ["timestamp", "product_id", "product_name", "category", "price"]
+    pd.testing.assert_frame_equal(recent(mongo.recent_activities(10), columns),
+                                  recent(pandas.recent_activities(10), columns), check_dtype=False)
+    columns = ["timestamp", "total_price", "product_id", "product_name", "quantity", "price"]
+    pd.testing.assert_frame_equal(recent(mongo.recent_orders(10), columns),
+                                  recent(pandas.recent_orders(10), columns), check_dtype=False)
+
+
+def test_daily_orders_match_pandas(db):
+    if isinstance(db, mongomock.Database):
+        pytest.skip("mongomock lacks $dateTrunc")
+    load_database(stored_events(3000), db)
+    mongo, pandas = MongoMetrics(db).daily_orders(), pandas_metrics(db).daily_orders()
+    assert as_dict(mongo, "date", "count") == as_dict(pandas, "date", "count")
+
+
+def shopper_events(n_shoppers, seed=0):
+    # Shoppers coming back a few times over a week, some visits ending in a checkout, in time order
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    events = []
+    for shopper in range(n_shoppers):
+        visit = start + timedelta(seconds=rng.uniform(0, 7 * 86400))
+        for _ in range(rng.randint(1, 3)):
+            timestamp = visit
+            for _ in range(rng.randint(1, 4)):
+                timestamp += timedelta(minutes=rng.uniform(0.5, 10))
+                events.append({"event_type": "add_to_cart", "session_id": f"s{shopper}", "timestamp": timestamp,
+                               "product_id": 1, "price": 10.0})
+            if rng.random() < 0.33:
+                timestamp += timedelta(minutes=rng.uniform(0.5, 10))
+                events.append({"event_type": "checkout", "session_id": f"s{shopper}", "timestamp": timestamp,
+                               "cart_items": [], "total_price": 10.0})
+            visit = timestamp + timedelta(hours=rng.uniform(0.6, 48))
+    return sorted(events, key=lambda event: event["timestamp"])
+
+
+def batch_funnel(events):
+    # Sessions split on SESSION_TIMEOUT_MINUTES of inactivity, as spark_job.py does
+    df = pd.DataFrame(events).sort_values(["session_id", "timestamp"])
+    gap = df["timestamp"].diff() >= timedelta(minutes=SESSION_TIMEOUT_MINUTES)
+    df["session"] = (gap | (df["session_id"] != df["session_id"].shift())).cumsum()
+    sessions = df.groupby("session")["event_type"].agg(set)
+    return [len(sessions), sum("add_to_cart" in types for types in sessions),
+            sum("checkout" in types for types in sessions)]
+
+
+def test_funnel_matches_a_batch_sessionization(db):
+    events = shopper_events(500)
+    aggregator = SessionAggregator(db)
+    for i in range(0, len(events), 100):
+        aggregator.apply(events[i:i + 100])
+    aggregator.watermark = datetime.max  # End of the stream: close whatever is still open
+    aggregator.expire()
+
+    assert funnel_summary(db)["count"].tolist() == batch_funnel(events)
+
+
+def test_pool_workers_restore_each_checkpoint_once(db):
+    events = shopper_events(200)
+    half = events[:len(events) // 2]
+    aggregator = SessionAggregator(db)
+    aggregator.apply(half)
+    open_sessions = len(aggregator.open)
+    aggregator.close()
+    assert db[SESSION_STATE].count_documents({}) == open_sessions
+
+    workers = [SessionAggregator(db) for _ in range(3)]
+    for worker in workers:
+        worker.restore()
+    assert sum(len(worker.open) for worker in workers) == open_sessions
+    assert db[SESSION_STATE].count_documents({}) == 0
+    for worker in workers:
+        worker.watermark = datetime.max
+        worker.expire()
+    assert funnel_summary(db)["count"].tolist() == batch_funnel(half)
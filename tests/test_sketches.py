@@ -0,0 +1,70 @@
+import math
+from datetime import datetime, timedelta
+
+import mongomock
+import pandas as pd
+
+from fakes import zipf_add_to_cart
+from sketches import ADDED, CMS_WIDTH, HLL_PRECISION, SKETCHES, SketchWriter, merged_sketch
+
+FIRST_DAY = datetime(2025, 1, 1)
+
+
+def test_estimates_stay_within_their_bounds_of_pandas():
+    events = zipf_add_to_cart(200_000, 100_000, 7, FIRST_DAY)
+    db = mongomock.MongoClient().db
+    writer = SketchWriter(db, flush_seconds=float("inf"))
+    for i in range(0, len(events), 500):
+        writer.apply(events[i:i + 500])
+    writer.close()
+
+    sketch = merged_sketch(db, ADDED)
+    counts = pd.Series([event["product_id"] for event in events]).value_counts()
+    assert abs(sketch.distinct() / len(counts) - 1) <= 3 * 1.04 / math.sqrt(1 << HLL_PRECISION)
+    top = sketch.top(10)
+    for key, estimate in top:
+        assert 0 <= estimate - counts[key] <= math.e / CMS_WIDTH * len(events)
+    assert [key for key, _ in top[:5]] == counts.index[:5].tolist()
+
+
+def day_events(n, product_id=1, day=FIRST_DAY):
+    return [{"event_type": "add_to_cart", "product_id": product_id, "timestamp": day}] * n
+
+
+def test_restarted_writers_fold_their_predecessors_documents():
+    db = mongomock.MongoClient().db
+    for _ in range(3):
+        writer = SketchWriter(db, flush_seconds=0)
+        writer.apply(day_events(10))
+        writer.close()
+        # The process stopped two hours ago, longer than a writer keeps a day in memory
+        db[SKETCHES].update_many({}, {"$set": {"updated_at": datetime.utcnow() - timedelta(hours=2)}})
+    assert db[SKETCHES].count_documents({}) == 1
+    assert merged_sketch(db, ADDED).total == 30
+
+
+def test_live_writers_keep_their_own_documents():
+    db = mongomock.MongoClient().db
+    first, second = SketchWriter(db, flush_seconds=0), SketchWriter(db, flush_seconds=0)
+    first.apply(day_events(10))
+    second.apply(day_events(5))
+    assert db[SKETCHES].count_documents({}) == 2
+    assert merged_sketch(db, ADDED).total == 15
+
+
+def test_a_late_event_resumes_the_writers_document():
+    db = mongomock.MongoClient().db
+    writer = SketchWriter(db, flush_seconds=0, idle_seconds=0)
+    writer.apply(day_events(10))
+    assert not writer.sketches  # Dropped from memory once persisted
+    writer.apply(day_events(1))
+    assert db[SKETCHES].count_documents({}) == 1
+    assert merged_sketch(db, ADDED).total == 11
+
+
+def test_other_days_are_left_alone():
+    db = mongomock.MongoClient().db
+    SketchWriter(db, flush_seconds=0).apply(day_events(10))
+    db[SKETCHES].update_many({}, {"$set": {"updated_at": datetime.utcnow() - timedelta(hours=2)}})
+    SketchWriter(db, flush_seconds=0).apply(day_events(5, day=FIRST_DAY + timedelta(days=1)))
+    assert db[SKETCHES].count_documents({}) == 2